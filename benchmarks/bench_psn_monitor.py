@@ -0,0 +1,728 @@
+#!/usr/bin/env python3
+"""
+Author: Michal Szymanski <misiektoja-github@rm-rf.ninja>
+v1.8.2
+
+Benchmark suite for psn_monitor hot paths and startup:
+https://github.com/misiektoja/psn_monitor/
+
+Covers the pure helpers used on every poll (presence parsing, string normalization, date formatting,
+exception classification), CSV and email sinks (against a local SMTP sink), event output of a poll cycle
+in interactive and headless mode, end-to-end polling cycles against the local fake PSN server
+(tools/psn_fake_server.py) plus import and startup time of psn_monitor (checked against the startup budget
+defined in STARTUP_BUDGETS on top of the measured interpreter start and compilation time).
+
+Results are stored as JSON in benchmarks/results/ (one file per run, ignored by git) so regressions
+between releases are visible. Compare a run against an older one with --compare.
+
+Usage:
+    python3 benchmarks/bench_psn_monitor.py
+    python3 benchmarks/bench_psn_monitor.py -k format --quick
+    python3 benchmarks/bench_psn_monitor.py --compare benchmarks/results/1.8.2_20260101-120000.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import re
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(REPO_DIR / "tools"))
+
+# Timezone used by the date formatting benchmarks
+BENCH_TIMEZONE = "Europe/Warsaw"
+
+# Relative slowdown reported as regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+# Startup budget (median, in seconds) for the startup benchmarks, allowed on top of the startup floor measured in the
+# same run (see measure_startup_floor()), so it holds on slow and fast machines alike; heavy dependencies are imported
+# lazily (together they take well over 200 ms) so importing the module and the --version / --generate-config fast
+# paths must stay within it
+STARTUP_BUDGETS = {
+    "import_psn_monitor": 0.100,
+    "startup_version": 0.100,
+    "startup_generate_config": 0.100,
+}
+
+# Startup floor in seconds (interpreter start and compilation of psn_monitor.py), measured once per run
+STARTUP_FLOOR = {}
+
+BENCHMARKS = []
+
+
+# Registers a benchmark function; setup (optional) returns the argument passed to the benchmark
+def benchmark(name, group, setup=None, teardown=None, number=None):
+    def wrap(func):
+        BENCHMARKS.append({"name": name, "group": group, "func": func, "setup": setup, "teardown": teardown, "number": number})
+        return func
+    return wrap
+
+
+# Skips a benchmark with the given reason
+class BenchmarkSkipped(Exception):
+    pass
+
+
+# Imports psn_monitor configured for benchmarking, skipping when its dependencies are missing
+def load_psn_monitor():
+    try:
+        import psn_monitor
+    except (ImportError, SystemExit) as e:
+        raise BenchmarkSkipped(f"cannot import psn_monitor: {e}")
+    psn_monitor.LOCAL_TIMEZONE = BENCH_TIMEZONE
+    return psn_monitor
+
+
+# Runs func(arg) repeatedly and returns per-call timing stats in seconds; cpu_median is the CPU time of the calling
+# thread only, so work done by the fake PSN server thread in end-to-end benchmarks is not counted
+def time_callable(func, arg, min_time=0.2, repeat=5, number=None):
+    if number is None:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                func(arg)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / 5 or number >= 1_000_000:
+                break
+            number *= 10
+    samples = []
+    cpu_samples = []
+    for _ in range(repeat):
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        samples.append((time.perf_counter() - start) / number)
+        cpu_samples.append((time.thread_time() - cpu_start) / number)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "cpu_median": statistics.median(cpu_samples),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+# ---------- sample data ----------
+
+PRESENCE_ONLINE = {
+    "basicPresence": {
+        "availability": "availableToPlay",
+        "primaryPlatformInfo": {"onlineStatus": "online", "platform": "PS5", "lastOnlineDate": "2026-10-18T20:12:44.123Z"},
+        "gameTitleInfoList": [{"npTitleId": "PPSA01487_00", "titleName": "ELDEN RING™ Shadow of the Erdtree", "format": "PS5", "launchPlatform": "PS5"}],
+    }
+}
+
+PRESENCE_OFFLINE = {
+    "basicPresence": {
+        "availability": "unavailable",
+        "primaryPlatformInfo": {"onlineStatus": "offline", "platform": "PS4", "lastOnlineDate": "2026-10-18T20:12:44.123Z"},
+    }
+}
+
+PRESENCE_ONLINE_OTHER_GAME = {
+    "basicPresence": {
+        "availability": "availableToPlay",
+        "primaryPlatformInfo": {"onlineStatus": "online", "platform": "PS5", "lastOnlineDate": "2026-10-18T20:12:44.123Z"},
+        "gameTitleInfoList": [{"npTitleId": "PPSA03420_00", "titleName": "Gran Turismo® 7", "format": "PS5", "launchPlatform": "PS5"}],
+    }
+}
+
+GAME_NAMES = [
+    "Marvel’s Spider-Man 2",
+    "Gran Turismo® 7",
+    "The Last of Us™ Part I – Remastered",
+    "Astro’s  Playroom ",
+    "Plain ASCII Title",
+]
+
+TS1 = 1760800000
+TS2 = TS1 + 3 * 3600 + 17 * 60 + 42
+
+
+# ---------- hot paths ----------
+
+@benchmark("parse_presence_online", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_parse_presence_online(pm):
+    pm.parse_presence(PRESENCE_ONLINE)
+
+
+@benchmark("parse_presence_offline", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_parse_presence_offline(pm):
+    pm.parse_presence(PRESENCE_OFFLINE)
+
+
+@benchmark("normalize_ascii", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_normalize_ascii(pm):
+    for name in GAME_NAMES:
+        pm.normalize_ascii(name)
+
+
+# Returns a fresh timestamp on every call, so memoized formatting is measured on cache misses (like new events)
+def next_ts(state={"ts": TS1}):
+    state["ts"] += 1
+    return state["ts"]
+
+
+@benchmark("calculate_timespan_int", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_calculate_timespan(pm):
+    ts = next_ts()
+    pm.calculate_timespan(ts + 11862, ts)
+
+
+@benchmark("calculate_timespan_no_seconds", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_calculate_timespan_no_seconds(pm):
+    ts = next_ts()
+    pm.calculate_timespan(ts + 11862, ts, show_seconds=False)
+
+
+@benchmark("get_date_from_ts", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_get_date_from_ts(pm):
+    pm.get_date_from_ts(next_ts())
+
+
+@benchmark("get_date_from_ts_memoized", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_get_date_from_ts_memoized(pm):
+    pm.get_date_from_ts(TS1)
+
+
+@benchmark("get_range_of_dates_from_tss_short", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_get_range_short(pm):
+    ts = next_ts()
+    pm.get_range_of_dates_from_tss(ts, ts + 11862, short=True)
+
+
+@benchmark("get_range_of_dates_from_tss_long", "hot_paths", setup=lambda: load_psn_monitor())
+def bench_get_range_long(pm):
+    ts = next_ts()
+    pm.get_range_of_dates_from_tss(ts, ts + 98262)
+
+
+# Formats all strings needed for one online -> offline status change (console, email subject and body)
+@benchmark("format_status_change_event", "formatting", setup=lambda: load_psn_monitor())
+def bench_format_status_change_event(pm):
+    status_ts_old = next_ts()
+    online_start_ts = status_ts_old - 1800
+    status_ts = status_ts_old + 11862
+    pm.calculate_timespan(status_ts, status_ts_old)
+    pm.get_range_of_dates_from_tss(status_ts_old, status_ts, short=True)
+    pm.calculate_timespan(status_ts, status_ts_old, show_seconds=False)
+    pm.get_range_of_dates_from_tss(status_ts_old, status_ts, short=True)
+    pm.calculate_timespan(status_ts, online_start_ts, show_seconds=False)
+    pm.get_range_of_dates_from_tss(online_start_ts, status_ts, short=True)
+    pm.calculate_timespan(status_ts, online_start_ts, show_seconds=False)
+    pm.get_range_of_dates_from_tss(online_start_ts, status_ts, short=True)
+    pm.get_range_of_dates_from_tss(status_ts_old, status_ts, short=True)
+    pm.calculate_timespan(status_ts, status_ts_old)
+    pm.get_cur_ts("Timestamp: ")
+
+
+# Builds a set of chained exceptions similar to the ones raised by requests/PSNAWP
+def make_exceptions(pm):
+    def chained(outer, inner):
+        try:
+            try:
+                raise inner
+            except Exception as e:
+                raise outer from e
+        except Exception as e:
+            return e
+    return [
+        chained(RuntimeError("HTTPSConnectionPool: Max retries exceeded"), ConnectionResetError(104, "Connection reset by peer")),
+        pm.PsnMalformedResponse("malformed presence response: basicPresence is list"),
+        Exception("Read timed out. (read timeout=15)"),
+        Exception("Your npsso code has expired or is incorrect. Please generate a new code!"),
+        chained(KeyError("basicPresence"), ValueError("weird")),
+    ]
+
+
+@benchmark("classify_psn_exception", "hot_paths", setup=lambda: make_exceptions(load_psn_monitor()))
+def bench_classify(excs):
+    import psn_monitor
+    for e in excs:
+        psn_monitor.classify_psn_exception(e)
+
+
+# ---------- sinks ----------
+
+def setup_csv():
+    pm = load_psn_monitor()
+    tmpdir = tempfile.mkdtemp(prefix="psn_bench_")
+    path = os.path.join(tmpdir, "bench.csv")
+    pm.init_csv_file(path)
+    return (pm, path, tmpdir)
+
+
+def teardown_csv(ctx):
+    import shutil
+    shutil.rmtree(ctx[2], ignore_errors=True)
+
+
+@benchmark("write_csv_entry", "sinks", setup=setup_csv, teardown=teardown_csv)
+def bench_write_csv(ctx):
+    pm, path, _ = ctx
+    pm.write_csv_entry(path, "2026-10-19 12:00:00", "online", "ELDEN RING Shadow of the Erdtree")
+
+
+# Minimal SMTP sink accepting any login and discarding messages
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self.reply("220 localhost psn_monitor benchmark sink")
+        in_data = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line in (b".\r\n", b".\n"):
+                    in_data = False
+                    self.server.messages += 1
+                    self.reply("250 OK queued")
+                continue
+            cmd = line.decode("ascii", "replace").strip().upper()
+            if cmd.startswith("EHLO"):
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif cmd.startswith("HELO"):
+                self.reply("250 localhost")
+            elif cmd.startswith("AUTH PLAIN"):
+                if cmd == "AUTH PLAIN":
+                    self.reply("334 ")
+                    self.rfile.readline()
+                self.reply("235 Authentication successful")
+            elif cmd.startswith("AUTH LOGIN"):
+                self.reply("334 VXNlcm5hbWU6")
+                self.rfile.readline()
+                self.reply("334 UGFzc3dvcmQ6")
+                self.rfile.readline()
+                self.reply("235 Authentication successful")
+            elif cmd.startswith("DATA"):
+                in_data = True
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+            elif cmd.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+# Starts the SMTP sink on a random local port
+def start_smtp_sink():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPSinkHandler)
+    server.daemon_threads = True
+    server.messages = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def setup_email():
+    pm = load_psn_monitor()
+    sink = start_smtp_sink()
+    pm.SMTP_HOST = "127.0.0.1"
+    pm.SMTP_PORT = sink.server_address[1]
+    pm.SMTP_USER = "bench"
+    pm.SMTP_PASSWORD = "bench"
+    pm.SENDER_EMAIL = "bench@example.com"
+    pm.RECEIVER_EMAIL = "bench@example.com"
+    return (pm, sink)
+
+
+def teardown_email(ctx):
+    ctx[1].shutdown()
+    ctx[1].server_close()
+
+
+@benchmark("send_email_smtp_sink", "sinks", setup=setup_email, teardown=teardown_email, number=20)
+def bench_send_email(ctx):
+    pm, _ = ctx
+    body = "PSN user bench changed status from offline to online\n\nUser was offline for 3 hours, 17 minutes\n\nTimestamp: Sun 19 Oct 2026, 12:00:00"
+    if pm.send_email("PSN user bench is now online", body, "", False, smtp_timeout=5) != 0:
+        raise RuntimeError("send_email() failed against the local SMTP sink")
+
+
+# ---------- event output: interactive vs headless ----------
+
+# Presences of one output cycle: the user gets online playing a game, changes the game and gets offline
+CYCLE_PRESENCES = [PRESENCE_ONLINE, PRESENCE_ONLINE_OTHER_GAME, PRESENCE_OFFLINE]
+
+
+# Prepares a monitored user whose events are written to NDJSON; interactive mode also renders them to the console
+# (discarded) and the log file like a terminal session, headless mode (HEADLESS_MODE) only emits them to the sinks
+def setup_output_cycle(headless):
+    pm = load_psn_monitor()
+    tmpdir = tempfile.mkdtemp(prefix="psn_bench_")
+    pm.STATE_STORE_FILE = ""
+    pm.NDJSON_FILE = os.path.join(tmpdir, "bench.ndjson")
+    pm.HEADLESS_MODE = headless
+    if headless:
+        output = pm.NullOutput()
+    else:
+        output = pm.Logger(os.path.join(tmpdir, "bench.log"))
+        output.terminal = open(os.devnull, "w", encoding="utf-8")
+    state = pm.new_user_state("bench_player", "")
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        pm.start_user_state(state, "offline", "", "", TS1, TS1)
+    finally:
+        sys.stdout = stdout
+    return (pm, state, output, tmpdir)
+
+
+def teardown_output_cycle(ctx):
+    import shutil
+    pm, _, output, tmpdir = ctx
+    pm.HEADLESS_MODE = False
+    pm.NDJSON_FILE = ""
+    if isinstance(output, pm.Logger):
+        output.terminal.close()
+        output.logfile.close()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# Runs one output cycle (3 presence changes, 5 events) through change detection and all enabled output sinks
+def run_output_cycle(ctx):
+    pm, state, output, _ = ctx
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        for presence in CYCLE_PRESENCES:
+            status, game_name, launchplatform, game_ids = pm.get_presence_fields(pm.parse_presence(presence))
+            pm.apply_user_presence(state, status, game_name, launchplatform, game_ids)
+    finally:
+        sys.stdout = stdout
+
+
+@benchmark("output_cycle_interactive", "output", setup=lambda: setup_output_cycle(False), teardown=teardown_output_cycle)
+def bench_output_cycle_interactive(ctx):
+    run_output_cycle(ctx)
+
+
+@benchmark("output_cycle_headless", "output", setup=lambda: setup_output_cycle(True), teardown=teardown_output_cycle)
+def bench_output_cycle_headless(ctx):
+    run_output_cycle(ctx)
+
+
+# ---------- end-to-end against the fake PSN server ----------
+
+def setup_e2e():
+    pm = load_psn_monitor()
+    try:
+        import psn_fake_server
+        from psnawp_api import PSNAWP
+    except ImportError as e:
+        raise BenchmarkSkipped(f"end-to-end benchmark needs PSNAWP and tools/psn_fake_server.py: {e}")
+    server, base_url = psn_fake_server.start_background(port=0, scenario={"users": [{"online_id": "bench_player", "timeline": [{"at": 0, "status": "online", "platform": "PS5", "game": "ELDEN RING™", "title_id": "PPSA01487_00", "launch_platform": "PS5"}]}]})
+    pm.apply_psn_api_base_url(base_url)
+    # PSNAWP 3.x paces its requests (one every 3 seconds by default), which would be measured instead of the poll cycle
+    try:
+        from pyrate_limiter import Duration, Rate
+        psnawp = PSNAWP("bench_npsso", rate_limit=Rate(100000, Duration.SECOND))
+    except ImportError:
+        psnawp = PSNAWP("bench_npsso")
+    psn_user = psnawp.user(online_id="bench_player")
+    return (pm, psn_user, server)
+
+
+def teardown_e2e(ctx):
+    ctx[2].shutdown()
+    ctx[2].server_close()
+
+
+@benchmark("poll_cycle_fake_server", "end_to_end", setup=setup_e2e, teardown=teardown_e2e, number=50)
+def bench_poll_cycle(ctx):
+    pm, psn_user, _ = ctx
+    parsed = pm.parse_presence(psn_user.get_presence())
+    pm.normalize_ascii(parsed["game_name"])
+
+
+# Same poll cycle with the lean presence client (RAW_PRESENCE_CLIENT) using the token of the PSNAWP session
+def setup_e2e_raw():
+    pm, psn_user, server = setup_e2e()
+    access_token = pm.get_psnawp_access_token(psn_user)
+    if not access_token:
+        teardown_e2e((pm, psn_user, server))
+        raise BenchmarkSkipped("installed psnawp version does not expose the access token")
+    return (pm, psn_user.account_id, access_token, server)
+
+
+@benchmark("poll_cycle_fake_server_raw", "end_to_end", setup=setup_e2e_raw, teardown=lambda ctx: teardown_e2e((None, None, ctx[3])), number=50)
+def bench_poll_cycle_raw(ctx):
+    pm, account_id, access_token, _ = ctx
+    parsed = pm.parse_presence(pm.fetch_raw_presence(account_id, access_token))
+    pm.normalize_ascii(parsed["game_name"])
+
+
+# ---------- import & startup ----------
+
+# Returns cumulative import time of psn_monitor in seconds as reported by python -X importtime
+def measure_importtime():
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import psn_monitor"], cwd=str(REPO_DIR), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise BenchmarkSkipped(f"import psn_monitor failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+psn_monitor$", line)
+        if m:
+            return int(m.group(1)) / 1_000_000
+    raise BenchmarkSkipped("psn_monitor not found in -X importtime output")
+
+
+# Returns wall time in seconds of running psn_monitor.py with the given arguments (in the given working directory)
+def measure_startup(args, cwd=REPO_DIR):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, str(REPO_DIR / "psn_monitor.py"), *args], cwd=str(cwd), capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise BenchmarkSkipped(f"psn_monitor.py {' '.join(args)} exited with {proc.returncode}")
+    return elapsed
+
+
+# Returns the startup floor in seconds: wall time of starting the interpreter and time of compiling psn_monitor.py,
+# which every run of the script pays (scripts are never loaded from cached bytecode) and so does the import when
+# bytecode is not cached (e.g. PYTHONDONTWRITEBYTECODE)
+def measure_startup_floor():
+    if not STARTUP_FLOOR:
+        source = (REPO_DIR / "psn_monitor.py").read_text(encoding="utf-8")
+        interpreter = []
+        compilation = []
+        for _ in range(5):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], capture_output=True)
+            interpreter.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            compile(source, "psn_monitor.py", "exec")
+            compilation.append(time.perf_counter() - start)
+        STARTUP_FLOOR["interpreter"] = statistics.median(interpreter)
+        STARTUP_FLOOR["compile"] = statistics.median(compilation)
+    return STARTUP_FLOOR
+
+
+# Returns the startup budget of the benchmark in seconds (allowance plus the floor it pays), None if it has no budget
+def get_startup_budget(name):
+    if name not in STARTUP_BUDGETS:
+        return None
+    floor = measure_startup_floor()
+    if name == "import_psn_monitor":
+        return STARTUP_BUDGETS[name] + floor["compile"]
+    return STARTUP_BUDGETS[name] + floor["interpreter"] + floor["compile"]
+
+
+@benchmark("import_psn_monitor", "startup", number=1)
+def bench_import(_):
+    return measure_importtime()
+
+
+@benchmark("startup_version", "startup", number=1)
+def bench_startup_version(_):
+    return measure_startup(["--version"])
+
+
+@benchmark("startup_generate_config", "startup", number=1)
+def bench_startup_generate_config(_):
+    return measure_startup(["--generate-config"])
+
+
+# Info mode (-i) against the fake PSN server, run in a temporary directory with a config file pointing at the server;
+# it imports PSNAWP and makes real PSN calls, so it has no startup budget (PSNAWP 3.x paces its own requests)
+def setup_startup_info():
+    try:
+        import psn_fake_server
+    except ImportError as e:
+        raise BenchmarkSkipped(f"info mode benchmark needs tools/psn_fake_server.py: {e}")
+    if importlib.util.find_spec("psnawp_api") is None:
+        raise BenchmarkSkipped("info mode benchmark needs PSNAWP")
+    server, base_url = psn_fake_server.start_background(port=0, scenario={"users": [{"online_id": "bench_player", "timeline": [{"at": 0, "status": "online", "platform": "PS5", "game": "ELDEN RING™", "title_id": "PPSA01487_00", "launch_platform": "PS5"}]}]})
+    tmp_dir = tempfile.TemporaryDirectory(prefix="psn_bench_")
+    (Path(tmp_dir.name) / "psn_monitor.toml").write_text(f'LOCAL_TIMEZONE = "{BENCH_TIMEZONE}"\nPSN_NPSSO = "bench_npsso"\nPSN_API_BASE_URL = "{base_url}"\n', encoding="utf-8")
+    return (server, tmp_dir)
+
+
+def teardown_startup_info(ctx):
+    teardown_e2e((None, None, ctx[0]))
+    ctx[1].cleanup()
+
+
+@benchmark("startup_info", "startup", setup=setup_startup_info, teardown=teardown_startup_info, number=1)
+def bench_startup_info(ctx):
+    return measure_startup(["bench_player", "-i", "--config-file", "psn_monitor.toml", "--env-file", "none"], cwd=ctx[1].name)
+
+
+# Runs a startup benchmark; the measured value is returned by the function itself (subprocess based)
+def run_measured(func, repeat, ctx=None):
+    samples = [func(ctx) for _ in range(repeat)]
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "number": 1,
+        "repeat": repeat,
+    }
+
+
+# ---------- runner ----------
+
+# Returns the current git commit of the repository (or None)
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(REPO_DIR), capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# Reads psn_monitor version without importing the module
+def read_version():
+    m = re.search(r'^VERSION = "([^"]+)"', (REPO_DIR / "psn_monitor.py").read_text(encoding="utf-8"), re.M)
+    return m.group(1) if m else "unknown"
+
+
+# Formats seconds with an appropriate unit
+def format_seconds(value):
+    if value is None:
+        return "n/a"
+    if value >= 1:
+        return f"{value:.3f} s"
+    if value >= 1e-3:
+        return f"{value * 1e3:.3f} ms"
+    return f"{value * 1e6:.3f} us"
+
+
+# Runs selected benchmarks and returns a list of result dicts
+def run_benchmarks(selected, quick=False):
+    results = []
+    repeat = 3 if quick else 5
+    min_time = 0.05 if quick else 0.2
+    for bench in selected:
+        name = bench["name"]
+        sys.stdout.write(f"- {name}".ljust(48))
+        sys.stdout.flush()
+        ctx = None
+        try:
+            ctx = bench["setup"]() if bench["setup"] else None
+            if bench["group"] == "startup":
+                stats = run_measured(bench["func"], repeat, ctx)
+            else:
+                stats = time_callable(bench["func"], ctx, min_time=min_time, repeat=repeat, number=bench["number"])
+            budget = get_startup_budget(name)
+            if budget is not None:
+                stats["budget"] = budget
+                stats["within_budget"] = stats["median"] <= budget
+            results.append({"name": name, "group": bench["group"], "status": "ok", **stats})
+            budget_str = ""
+            if budget is not None:
+                budget_str = f" [budget {format_seconds(budget)}: {'OK' if stats['within_budget'] else 'EXCEEDED'}]"
+            cpu_str = f", cpu {format_seconds(stats['cpu_median'])}" if bench["group"] in ("end_to_end", "output") else ""
+            print(f"{format_seconds(stats['median'])} (min {format_seconds(stats['min'])}{cpu_str}){budget_str}")
+        except BenchmarkSkipped as e:
+            results.append({"name": name, "group": bench["group"], "status": "skipped", "reason": str(e)})
+            print(f"skipped ({e})")
+        except Exception as e:
+            results.append({"name": name, "group": bench["group"], "status": "error", "reason": f"{type(e).__name__}: {e}"})
+            print(f"error ({type(e).__name__}: {e})")
+        finally:
+            if ctx is not None and bench["teardown"]:
+                try:
+                    bench["teardown"](ctx)
+                except Exception:
+                    pass
+    return results
+
+
+# Prints the comparison of the current results with an older result file, returns number of regressions
+def compare_results(results, baseline_path, threshold):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {r["name"]: r for r in baseline.get("results", []) if r.get("status") == "ok"}
+    regressions = 0
+    print(f"\n* Comparison with {baseline_path} (psn_monitor v{baseline.get('version')}, commit {baseline.get('commit')})\n")
+    for r in results:
+        if r.get("status") != "ok" or r["name"] not in old:
+            continue
+        ratio = r["median"] / old[r["name"]]["median"] if old[r["name"]]["median"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  (faster)"
+        print(f"- {r['name']}".ljust(48) + f"{format_seconds(old[r['name']]['median'])} -> {format_seconds(r['median'])} ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench_psn_monitor", description="Benchmark suite for psn_monitor hot paths and startup")
+    parser.add_argument("-k", dest="filter", metavar="PATTERN", help="Only run benchmarks whose name or group contains PATTERN")
+    parser.add_argument("--quick", action="store_true", help="Fewer repeats, for a fast sanity run")
+    parser.add_argument("--list", action="store_true", help="List benchmarks and exit")
+    parser.add_argument("--output", metavar="JSON_FILE", help="Where to store results (default: benchmarks/results/<version>_<timestamp>.json)")
+    parser.add_argument("--no-save", dest="no_save", action="store_true", help="Do not store results")
+    parser.add_argument("--compare", metavar="JSON_FILE", help="Compare with results stored by an earlier run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help=f"Relative slowdown treated as regression (default: {REGRESSION_THRESHOLD})")
+    parser.add_argument("--fail-on-regression", dest="fail_on_regression", action="store_true", help="Exit with code 1 when a regression is found or a startup budget is exceeded")
+    args = parser.parse_args()
+
+    selected = [b for b in BENCHMARKS if not args.filter or args.filter in b["name"] or args.filter in b["group"]]
+
+    if args.list:
+        for b in selected:
+            print(f"{b['group']:<12} {b['name']}")
+        sys.exit(0)
+
+    version = read_version()
+    print(f"psn_monitor v{version} benchmarks (Python {platform.python_version()}, {platform.system()} {platform.machine()})\n")
+
+    results = run_benchmarks(selected, quick=args.quick)
+
+    data = {
+        "version": version,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": f"{platform.system()} {platform.release()} {platform.machine()}",
+        "cpu_count": os.cpu_count(),
+        "quick": args.quick,
+        "results": results,
+    }
+
+    if not args.no_save:
+        out_path = Path(args.output) if args.output else RESULTS_DIR / f"{version}_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        print(f"\n* Results saved to {out_path}")
+
+    over_budget = [r["name"] for r in results if r.get("within_budget") is False]
+    if over_budget:
+        print(f"\n* Startup budget exceeded: {', '.join(over_budget)}")
+
+    regressions = 0
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.threshold)
+
+    if args.fail_on_regression and (regressions or over_budget):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,10 @@ CONFIG_BLOCK = """
 #   - Hard-code it in the code or config file
 #
 # The refresh token generated from the npsso should remain valid for about 2 months
+#
+# Several npsso codes of different PSN accounts can be given separated by commas to spread requests across the accounts
+# (pool of credentials); each one gets its own session and request budget (PSN_RATE_LIMIT) and codes failing
+# authentication are taken out of rotation without interrupting the others
 PSN_NPSSO = "your_psn_npsso_code"
 
 # SMTP settings for sending email notifications
@@ -65,6 +69,15 @@ ACTIVE_INACTIVE_NOTIFICATION = False
 # Can also be enabled via the -g flag
 GAME_CHANGE_NOTIFICATION = False
 
+# Whether to send an email when the user earns trophies
+# Can also be enabled via the -t flag
+TROPHY_NOTIFICATION = False
+
+# Whether to send an email when profile, trophy summary or played titles data of the user changes
+# (checked every PROFILE_REFRESH_INTERVAL / TROPHIES_REFRESH_INTERVAL / TITLES_REFRESH_INTERVAL)
+# Can also be enabled via the -p flag
+PROFILE_CHANGE_NOTIFICATION = False
+
 # Whether to send an email on errors
 # Can also be disabled via the -e flag
 ERROR_NOTIFICATION = True
@@ -98,10 +111,179 @@ CHECK_INTERNET_URL = 'https://ca.account.sony.com/'
 # Timeout used when checking initial internet connectivity; in seconds
 CHECK_INTERNET_TIMEOUT = 5
 
+# Base URL of an alternative PSN API server used instead of Sony's hosts (e.g. the bundled fake
+# server from tools/psn_fake_server.py for offline integration and load tests)
+# Leave empty to use the real PSN API
+# Can also be set using the --psn-api-url flag
+PSN_API_BASE_URL = ""
+
+# Whether presence is fetched by the lean built-in client instead of PSNAWP's get_presence(): it reuses the access
+# token of the PSNAWP session, sends the request over a kept-alive connection and decodes it with orjson (if installed),
+# which lowers CPU use and latency of every poll; PSNAWP is still used for everything else and as a fallback
+# Can also be enabled using the --raw-presence flag
+RAW_PRESENCE_CLIENT = False
+
+# Max number of PSN API calls per minute shared by all calls made by the tool (presence, profile, trophies, auth probes)
+# Sony throttles requests per account (HTTP 429), the effective rate is lowered automatically when it happens
+# and raised back gradually after successful calls; set to 0 to disable the limiter
+PSN_RATE_LIMIT = 20
+
+# Max number of PSN API calls which can be made in a burst without waiting (token bucket size)
+PSN_RATE_LIMIT_BURST = 20
+
+# Retry policy for failed PSN calls: consecutive retry delays are randomized (decorrelated jitter) starting from
+# RETRY_BASE_DELAY and capped at RETRY_MAX_DELAY, so many instances failing together do not retry in lock-step; in seconds
+RETRY_BASE_DELAY = 15
+RETRY_MAX_DELAY = 900  # 15 mins
+
+# After this many consecutive failed PSN calls the circuit breaker opens and suspends all PSN calls
+# for CIRCUIT_BREAKER_COOLDOWN seconds, then a single trial call decides whether to resume or stay open
+# Set CIRCUIT_BREAKER_THRESHOLD to 0 to disable the circuit breaker
+CIRCUIT_BREAKER_THRESHOLD = 6
+CIRCUIT_BREAKER_COOLDOWN = 600  # 10 mins
+
+# NPSSO credentials of the pool taken out of rotation after failing authentication are probed again after this delay,
+# doubled after every failed probe (up to 24 hours); SIGHUP probes them right away
+# Set to 0 to probe them only on SIGHUP; in seconds
+NPSSO_RETRY_INTERVAL = 1800  # 30 mins
+
+# Whether to adapt the polling interval of offline users to their hour-of-week activity profile learned from
+# the CSV history (CSV_FILE) and status changes observed while running: users are polled rarely (up to
+# ADAPTIVE_MAX_INTERVAL) in hours they were never online and toward PSN_ACTIVE_CHECK_INTERVAL around their usual login times
+# Can also be enabled via the --adaptive flag
+ADAPTIVE_POLLING = False
+
+# Longest polling interval used by adaptive polling for offline users; in seconds
+ADAPTIVE_MAX_INTERVAL = 1800  # 30 mins
+
+# How much of the activity history is used to build the profile and how much is needed before intervals are adapted; in days
+ADAPTIVE_HISTORY_DAYS = 28
+ADAPTIVE_MIN_HISTORY_DAYS = 7
+
+# Share of the observed weeks in which the user was online in the given hour of the week, from which
+# the user is polled with PSN_ACTIVE_CHECK_INTERVAL even when offline
+ADAPTIVE_HOT_PROBABILITY = 0.5
+
+# Whether to poll the user faster right after a status or game change: the interval starts at BURST_INTERVAL
+# and grows linearly back to the normal one over BURST_WINDOW seconds (sharper short offline interruptions
+# and game session boundaries); extra polls are limited per user to BURST_BUDGET_PER_HOUR
+# Can also be enabled via the --burst flag
+BURST_POLLING = False
+BURST_INTERVAL = 10
+BURST_WINDOW = 300  # 5 mins
+BURST_BUDGET_PER_HOUR = 30
+
+# Refresh intervals of data other than presence, which is re-fetched on its own cadence and compared with
+# the previous value; differences are reported as profile change events; in seconds, 0 disables the refresh
+PROFILE_REFRESH_INTERVAL = 86400  # 1 day (about me, PS+, languages, verification, friendship)
+TROPHIES_REFRESH_INTERVAL = 3600  # 1 hour (trophy level, tier and earned trophies)
+TITLES_REFRESH_INTERVAL = 21600  # 6 hours (play count and play time of recently played titles)
+
+# When the trophy refresh shows new earned trophies, this many recently updated trophy titles are checked and
+# trophies are fetched only for titles updated since the previous refresh
+TROPHY_TRACKER_TITLE_LIMIT = 20
+
+# In multi-user mode users are polled by priority: in-game > online > recently offline > long offline
+# Users offline for less than SCHEDULER_RECENTLY_OFFLINE seconds are considered recently offline
+SCHEDULER_RECENTLY_OFFLINE = 3600  # 1 hour
+
+# When the request budget is exhausted (rate limiter out of tokens) or polls start later than SCHEDULER_MAX_LAG seconds
+# after their deadline, polls of offline users are postponed by their polling interval, at most SCHEDULER_MAX_SHED times in a row
+SCHEDULER_MAX_LAG = 30
+SCHEDULER_MAX_SHED = 3
+
+# Friends mode: watches all friends of the PSN account the NPSSO code belongs to (the first code of the pool), their
+# presences are fetched in bulk with one request per FRIENDS_PRESENCE_BATCH friends instead of one request per user
+# PSN IDs given on the command line (if any) limit it to these friends
+# Can also be enabled using the --friends flag
+FRIENDS_MODE = False
+
+# Regular expression selecting watched friends by their PSN ID (online ID), empty watches all friends
+# Can also be set using the --friends-filter flag
+FRIENDS_FILTER = ""
+
+# How often the friends list is fetched again, so added and removed friends are picked up; in seconds
+FRIENDS_REFRESH_INTERVAL = 3600  # 1 hour
+
+# Max number of friends whose presences are fetched with one request
+FRIENDS_PRESENCE_BATCH = 100
+
+# Path of the Unix domain socket accepting commands which change the running tool without a restart: add or remove
+# monitored users, set polling intervals per user, toggle outputs and notifications, force a poll, dump user state
+# and read stats (see README); empty disables it, not available on Windows and with worker processes (WORKERS > 1)
+# Can also be set using the --control-socket flag
+CONTROL_SOCKET = ""
+
+# Number of worker processes in multi-user mode, users are spread across workers with consistent hashing so adding
+# or removing users moves only a small share of them; the PSN API rate limit is split evenly between workers
+# 0 or 1 monitors all users in a single process, requires fork (macOS/Linux/Unix)
+# Can also be set using the --workers flag
+WORKERS = 0
+
+# How often workers report metrics & user state to the supervisor, which also re-reads the users file; in seconds
+SUPERVISOR_REPORT_INTERVAL = 30
+
+# Number of virtual nodes per worker on the consistent hash ring, more nodes spread users more evenly
+HASH_RING_VNODES = 64
+
+# Lease backend coordinating several nodes (hosts or tool instances) monitoring the same users, so each user is
+# polled by one node only; the lease holder hands over user state with the lease, e.g. sqlite:///shared/psn_leases.db
+# (a plain path means SQLite); empty disables coordination
+# Can also be set using the --lease-backend flag
+LEASE_BACKEND = ""
+
+# Lease of a node which stops heartbeating expires after LEASE_TTL seconds and its users fail over to other nodes
+# Leases are renewed every LEASE_TTL / 3 seconds
+LEASE_TTL = 90
+
+# Unique ID of this node in the lease backend, by default <hostname>:<pid>
+# Can also be set using the --node-id flag
+LEASE_NODE_ID = ""
+
 # CSV file to write all status & game changes
 # Can also be set using the -b flag
 CSV_FILE = ""
 
+# File to append all monitoring events (status & game changes) to, one JSON object per line (NDJSON)
+# Can also be set using the --ndjson-file flag
+NDJSON_FILE = ""
+
+# File to write monitoring counters to as JSON (polls, errors and events per type), e.g. for external scrapers
+# Can also be set using the --metrics-file flag
+METRICS_FILE = ""
+
+# How often the metrics file is rewritten; in seconds
+METRICS_WRITE_INTERVAL = 60  # 1 min
+
+# File caching PSN account IDs of monitored users (online ID -> account ID), so sessions can be recreated and many users
+# started without an online ID lookup per user; renames of online IDs are detected via the stable account ID
+# Empty disables the cache
+PSN_ID_CACHE_FILE = "psn_monitor_ids.json"
+
+# State store keeping the last status and the checkpoint of all monitored users in one place: the snapshot file plus
+# its journal (<file>.journal), where changes are appended and which is compacted into the snapshot from time to time
+# Legacy psn_<psn_user_id>_last_status.json and psn_<psn_user_id>_checkpoint.json files are migrated automatically
+# Empty keeps the state in memory only (legacy files are then still read, but kept on disk)
+# A relative path is relative to the working directory, i.e. next to the legacy files, CSV and log files
+# Can also be set using the --state-file flag
+STATE_STORE_FILE = "psn_monitor_state.json"
+
+# How often the journal of the state store is flushed to disk (fsync); in seconds
+# Changes are written to the journal immediately, so only a power loss / OS crash can lose the last few seconds
+STATE_STORE_SYNC_INTERVAL = 5
+
+# Number of changes appended to the journal after which it is compacted into the snapshot file
+STATE_STORE_COMPACT_ENTRIES = 1000
+
+# Max age of the checkpoint of a user for the monitoring session to be continued from it after a restart; older
+# checkpoints (the tool was down for long) are discarded and a new session is started; set to 0 to always continue
+# Checkpoints are saved on every change and on exit; in seconds
+CHECKPOINT_MAX_AGE = 21600  # 6 hours
+
+# How often the TOML config file (psn_monitor.toml) is checked for changes, which are then applied to the running tool
+# without a restart (only the changed options); in seconds, 0 disables it
+CONFIG_RELOAD_INTERVAL = 5
+
 # Location of the optional dotenv file which can keep secrets
 # If not specified it will try to auto-search for .env files
 # To disable auto-search, set this to the literal string "none"
@@ -122,6 +304,12 @@ HORIZONTAL_LINE = 113
 # Whether to clear the terminal screen after starting the tool
 CLEAR_SCREEN = True
 
+# Headless mode for service deployments: console output and the log file are disabled, no terminal rendering is done
+# (timestamps & separator lines, liveness checks, screen clearing) and events go only to the configured sinks
+# (email notifications, CSV_FILE, NDJSON_FILE and METRICS_FILE)
+# Can also be enabled using the --headless flag
+HEADLESS_MODE = False
+
 # Value used by signal handlers increasing/decreasing the check for player activity
 # when user is online (PSN_ACTIVE_CHECK_INTERVAL); in seconds
 PSN_ACTIVE_CHECK_SIGNAL_VALUE = 30  # 30 seconds
@@ -143,6 +331,8 @@ SENDER_EMAIL = ""
 RECEIVER_EMAIL = ""
 ACTIVE_INACTIVE_NOTIFICATION = False
 GAME_CHANGE_NOTIFICATION = False
+TROPHY_NOTIFICATION = False
+PROFILE_CHANGE_NOTIFICATION = False
 ERROR_NOTIFICATION = False
 PSN_CHECK_INTERVAL = 0
 PSN_ACTIVE_CHECK_INTERVAL = 0
@@ -151,18 +341,97 @@ OFFLINE_INTERRUPT = 0
 LIVENESS_CHECK_INTERVAL = 0
 CHECK_INTERNET_URL = ""
 CHECK_INTERNET_TIMEOUT = 0
+PSN_API_BASE_URL = ""
+RAW_PRESENCE_CLIENT = False
+PSN_RATE_LIMIT = 0
+PSN_RATE_LIMIT_BURST = 0
+RETRY_BASE_DELAY = 0
+RETRY_MAX_DELAY = 0
+CIRCUIT_BREAKER_THRESHOLD = 0
+CIRCUIT_BREAKER_COOLDOWN = 0
+NPSSO_RETRY_INTERVAL = 0
+ADAPTIVE_POLLING = False
+ADAPTIVE_MAX_INTERVAL = 0
+ADAPTIVE_HISTORY_DAYS = 0
+ADAPTIVE_MIN_HISTORY_DAYS = 0
+ADAPTIVE_HOT_PROBABILITY = 0.0
+BURST_POLLING = False
+BURST_INTERVAL = 0
+BURST_WINDOW = 0
+BURST_BUDGET_PER_HOUR = 0
+PROFILE_REFRESH_INTERVAL = 0
+TROPHIES_REFRESH_INTERVAL = 0
+TITLES_REFRESH_INTERVAL = 0
+TROPHY_TRACKER_TITLE_LIMIT = 0
+SCHEDULER_RECENTLY_OFFLINE = 0
+SCHEDULER_MAX_LAG = 0
+SCHEDULER_MAX_SHED = 0
+FRIENDS_MODE = False
+FRIENDS_FILTER = ""
+FRIENDS_REFRESH_INTERVAL = 0
+FRIENDS_PRESENCE_BATCH = 0
+CONTROL_SOCKET = ""
+WORKERS = 0
+SUPERVISOR_REPORT_INTERVAL = 0
+HASH_RING_VNODES = 0
+LEASE_BACKEND = ""
+LEASE_TTL = 0
+LEASE_NODE_ID = ""
 CSV_FILE = ""
+NDJSON_FILE = ""
+METRICS_FILE = ""
+METRICS_WRITE_INTERVAL = 0
+PSN_ID_CACHE_FILE = ""
+STATE_STORE_FILE = ""
+STATE_STORE_SYNC_INTERVAL = 0
+STATE_STORE_COMPACT_ENTRIES = 0
+CHECKPOINT_MAX_AGE = 0
+CONFIG_RELOAD_INTERVAL = 0
 DOTENV_FILE = ""
 PSN_LOGFILE = ""
 DISABLE_LOGGING = False
 HORIZONTAL_LINE = 0
 CLEAR_SCREEN = False
+HEADLESS_MODE = False
 PSN_ACTIVE_CHECK_SIGNAL_VALUE = 0
 
 exec(CONFIG_BLOCK, globals())
 
-# Default name for the optional config file
+# Default names for the optional config file, the TOML one is preferred when both exist in the same location
 DEFAULT_CONFIG_FILENAME = "psn_monitor.conf"
+DEFAULT_TOML_CONFIG_FILENAME = "psn_monitor.toml"
+
+# Options which can be overridden per user in [users."<psn_user_id>"] tables of the TOML config file
+CONFIG_USER_KEYS = ("PSN_CHECK_INTERVAL", "PSN_ACTIVE_CHECK_INTERVAL", "ACTIVE_INACTIVE_NOTIFICATION", "GAME_CHANGE_NOTIFICATION", "TROPHY_NOTIFICATION", "PROFILE_CHANGE_NOTIFICATION", "ERROR_NOTIFICATION")
+
+# Per-user polling intervals: option of the TOML config file -> key of the interval set via the control socket in the
+# user state, which takes precedence over the config file one (kept under config_<key>, see get_user_interval())
+CONFIG_USER_INTERVAL_KEYS = {"PSN_CHECK_INTERVAL": "check_interval", "PSN_ACTIVE_CHECK_INTERVAL": "active_check_interval"}
+
+# Allowed ranges (min, max) of numeric options in the TOML config file, other numeric options must not be negative
+CONFIG_VALUE_RANGES = {
+    "PSN_CHECK_INTERVAL": (1, None),
+    "PSN_ACTIVE_CHECK_INTERVAL": (1, None),
+    "SMTP_PORT": (1, 65535),
+    "CHECK_INTERNET_TIMEOUT": (1, None),
+    "RETRY_BASE_DELAY": (1, None),
+    "ADAPTIVE_HOT_PROBABILITY": (0, 1),
+    "BURST_INTERVAL": (1, None),
+    "FRIENDS_PRESENCE_BATCH": (1, None),
+    "HASH_RING_VNODES": (1, None),
+    "LEASE_TTL": (1, None),
+}
+
+# Options of the TOML config file which are used only at startup, their changes are reported but need a restart
+CONFIG_RESTART_KEYS = (
+    "LOCAL_TIMEZONE", "CHECK_INTERNET_URL", "CHECK_INTERNET_TIMEOUT", "PSN_API_BASE_URL", "FRIENDS_MODE", "CONTROL_SOCKET", "WORKERS",
+    "SUPERVISOR_REPORT_INTERVAL", "HASH_RING_VNODES", "LEASE_BACKEND", "LEASE_TTL", "LEASE_NODE_ID", "CSV_FILE", "NDJSON_FILE", "METRICS_FILE",
+    "PSN_ID_CACHE_FILE", "STATE_STORE_FILE", "CONFIG_RELOAD_INTERVAL", "DOTENV_FILE", "PSN_LOGFILE", "DISABLE_LOGGING", "CLEAR_SCREEN", "HEADLESS_MODE",
+)
+
+# Refresh intervals of the TOML config file (see REFRESH_TASKS): changes are applied, but refreshes disabled (0) at
+# startup are not scheduled, so enabling them needs a restart
+CONFIG_REFRESH_KEYS = ("PROFILE_REFRESH_INTERVAL", "TROPHIES_REFRESH_INTERVAL", "TITLES_REFRESH_INTERVAL")
 
 # List of secret keys to load from env/config
 SECRET_KEYS = ("PSN_NPSSO", "SMTP_PASSWORD")
@@ -170,6 +439,32 @@ SECRET_KEYS = ("PSN_NPSSO", "SMTP_PASSWORD")
 # Default value for timeouts in alarm signal handler; in seconds
 FUNCTION_TIMEOUT = 15
 
+# Lowest rate (calls per minute) the limiter can adapt down to after HTTP 429 responses
+RATE_LIMIT_MIN = 1
+
+# Multiplier applied to the current rate after HTTP 429 and rate increase after each successful call (calls per minute)
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+RATE_LIMIT_RECOVERY_STEP = 0.5
+
+# Pause used after HTTP 429 when PSN does not send Retry-After header; in seconds
+RATE_LIMIT_DEFAULT_RETRY_AFTER = 60
+
+# PSNAWP session of the NPSSO credential currently in use, shared by all users assigned to it (see create_psn_session())
+PSN_SESSION = {"client": None, "generation": 0, "npsso": "", "last_recreate_ts": 0}
+
+# Pool of NPSSO credentials parsed from PSN_NPSSO (source), each one with its own session, rate limiter and health
+# (see sync_psn_credentials())
+PSN_CREDENTIALS = {"source": "", "pool": []}
+
+# Minimal time between automatic PSNAWP session recreations after errors; in seconds
+PSN_SESSION_RECREATE_COOLDOWN = 300
+
+# Scheduler priority classes from the most to the least important (see get_user_priority())
+PRIORITY_CLASSES = ("in_game", "online", "recently_offline", "offline")
+
+# Polls of users with this priority or lower can be postponed by the scheduler under load
+SCHEDULER_SHED_PRIORITY = 2
+
 LIVENESS_CHECK_COUNTER = LIVENESS_CHECK_INTERVAL / PSN_CHECK_INTERVAL
 
 stdout_bck = None
@@ -177,6 +472,40 @@ csvfieldnames = ['Date', 'Status', 'Game name']
 
 CLI_CONFIG_PATH = None
 
+# Resolved pytz timezone object for LOCAL_TIMEZONE (see get_local_tz())
+LOCAL_TZ = None
+LOCAL_TZ_NAME = None
+
+# Registered output sinks receiving monitoring events (see register_event_sink())
+EVENT_SINKS = []
+
+# Control socket server and commands waiting to be run by the monitoring loop (see start_control_server()), lock guards
+# the state of queued commands (see submit_control_command())
+CONTROL = {"server": None, "path": "", "commands": None, "lock": None}
+
+# Wakeup socket pair of the monitoring loop (see wait_for_wakeup()): signals write to it via signal.set_wakeup_fd() and
+# control commands via wake_up_loop(), so waits between polls end at once; the flags tell the loop what to apply
+WAKEUP = {"pid": None, "selector": None, "socks": None, "loop": False, "waiting": False, "stop": None, "reload": False, "reschedule": False, "config": False}
+
+# TOML config file in use: its options and per-user options as loaded, and options set by command-line flags or .env
+# at startup, which config reloads leave alone (see reload_toml_config())
+CONFIG = {"path": "", "options": {}, "users": {}, "overridden": set()}
+
+# Counters exposed via METRICS_FILE (see metric_inc())
+METRICS = {}
+METRICS_LAST_WRITE_TS = 0
+
+# Metrics reported by worker processes in supervisor mode: worker ID -> counters
+METRICS_WORKERS = {}
+
+# Metrics which describe the current state instead of counting (besides scheduler lag averages and maximums), they are
+# not carried over from previous runs of restarted workers (see psn_monitor_supervisor())
+METRICS_GAUGES = ("circuit_breaker_state", "credentials_healthy", "credentials_total", "friends_total", "friends_watched", "lease_held", "ratelimit_rate_per_minute")
+
+# Max number of rendered timestamps kept per formatting function (see memoize_ts_format())
+TS_FORMAT_CACHE_SIZE = 2048
+TS_FORMAT_CACHES = []
+
 # to solve the issue: 'SyntaxError: f-string expression part cannot include a backslash'
 nl_ch = "\n"
 
@@ -198,40 +527,65 @@ if sys.version_info < (3, 10):
     sys.exit(1)
 
 import time
-import string
 import json
 import os
-from datetime import datetime, timezone
-from dateutil import relativedelta
-from dateutil.parser import isoparse
+from datetime import datetime, timedelta, timezone
 import calendar
-import requests as req
+import functools
 import signal
-import smtplib
-import ssl
-from email.header import Header
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+import threading
+import random
+import hashlib
 import argparse
-import csv
-try:
-    import pytz
-except ModuleNotFoundError:
-    raise SystemExit("Error: Couldn't find the pytz library !\n\nTo install it, run:\n    pip3 install pytz\n\nOnce installed, re-run this tool")
-try:
-    from tzlocal import get_localzone
-except ImportError:
-    get_localzone = None
+import importlib
+import importlib.util
 import platform
 import re
-import ipaddress
-try:
-    from psnawp_api import PSNAWP
-except ModuleNotFoundError:
-    raise SystemExit("Error: Couldn't find the PSNAWP library !\n\nTo install it, run:\n    pip3 install PSNAWP\n\nOnce installed, re-run this tool. For more help, visit:\nhttps://github.com/isFakeAccount/psnawp")
 import shutil
 from pathlib import Path
 
+# Heavy dependencies (requests, PSNAWP, pytz, dateutil, smtplib/ssl/email, csv) are imported lazily
+# in the code paths that need them, so --generate-config, --version, --send-test-email and -i start fast
+
+# Required dependencies checked at startup of the modes talking to PSN: module name -> (pip package, extra hint)
+REQUIRED_MODULES = {
+    "pytz": ("pytz", ""),
+    "dateutil": ("python-dateutil", ""),
+    "requests": ("requests", ""),
+    "psnawp_api": ("PSNAWP", " For more help, visit:\nhttps://github.com/isFakeAccount/psnawp"),
+}
+
+
+# Imports a required dependency on first use, exits with install guidance if it is missing
+def import_required(module_name):
+    try:
+        return importlib.import_module(module_name)
+    except ModuleNotFoundError:
+        pip_name, extra = REQUIRED_MODULES.get(module_name.split(".")[0], (module_name, ""))
+        raise SystemExit(f"Error: Couldn't find the {pip_name} library !\n\nTo install it, run:\n    pip3 install {pip_name}\n\nOnce installed, re-run this tool.{extra}")
+
+
+# Checks if required dependencies are installed without importing them (find_spec is cheap)
+def check_required_modules(module_names=None):
+    for module_name in (module_names or REQUIRED_MODULES):
+        if importlib.util.find_spec(module_name) is None:
+            import_required(module_name)
+
+
+# Returns the PSNAWP class, PSNAWP is heavy so it is only imported when a PSN session is really needed
+def get_psnawp_class():
+    return import_required("psnawp_api").PSNAWP
+
+
+# Returns the pytz timezone object for LOCAL_TIMEZONE, resolved once and re-resolved only if LOCAL_TIMEZONE changes
+def get_local_tz():
+    global LOCAL_TZ, LOCAL_TZ_NAME
+    if LOCAL_TZ is None or LOCAL_TZ_NAME != LOCAL_TIMEZONE:
+        pytz = import_required("pytz")
+        LOCAL_TZ = pytz.timezone(LOCAL_TIMEZONE)
+        LOCAL_TZ_NAME = LOCAL_TIMEZONE
+    return LOCAL_TZ
+
 
 # Probes the PSN OAuth endpoint with the given npsso and returns a specific error hint if the redirect carries a recognizable error such as ToSUA re-acceptance, otherwise None
 def probe_npsso_auth_error(npsso):
@@ -240,6 +594,7 @@ def probe_npsso_auth_error(npsso):
         from urllib.parse import urlparse, parse_qs
         from psnawp_api.core.authenticator import Authenticator
         from psnawp_api.utils.endpoints import BASE_PATH, API_PATH
+        import requests as req
     except Exception:
         return None
     try:
@@ -274,6 +629,7 @@ def probe_npsso_auth_error(npsso):
             "turnOnTrustedBrowser": "true",
             "ui": "pr",
         }
+        rate_limit_acquire("auth")
         resp = req.get(f"{BASE_PATH['base_uri']}{API_PATH['oauth_code']}", headers=headers, params=params, allow_redirects=False, timeout=15)
         loc = resp.headers.get("location", "")
         if not loc:
@@ -292,6 +648,20 @@ def probe_npsso_auth_error(npsso):
         return None
 
 
+# Redirects all PSN API hosts used by PSNAWP to the given base URL (e.g. http://127.0.0.1:8765)
+def apply_psn_api_base_url(base_url):
+    if not base_url:
+        return
+    base_url = base_url.rstrip("/")
+    try:
+        from psnawp_api.utils import endpoints
+    except Exception as e:
+        raise RuntimeError(f"Cannot redirect PSN API to '{base_url}': {e}")
+    for key, val in list(endpoints.BASE_PATH.items()):
+        if isinstance(val, str):
+            endpoints.BASE_PATH[key] = re.sub(r"^https?://[^/]+", base_url, val)
+
+
 # Tagged exception raised when a PSN API response does not match the expected shape
 class PsnMalformedResponse(ValueError):
     pass
@@ -318,10 +688,70 @@ def is_too_many_open_files(ex):
     return False
 
 
-# Classifies a PSN polling exception into one of: auth transient malformed exhausted unknown
+# Returns True if any exception in the chain indicates PSN throttling (HTTP 429 Too Many Requests)
+def is_rate_limited(ex):
+    for cur in iter_exc_chain(ex):
+        response = getattr(cur, "response", None)
+        if getattr(response, "status_code", None) == 429:
+            return True
+        name = type(cur).__name__.lower()
+        if "toomanyrequests" in name or "ratelimit" in name:
+            return True
+        msg = str(cur).lower()
+        if "too many requests" in msg or "rate limit" in msg:
+            return True
+    return False
+
+
+# Retry-After header of the last HTTP 429 response received by a PSNAWP session (see install_psnawp_retry_after_hook())
+PSN_LAST_RETRY_AFTER = {"value": None, "ts": 0.0}
+
+
+# Returns the delay in seconds requested by PSN via Retry-After header for the exception chain, None if not present
+# PSNAWP 3.x exceptions carry only the response body, the header is then taken from the last 429 response of the
+# PSNAWP session (if received within the last minute)
+def get_retry_after(ex):
+    value = None
+    for cur in iter_exc_chain(ex):
+        headers = getattr(getattr(cur, "response", None), "headers", None)
+        if headers and headers.get("Retry-After"):
+            value = headers.get("Retry-After")
+            break
+    if value is None and PSN_LAST_RETRY_AFTER["value"] and time.time() - PSN_LAST_RETRY_AFTER["ts"] < 60 and is_rate_limited(ex):
+        value = PSN_LAST_RETRY_AFTER["value"]
+        PSN_LAST_RETRY_AFTER.update(value=None, ts=0.0)
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0, int(parsedate_to_datetime(value).timestamp() - time.time()))
+    except Exception:
+        return None
+
+
+# Makes the HTTP session of the PSNAWP object record Retry-After of HTTP 429 responses for get_retry_after(), as
+# PSNAWP raises its exceptions without the response; no-op if the session cannot be found
+def install_psnawp_retry_after_hook(client):
+    session = getattr(getattr(getattr(client, "authenticator", None), "request_builder", None), "session", None)
+    if not isinstance(getattr(session, "hooks", None), dict):
+        return
+
+    def record_retry_after(response, *args, **kwargs):
+        if response.status_code == 429:
+            PSN_LAST_RETRY_AFTER.update(value=response.headers.get("Retry-After"), ts=time.time())
+
+    session.hooks.setdefault("response", []).append(record_retry_after)
+
+
+# Classifies a PSN polling exception into one of: auth transient malformed ratelimited exhausted unknown
 def classify_psn_exception(ex):
     if is_too_many_open_files(ex):
         return "exhausted"
+    if is_rate_limited(ex):
+        return "ratelimited"
     try:
         from requests.exceptions import ConnectionError as _ReqConnErr, Timeout as _ReqTimeout, SSLError as _ReqSSL, ChunkedEncodingError as _ReqChunked
         transient_types = (_ReqConnErr, _ReqTimeout, _ReqSSL, _ReqChunked, ConnectionError, TimeoutError)
@@ -349,6 +779,144 @@ def classify_psn_exception(ex):
     return "unknown"
 
 
+# State of the process-wide PSN API token bucket (see rate_limit_acquire())
+RATE_LIMITER = {"rate": 0.0, "tokens": 0.0, "updated": 0.0, "blocked_until": 0.0}
+RATE_LIMITER_LOCK = threading.Lock()
+
+# Whether calls are paced by the token bucket; one-shot info mode (-i) makes a bounded number of calls, so it is only
+# held back by pauses after HTTP 429 (see rate_limit_throttled())
+RATE_LIMIT_PACING = True
+
+# Adds tokens to the PSN API token bucket for the time elapsed since the last refill, RATE_LIMITER_LOCK must be held
+def rate_limit_refill(now):
+    if RATE_LIMITER["updated"] == 0 or RATE_LIMITER["rate"] <= 0 or RATE_LIMITER["rate"] > PSN_RATE_LIMIT:
+        RATE_LIMITER["rate"] = float(PSN_RATE_LIMIT)
+        RATE_LIMITER["tokens"] = float(PSN_RATE_LIMIT_BURST)
+        RATE_LIMITER["updated"] = now
+    RATE_LIMITER["tokens"] = min(float(max(PSN_RATE_LIMIT_BURST, 1)), RATE_LIMITER["tokens"] + (now - RATE_LIMITER["updated"]) * RATE_LIMITER["rate"] / 60)
+    RATE_LIMITER["updated"] = now
+
+
+# Waits until the process-wide PSN API token bucket allows another call and returns the time waited; in seconds
+# Every PSN API call made by the tool should be preceded by this call, endpoint is only used for metrics
+def rate_limit_acquire(endpoint="presence"):
+    if PSN_RATE_LIMIT <= 0:
+        return 0
+    waited = 0.0
+    while True:
+        with RATE_LIMITER_LOCK:
+            now = time.time()
+            rate_limit_refill(now)
+            wait = max(0.0, RATE_LIMITER["blocked_until"] - now)
+            if wait == 0 and (RATE_LIMITER["tokens"] >= 1 or not RATE_LIMIT_PACING):
+                RATE_LIMITER["tokens"] = max(0.0, RATE_LIMITER["tokens"] - 1)
+                break
+            if wait == 0:
+                wait = (1 - RATE_LIMITER["tokens"]) * 60 / RATE_LIMITER["rate"]
+        time.sleep(wait)
+        waited += wait
+    metric_inc("ratelimit_calls_total")
+    metric_inc(f"ratelimit_calls_{endpoint}")
+    if waited > 0:
+        metric_inc("ratelimit_waits_total")
+        metric_inc("ratelimit_wait_seconds_total", round(waited, 3))
+    return waited
+
+
+# Returns the number of PSN API calls which can be made right now without waiting
+def rate_limit_tokens():
+    if PSN_RATE_LIMIT <= 0:
+        return float("inf")
+    with RATE_LIMITER_LOCK:
+        now = time.time()
+        rate_limit_refill(now)
+        if RATE_LIMITER["blocked_until"] > now:
+            return 0.0
+        return RATE_LIMITER["tokens"]
+
+
+# Lowers the PSN API call rate after HTTP 429 and pauses all calls for retry_after seconds; returns the pause in seconds
+def rate_limit_throttled(retry_after=None):
+    with RATE_LIMITER_LOCK:
+        now = time.time()
+        rate_limit_refill(now)
+        RATE_LIMITER["rate"] = max(float(RATE_LIMIT_MIN), RATE_LIMITER["rate"] * RATE_LIMIT_DECREASE_FACTOR)
+        RATE_LIMITER["tokens"] = 0.0
+        delay = retry_after if retry_after is not None else RATE_LIMIT_DEFAULT_RETRY_AFTER
+        RATE_LIMITER["blocked_until"] = max(RATE_LIMITER["blocked_until"], now + delay)
+        METRICS["ratelimit_rate_per_minute"] = round(RATE_LIMITER["rate"], 2)
+    metric_inc("ratelimit_throttled_total")
+    return delay
+
+
+# Raises the PSN API call rate back towards PSN_RATE_LIMIT after a successful call
+def rate_limit_success():
+    with RATE_LIMITER_LOCK:
+        if 0 < RATE_LIMITER["rate"] < PSN_RATE_LIMIT:
+            RATE_LIMITER["rate"] = min(float(PSN_RATE_LIMIT), RATE_LIMITER["rate"] + RATE_LIMIT_RECOVERY_STEP)
+            METRICS["ratelimit_rate_per_minute"] = round(RATE_LIMITER["rate"], 2)
+
+
+# Returns the next retry delay after a failed PSN call using decorrelated jitter; in seconds
+# prev_delay is the previously returned delay (0 after a success), base_delay the lower bound for the error kind
+def get_retry_delay(prev_delay, base_delay):
+    base_delay = max(1, base_delay)
+    delay = random.uniform(base_delay, max(base_delay, prev_delay) * 3)
+    return int(min(max(RETRY_MAX_DELAY, base_delay), delay))
+
+
+# State of the process-wide circuit breaker in front of PSN calls: closed (calls allowed), open (calls suspended)
+# or half-open (a single trial call allowed after cooldown); probe_ts is the start of the trial call in progress
+CIRCUIT_BREAKER = {"state": "closed", "failures": 0, "opened_ts": 0, "probe_ts": 0}
+
+
+# Changes circuit breaker state, logging the transition and exposing it in metrics
+def circuit_breaker_transition(state, reason):
+    old_state = CIRCUIT_BREAKER["state"]
+    CIRCUIT_BREAKER["state"] = state
+    METRICS["circuit_breaker_state"] = state
+    metric_inc(f"circuit_breaker_{state.replace('-', '_')}_total")
+    print(f"* Circuit breaker for PSN calls: {old_state} -> {state} ({reason})")
+    print_cur_ts("Timestamp:\t\t\t")
+
+
+# Returns how long PSN calls are still suspended by the circuit breaker (0 if a call is allowed); in seconds
+# In half-open state only the trial call is allowed, other calls wait until its result is recorded (or it is considered
+# lost after FUNCTION_TIMEOUT seconds, e.g. a 429 response which is not a result of the breaker)
+def circuit_breaker_wait():
+    if CIRCUIT_BREAKER_THRESHOLD <= 0 or CIRCUIT_BREAKER["state"] == "closed":
+        return 0
+    now = int(time.time())
+    if CIRCUIT_BREAKER["state"] == "half-open":
+        remaining = CIRCUIT_BREAKER["probe_ts"] + FUNCTION_TIMEOUT - now
+        if CIRCUIT_BREAKER["probe_ts"] and remaining > 0:
+            return remaining
+        CIRCUIT_BREAKER["probe_ts"] = now
+        return 0
+    remaining = CIRCUIT_BREAKER["opened_ts"] + CIRCUIT_BREAKER_COOLDOWN - now
+    if remaining > 0:
+        return remaining
+    circuit_breaker_transition("half-open", "cooldown elapsed, trying a single call")
+    CIRCUIT_BREAKER["probe_ts"] = now
+    return 0
+
+
+# Records the result of a PSN call in the circuit breaker
+def circuit_breaker_record(success):
+    if CIRCUIT_BREAKER_THRESHOLD <= 0:
+        return
+    CIRCUIT_BREAKER["probe_ts"] = 0
+    if success:
+        CIRCUIT_BREAKER["failures"] = 0
+        if CIRCUIT_BREAKER["state"] != "closed":
+            circuit_breaker_transition("closed", "PSN call succeeded")
+        return
+    CIRCUIT_BREAKER["failures"] += 1
+    if CIRCUIT_BREAKER["state"] == "half-open" or (CIRCUIT_BREAKER["state"] == "closed" and CIRCUIT_BREAKER["failures"] >= CIRCUIT_BREAKER_THRESHOLD):
+        CIRCUIT_BREAKER["opened_ts"] = int(time.time())
+        circuit_breaker_transition("open", f"{CIRCUIT_BREAKER['failures']} consecutive failures, suspending PSN calls for {display_time(CIRCUIT_BREAKER_COOLDOWN)}")
+
+
 # Parses a PSN presence response into normalized fields raising PsnMalformedResponse for any unexpected shape
 def parse_presence(pres):
     if not isinstance(pres, dict):
@@ -375,9 +943,38 @@ def parse_presence(pres):
         "availability": basic.get("availability"),
         "game_name": (game_entry.get("titleName") if game_entry else None),
         "launch_platform": (game_entry.get("launchPlatform") if game_entry else None),
+        "title_id": (game_entry.get("npTitleId") if game_entry else None),
+        "concept_id": (game_entry.get("conceptId") if game_entry else None),
     }
 
 
+# Display names of games by PSN title ID (npTitleId), normalized once per title (see get_game_name())
+GAME_NAMES = {}
+
+
+# Returns display name of the game from presence; names are cached by title ID, so the name stays the same when Sony
+# edits or localizes it and it is normalized only when the title is seen for the first time
+def get_game_name(title_id, title_name):
+    if not title_id:
+        return normalize_ascii(title_name) if title_name else ""
+    name = GAME_NAMES.get(title_id)
+    if name is None:
+        name = GAME_NAMES[title_id] = normalize_ascii(title_name) if title_name else title_id
+    return name
+
+
+# Returns True if two presences show the same game; game_ids are tuples of title ID and concept ID, compared like with
+# like: by concept ID (shared by PS4 & PS5 versions of the game) when both have one, by title ID when both have one,
+# by game name otherwise, so a concept ID missing in one poll does not look like a game change
+def is_same_game(game_ids, game_ids_old, game_name, game_name_old):
+    (title_id, concept_id), (title_id_old, concept_id_old) = game_ids, game_ids_old
+    if concept_id and concept_id_old:
+        return str(concept_id) == str(concept_id_old)
+    if title_id and title_id_old:
+        return title_id == title_id_old
+    return game_name == game_name_old
+
+
 # Converts a PSN platform code into a readable label while preserving unknown values
 def format_platform_display(platform_value):
     if not platform_value:
@@ -402,6 +999,27 @@ class Logger(object):
         pass
 
 
+# Output class used as stdout in headless mode: console messages are discarded, while errors, warnings and hints
+# (including the reason of a fatal exit) are passed on to stderr line by line, so an unattended run leaves a trace
+class HeadlessOutput(object):
+    alert_re = re.compile(r"^\s*\*?\s*(error|warning|hint|cannot|no connectivity|psn auth|psn rate limit hit)|timeout, retrying", re.IGNORECASE)
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self.line = ""
+
+    def write(self, message):
+        self.line += message
+        while "\n" in self.line:
+            line, self.line = self.line.split("\n", 1)
+            if self.alert_re.search(line):
+                self.stream.write(line.strip() + "\n")
+                self.stream.flush()
+
+    def flush(self):
+        pass
+
+
 # Class used to generate timeout exceptions
 class TimeoutException(Exception):
     pass
@@ -412,15 +1030,21 @@ def timeout_handler(sig, frame):
     raise TimeoutException
 
 
-# Signal handler when user presses Ctrl+C
+# Signal handler when user presses Ctrl+C or the tool is stopped with SIGTERM (see stop_from_signal())
 def signal_handler(sig, frame):
-    sys.stdout = stdout_bck
-    print('\n* You pressed Ctrl+C, tool is terminated.')
-    sys.exit(0)
+    def stop():
+        sys.stdout = stdout_bck
+        if sig == signal.SIGINT:
+            print('\n* You pressed Ctrl+C, tool is terminated.')
+        else:
+            print(f"\n* Signal {signal.Signals(sig).name} received, tool is terminated.")
+        sys.exit(0)
+    stop_from_signal(stop)
 
 
 # Checks internet connectivity
 def check_internet(url=CHECK_INTERNET_URL, timeout=CHECK_INTERNET_TIMEOUT):
+    import requests as req
     try:
         _ = req.get(url, timeout=timeout)
         return True
@@ -429,9 +1053,9 @@ def check_internet(url=CHECK_INTERNET_URL, timeout=CHECK_INTERNET_TIMEOUT):
         return False
 
 
-# Clears the terminal screen
+# Clears the terminal screen (if stdout is a terminal)
 def clear_screen(enabled=True):
-    if not enabled:
+    if not enabled or not sys.stdout.isatty():
         return
     try:
         if platform.system() == 'Windows':
@@ -468,9 +1092,45 @@ def display_time(seconds, granularity=2):
         return '0 seconds'
 
 
+# Memoizes formatting functions for integer timestamps, so an event rendered by several outputs is formatted only once
+# The cache key includes LOCAL_TIMEZONE (and the current year in LOCAL_TIMEZONE if the output depends on it), other argument types are not cached
+def memoize_ts_format(year_sensitive=False):
+    def decorator(func):
+        cache = {}
+        TS_FORMAT_CACHES.append(cache)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for a in args:
+                if type(a) is not int:
+                    return func(*args, **kwargs)
+            key = (LOCAL_TIMEZONE, args, tuple(kwargs.items()))
+            if year_sensitive:
+                key += (datetime.now(get_local_tz()).year,)
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            if len(cache) >= TS_FORMAT_CACHE_SIZE:
+                cache.clear()
+            result = cache[key] = func(*args, **kwargs)
+            return result
+        return wrapper
+    return decorator
+
+
+# Clears all memoized timestamp renderings
+def clear_ts_format_caches():
+    for cache in TS_FORMAT_CACHES:
+        cache.clear()
+
+
 # Calculates time span between two timestamps, accepts timestamp integers, floats and datetime objects
+@memoize_ts_format()
 def calculate_timespan(timestamp1, timestamp2, show_weeks=True, show_hours=True, show_minutes=True, show_seconds=True, granularity=3):
     result = []
+    from dateutil.parser import isoparse
+    from dateutil.relativedelta import relativedelta
     intervals = ['years', 'months', 'weeks', 'days', 'hours', 'minutes', 'seconds']
     ts1 = timestamp1
     ts2 = timestamp2
@@ -489,9 +1149,9 @@ def calculate_timespan(timestamp1, timestamp2, show_weeks=True, show_hours=True,
     elif isinstance(timestamp1, datetime):
         dt1 = timestamp1
         if dt1.tzinfo is None:
-            dt1 = pytz.utc.localize(dt1)
+            dt1 = dt1.replace(tzinfo=timezone.utc)
         else:
-            dt1 = dt1.astimezone(pytz.utc)
+            dt1 = dt1.astimezone(timezone.utc)
         ts1 = int(round(dt1.timestamp()))
     else:
         return ""
@@ -510,9 +1170,9 @@ def calculate_timespan(timestamp1, timestamp2, show_weeks=True, show_hours=True,
     elif isinstance(timestamp2, datetime):
         dt2 = timestamp2
         if dt2.tzinfo is None:
-            dt2 = pytz.utc.localize(dt2)
+            dt2 = dt2.replace(tzinfo=timezone.utc)
         else:
-            dt2 = dt2.astimezone(pytz.utc)
+            dt2 = dt2.astimezone(timezone.utc)
         ts2 = int(round(dt2.timestamp()))
     else:
         return ""
@@ -524,7 +1184,7 @@ def calculate_timespan(timestamp1, timestamp2, show_weeks=True, show_hours=True,
         dt1, dt2 = dt2, dt1
 
     if ts_diff > 0:
-        date_diff = relativedelta.relativedelta(dt1, dt2)
+        date_diff = relativedelta(dt1, dt2)
         years = date_diff.years
         months = date_diff.months
         days_total = date_diff.days
@@ -556,6 +1216,13 @@ def calculate_timespan(timestamp1, timestamp2, show_weeks=True, show_hours=True,
 
 # Sends email notification
 def send_email(subject, body, body_html, use_ssl, smtp_timeout=15):
+    import ipaddress
+    import smtplib
+    import ssl
+    from email.header import Header
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     fqdn_re = re.compile(r'(?=^.{4,253}$)(^((?!-)[a-zA-Z0-9-]{1,63}(?<!-)\.)+[a-zA-Z]{2,63}\.?$)')
     email_re = re.compile(r'[^@]+@[^@]+\.[^@]+')
 
@@ -623,6 +1290,7 @@ def send_email(subject, body, body_html, use_ssl, smtp_timeout=15):
 
 # Initializes the CSV file
 def init_csv_file(csv_file_name):
+    import csv
     try:
         if not os.path.isfile(csv_file_name) or os.path.getsize(csv_file_name) == 0:
             with open(csv_file_name, 'a', newline='', buffering=1, encoding="utf-8") as f:
@@ -634,6 +1302,7 @@ def init_csv_file(csv_file_name):
 
 # Writes CSV entry
 def write_csv_entry(csv_file_name, timestamp, status, game_name):
+    import csv
     try:
 
         with open(csv_file_name, 'a', newline='', buffering=1, encoding="utf-8") as csv_file:
@@ -646,12 +1315,12 @@ def write_csv_entry(csv_file_name, timestamp, status, game_name):
 
 # Returns current local time without timezone info (naive)
 def now_local_naive():
-    return datetime.now(pytz.timezone(LOCAL_TIMEZONE)).replace(microsecond=0, tzinfo=None)
+    return datetime.now(get_local_tz()).replace(microsecond=0, tzinfo=None)
 
 
 # Returns current local time with timezone info (aware)
 def now_local():
-    return datetime.now(pytz.timezone(LOCAL_TIMEZONE))
+    return datetime.now(get_local_tz())
 
 
 # Converts ISO datetime string to localized datetime (aware)
@@ -660,38 +1329,44 @@ def convert_iso_str_to_datetime(dt_str):
         return None
 
     try:
+        from dateutil.parser import isoparse
         utc_dt = isoparse(dt_str)
         if utc_dt.tzinfo is None:
-            utc_dt = pytz.utc.localize(utc_dt)
-        return utc_dt.astimezone(pytz.timezone(LOCAL_TIMEZONE))
+            utc_dt = utc_dt.replace(tzinfo=timezone.utc)
+        return utc_dt.astimezone(get_local_tz())
     except Exception:
         return None
 
 
 # Returns the current date/time in human readable format; eg. Sun 21 Apr 2024, 15:08:45
 def get_cur_ts(ts_str=""):
-    return (f'{ts_str}{calendar.day_abbr[(now_local_naive()).weekday()]} {now_local_naive().strftime("%d %b %Y, %H:%M:%S")}')
+    now = now_local_naive()
+    return (f'{ts_str}{calendar.day_abbr[now.weekday()]} {now.strftime("%d %b %Y, %H:%M:%S")}')
 
 
 # Prints the current date/time in human readable format with separator; eg. Sun 21 Apr 2024, 15:08:45
 def print_cur_ts(ts_str=""):
+    if HEADLESS_MODE:
+        return
     print(get_cur_ts(str(ts_str)))
     print("─" * HORIZONTAL_LINE)
 
 
 # Returns the timestamp/datetime object in human readable format (long version); eg. Sun 21 Apr 2024, 15:08:45
+@memoize_ts_format()
 def get_date_from_ts(ts):
-    tz = pytz.timezone(LOCAL_TIMEZONE)
+    tz = get_local_tz()
 
     if isinstance(ts, str):
         try:
+            from dateutil.parser import isoparse
             ts = isoparse(ts)
         except Exception:
             return ""
 
     if isinstance(ts, datetime):
         if ts.tzinfo is None:
-            ts = pytz.utc.localize(ts)
+            ts = ts.replace(tzinfo=timezone.utc)
         ts_new = ts.astimezone(tz)
 
     elif isinstance(ts, int):
@@ -714,20 +1389,22 @@ def get_date_from_ts(ts):
 # Sun 21 Apr (if show_hour == False)
 # Sun 21 Apr 15:08:32 (if show_seconds == True)
 # 21 Apr 15:08 (if show_weekday == False)
+@memoize_ts_format(year_sensitive=True)
 def get_short_date_from_ts(ts, show_year=False, show_hour=True, show_weekday=True, show_seconds=False, always_show_year=False):
-    tz = pytz.timezone(LOCAL_TIMEZONE)
+    tz = get_local_tz()
     if always_show_year:
         show_year = True
 
     if isinstance(ts, str):
         try:
+            from dateutil.parser import isoparse
             ts = isoparse(ts)
         except Exception:
             return ""
 
     if isinstance(ts, datetime):
         if ts.tzinfo is None:
-            ts = pytz.utc.localize(ts)
+            ts = ts.replace(tzinfo=timezone.utc)
         ts_new = ts.astimezone(tz)
 
     elif isinstance(ts, int):
@@ -755,18 +1432,20 @@ def get_short_date_from_ts(ts, show_year=False, show_hour=True, show_weekday=Tru
 
 
 # Returns the timestamp/datetime object in human readable format (only hour, minutes and optionally seconds): eg. 15:08:12
+@memoize_ts_format()
 def get_hour_min_from_ts(ts, show_seconds=False):
-    tz = pytz.timezone(LOCAL_TIMEZONE)
+    tz = get_local_tz()
 
     if isinstance(ts, str):
         try:
+            from dateutil.parser import isoparse
             ts = isoparse(ts)
         except Exception:
             return ""
 
     if isinstance(ts, datetime):
         if ts.tzinfo is None:
-            ts = pytz.utc.localize(ts)
+            ts = ts.replace(tzinfo=timezone.utc)
         ts_new = ts.astimezone(tz)
 
     elif isinstance(ts, int):
@@ -784,8 +1463,9 @@ def get_hour_min_from_ts(ts, show_seconds=False):
 
 
 # Returns the range between two timestamps/datetime objects; eg. Sun 21 Apr 14:09 - 14:15
+@memoize_ts_format(year_sensitive=True)
 def get_range_of_dates_from_tss(ts1, ts2, between_sep=" - ", short=False):
-    tz = pytz.timezone(LOCAL_TIMEZONE)
+    tz = get_local_tz()
 
     if isinstance(ts1, datetime):
         ts1_new = int(round(ts1.timestamp()))
@@ -824,7 +1504,280 @@ def get_range_of_dates_from_tss(ts1, ts2, between_sep=" - ", short=False):
 
 # Checks if the timezone name is correct
 def is_valid_timezone(tz_name):
-    return tz_name in pytz.all_timezones
+    return tz_name in import_required("pytz").all_timezones
+
+
+# Creates a monitoring event; events are plain dicts passed to all registered output sinks (see register_event_sink())
+# Common fields: type, user, ts (unix timestamp of the event) and type-specific fields with raw (unformatted) values
+def make_event(event_type, user, ts, **fields):
+    event = {"type": event_type, "user": user, "ts": int(ts)}
+    event.update(fields)
+    return event
+
+
+# Registers an output sink receiving monitoring events
+# handler(event, ctx) is called for every event, ctx is the per-user context (user id, CSV file etc.)
+# enabled() is evaluated before every event, so disabled sinks do not render anything
+def register_event_sink(name, handler, enabled=None):
+    unregister_event_sink(name)
+    EVENT_SINKS.append({"name": name, "handler": handler, "enabled": enabled or (lambda: True), "active": True})
+
+
+# Removes an output sink registered under the given name
+def unregister_event_sink(name):
+    EVENT_SINKS[:] = [sink for sink in EVENT_SINKS if sink["name"] != name]
+
+
+# Switches the output sink registered under the given name on or off at runtime, returns False if there is no such sink
+def set_event_sink_active(name, active):
+    for sink in EVENT_SINKS:
+        if sink["name"] == name:
+            sink["active"] = active
+            return True
+    return False
+
+
+# Passes the event to all enabled output sinks
+def emit_event(event, ctx):
+    for sink in EVENT_SINKS:
+        try:
+            if sink["active"] and sink["enabled"]():
+                sink["handler"](event, ctx)
+        except Exception as e:
+            print(f"* Error in '{sink['name']}' output: {e}")
+
+
+# Increments the given metrics counter
+def metric_inc(name, value=1):
+    METRICS[name] = METRICS.get(name, 0) + value
+
+
+# Writes metrics counters as JSON to METRICS_FILE (atomically), at most once per METRICS_WRITE_INTERVAL unless forced
+def write_metrics_file(force=False):
+    global METRICS_LAST_WRITE_TS
+    if not METRICS_FILE:
+        return
+    now = int(time.time())
+    if not force and now - METRICS_LAST_WRITE_TS < METRICS_WRITE_INTERVAL:
+        return
+    METRICS_LAST_WRITE_TS = now
+    data = {"version": VERSION, "pid": os.getpid(), "updated": now, "counters": METRICS}
+    if METRICS_WORKERS:
+        data["workers"] = METRICS_WORKERS
+    tmp_file = f"{METRICS_FILE}.tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, METRICS_FILE)
+    except Exception as e:
+        print(f"* Cannot write metrics to '{METRICS_FILE}' file: {e}")
+
+
+# Returns launch platform suffix used in messages, eg. " (PS5)"
+def get_platform_suffix(event):
+    return f" ({event['platform']})" if event.get("platform") else ""
+
+
+# Returns the message about short offline interruption for status change event
+def get_short_offline_msg(event):
+    return f"Short offline interruption ({display_time(event['ts'] - event['status_ts_old'])}), online start timestamp set back to {get_short_date_from_ts(event['online_start_restored_ts'])}"
+
+
+# Renders console lines for status change event
+def render_status_change_console(event):
+    user, ts, ts_old = event["user"], event["ts"], event["status_ts_old"]
+    status_old, status = event["status_old"], event["status"]
+    lines = [
+        f"PSN user {user} changed status from {status_old} to {status}",
+        f"User was {status_old} for {calculate_timespan(ts, ts_old)} ({get_range_of_dates_from_tss(ts_old, ts, short=True)})",
+    ]
+    if status_old == "offline" and status and status != "offline":
+        lines.append(f"*** User got ACTIVE ! (was offline since {get_date_from_ts(ts_old)})")
+        if event.get("online_start_restored_ts"):
+            lines.append(get_short_offline_msg(event))
+    if status_old and status_old != "offline" and status == "offline":
+        online_start_ts = event.get("online_start_ts", 0)
+        online_since_msg = ""
+        if online_start_ts > 0:
+            online_since_msg = f"(after {calculate_timespan(ts, online_start_ts, show_seconds=False)}: {get_range_of_dates_from_tss(online_start_ts, ts, short=True)})"
+        if event.get("games_number"):
+            lines.append(f"User played {event['games_number']} games for total time of {display_time(event['game_total_ts'])}")
+        lines.append(f"*** User got OFFLINE ! {online_since_msg}")
+    if status != "offline" and event.get("game"):
+        lines.append(f"User is currently in-game: {event['game']}{get_platform_suffix(event)}")
+    return lines
+
+
+# Renders email subject and body for status change event
+def render_status_change_email(event):
+    user, ts, ts_old = event["user"], event["ts"], event["status_ts_old"]
+    status_old, status = event["status_old"], event["status"]
+    subject_after = calculate_timespan(ts, ts_old, show_seconds=False)
+    subject_was_since = f", was {status_old}: {get_range_of_dates_from_tss(ts_old, ts, short=True)}"
+    body_was_since = f" ({get_range_of_dates_from_tss(ts_old, ts, short=True)})"
+    body_short_offline_msg = ""
+    body_user_in_game = ""
+    body_played_games = ""
+    if event.get("online_start_restored_ts"):
+        body_short_offline_msg = f"\n\n{get_short_offline_msg(event)}"
+    online_start_ts = event.get("online_start_ts", 0)
+    if status == "offline" and online_start_ts > 0:
+        subject_after = calculate_timespan(ts, online_start_ts, show_seconds=False)
+        subject_was_since = f", was available: {get_range_of_dates_from_tss(online_start_ts, ts, short=True)}"
+        body_was_since = f" ({get_range_of_dates_from_tss(ts_old, ts, short=True)})\n\nUser was available for {calculate_timespan(ts, online_start_ts, show_seconds=False)} ({get_range_of_dates_from_tss(online_start_ts, ts, short=True)})"
+    if event.get("games_number"):
+        body_played_games = f"\n\nUser played {event['games_number']} games for total time of {display_time(event['game_total_ts'])}"
+    if status != "offline" and event.get("game"):
+        body_user_in_game = f"\n\nUser is currently in-game: {event['game']}{get_platform_suffix(event)}"
+    subject = f"PSN user {user} is now {status} (after {subject_after}{subject_was_since})"
+    body = f"PSN user {user} changed status from {status_old} to {status}\n\nUser was {status_old} for {calculate_timespan(ts, ts_old)}{body_was_since}{body_short_offline_msg}{body_user_in_game}{body_played_games}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
+    return subject, body
+
+
+# Renders console lines for game change event
+def render_game_change_console(event):
+    user, ts, ts_old = event["user"], event["ts"], event["game_ts_old"]
+    platform_str = get_platform_suffix(event)
+    if event["kind"] == "started":
+        return [f"PSN user {user} started playing '{event['game']}'{platform_str}"]
+    played_from = f"User played game from {get_range_of_dates_from_tss(ts_old, ts, short=True, between_sep=' to ')}"
+    if event["kind"] == "changed":
+        return [f"PSN user {user} changed game from '{event['game_old']}' to '{event['game']}'{platform_str} after {calculate_timespan(ts, ts_old)}", played_from]
+    return [f"PSN user {user} stopped playing '{event['game_old']}' after {calculate_timespan(ts, ts_old)}", played_from]
+
+
+# Renders email subject and body for game change event
+def render_game_change_email(event):
+    user, ts, ts_old = event["user"], event["ts"], event["game_ts_old"]
+    platform_str = get_platform_suffix(event)
+    cur_ts = get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')
+    if event["kind"] == "started":
+        return f"PSN user {user} now plays '{event['game']}'{platform_str}", f"PSN user {user} now plays '{event['game']}'{platform_str}{cur_ts}"
+    played_from = f"User played game from {get_range_of_dates_from_tss(ts_old, ts, short=True, between_sep=' to ')}"
+    after_short = f"{calculate_timespan(ts, ts_old, show_seconds=False)}: {get_range_of_dates_from_tss(ts_old, ts, short=True)}"
+    if event["kind"] == "changed":
+        platform_prefix = f"{event['platform']}, " if event.get("platform") else ""
+        subject = f"PSN user {user} changed game to '{event['game']}' ({platform_prefix}after {after_short})"
+        body = f"PSN user {user} changed game from '{event['game_old']}' to '{event['game']}'{platform_str} after {calculate_timespan(ts, ts_old)}\n\n{played_from}{cur_ts}"
+        return subject, body
+    subject = f"PSN user {user} stopped playing '{event['game_old']}' (after {after_short})"
+    body = f"PSN user {user} stopped playing '{event['game_old']}' after {calculate_timespan(ts, ts_old)}\n\n{played_from}{cur_ts}"
+    return subject, body
+
+
+# Renders console lines for profile change event (profile, trophies or titles data of the user changed)
+def render_profile_change_console(event):
+    lines = [f"PSN user {event['user']} {event['data']} data changed:"]
+    for change in event["changes"]:
+        lines.append(f"- {change['field']}: {change['old']} -> {change['new']}")
+    return lines
+
+
+# Renders email subject and body for profile change event
+def render_profile_change_email(event):
+    fields = ", ".join(change["field"] for change in event["changes"])
+    subject = f"PSN user {event['user']} {event['data']} data changed ({fields})"
+    body = "\n".join(render_profile_change_console(event)) + get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')
+    return subject, body
+
+
+# Renders console lines for trophy earned event
+def render_trophy_earned_console(event):
+    return [f"PSN user {event['user']} earned {event['trophy_type']} trophy '{event['trophy_name']}' in '{event['game']}' ({event['platform']}, {get_date_from_ts(event['ts'])})"]
+
+
+# Renders email subject and body for trophy earned event
+def render_trophy_earned_email(event):
+    subject = f"PSN user {event['user']} earned {event['trophy_type']} trophy in '{event['game']}'"
+    body = f"PSN user {event['user']} earned {event['trophy_type']} trophy '{event['trophy_name']}' in '{event['game']}' ({event['platform']})\n\nEarned: {get_date_from_ts(event['ts'])}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
+    return subject, body
+
+
+# Renders console lines for user renamed event (online ID of the monitored account changed)
+def render_user_renamed_console(event):
+    return [f"PSN user {event['user']} changed online ID from '{event['old_online_id']}' to '{event['online_id']}' (account ID {event['account_id']})"]
+
+
+# Console and email renderers per event type: type -> (console renderer, email renderer)
+EVENT_RENDERERS = {
+    "status_change": (render_status_change_console, render_status_change_email),
+    "game_change": (render_game_change_console, render_game_change_email),
+    "profile_change": (render_profile_change_console, render_profile_change_email),
+    "trophy_earned": (render_trophy_earned_console, render_trophy_earned_email),
+    "user_renamed": (render_user_renamed_console, None),
+}
+
+
+# Returns True if email notification should be sent for the event, per-user notification options of the TOML config
+# file (ctx["notify"]) take precedence over the global ones
+def is_email_notification_enabled(event, ctx):
+    notify = ctx.get("notify") or {}
+    if event["type"] == "status_change":
+        return notify.get("ACTIVE_INACTIVE_NOTIFICATION", ACTIVE_INACTIVE_NOTIFICATION) and event.get("notify", False)
+    if event["type"] == "game_change":
+        return notify.get("GAME_CHANGE_NOTIFICATION", GAME_CHANGE_NOTIFICATION)
+    if event["type"] == "trophy_earned":
+        return notify.get("TROPHY_NOTIFICATION", TROPHY_NOTIFICATION)
+    if event["type"] == "profile_change":
+        return notify.get("PROFILE_CHANGE_NOTIFICATION", PROFILE_CHANGE_NOTIFICATION)
+    return False
+
+
+# Output sink printing events to the console (and log file)
+def console_event_sink(event, ctx):
+    renderers = EVENT_RENDERERS.get(event["type"])
+    if renderers and renderers[0]:
+        for line in renderers[0](event):
+            print(line)
+
+
+# Output sink sending email notifications, subject and body are rendered only if notification is enabled for the event
+def email_event_sink(event, ctx):
+    renderers = EVENT_RENDERERS.get(event["type"])
+    if not renderers or not renderers[1] or not is_email_notification_enabled(event, ctx):
+        return
+    m_subject, m_body = renderers[1](event)
+    print(f"Sending email notification to {RECEIVER_EMAIL}")
+    send_email(m_subject, m_body, "", SMTP_SSL)
+
+
+# Output sink writing status & game changes to the CSV file
+# A status and a game change detected in the same poll produce identical rows, so only one row is written per poll
+def csv_event_sink(event, ctx):
+    csv_file_name = ctx.get("csv_file")
+    if not csv_file_name or event["type"] not in ("status_change", "game_change"):
+        return
+    row = (event["status"], event["game"])
+    if row == ctx.get("csv_last_row"):
+        return
+    try:
+        write_csv_entry(csv_file_name, datetime.fromtimestamp(event["ts"], get_local_tz()).replace(tzinfo=None), row[0], row[1])
+        ctx["csv_last_row"] = row
+    except Exception as e:
+        print(f"* Error: {e}")
+        print_cur_ts("Timestamp:\t\t\t")
+
+
+# Output sink appending events as JSON lines to NDJSON_FILE
+def ndjson_event_sink(event, ctx):
+    record = dict(event)
+    record["time"] = datetime.fromtimestamp(event["ts"], get_local_tz()).isoformat()
+    with open(NDJSON_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+# Output sink counting events per type in METRICS
+def metrics_event_sink(event, ctx):
+    metric_inc("events_total")
+    metric_inc(f"events_{event['type']}")
+    write_metrics_file()
+
+
+register_event_sink("console", console_event_sink, lambda: not HEADLESS_MODE)
+register_event_sink("email", email_event_sink, lambda: ACTIVE_INACTIVE_NOTIFICATION or GAME_CHANGE_NOTIFICATION or TROPHY_NOTIFICATION or PROFILE_CHANGE_NOTIFICATION or bool(CONFIG["users"]))
+register_event_sink("csv", csv_event_sink)
+register_event_sink("ndjson", ndjson_event_sink, lambda: bool(NDJSON_FILE))
+register_event_sink("metrics", metrics_event_sink)
 
 
 # Signal handler for SIGUSR1 allowing to switch active/inactive email notifications
@@ -855,6 +1808,7 @@ def increase_active_check_signal_handler(sig, frame):
     print(f"* Signal {sig_name} received")
     print(f"* PSN timers: [active check interval: {display_time(PSN_ACTIVE_CHECK_INTERVAL)}]")
     print_cur_ts("Timestamp:\t\t\t")
+    WAKEUP["reschedule"] = True
 
 
 # Signal handler for SIGABRT allowing to decrease check timer for player activity when user is online by PSN_ACTIVE_CHECK_SIGNAL_VALUE seconds
@@ -866,6 +1820,7 @@ def decrease_active_check_signal_handler(sig, frame):
     print(f"* Signal {sig_name} received")
     print(f"* PSN timers: [active check interval: {display_time(PSN_ACTIVE_CHECK_INTERVAL)}]")
     print_cur_ts("Timestamp:\t\t\t")
+    WAKEUP["reschedule"] = True
 
 
 # Signal handler for SIGHUP allowing to reload secrets from .env
@@ -901,6 +1856,7 @@ def reload_secrets_signal_handler(sig, frame):
                 print(f"* Reloaded {secret} from {env_path}")
 
     print_cur_ts("Timestamp:\t\t\t")
+    WAKEUP["reload"] = True
 
 
 # Finds an optional config file
@@ -908,9 +1864,9 @@ def find_config_file(cli_path=None):
     """
     Search for an optional config file in:
       1) CLI-provided path (must exist if given)
-      2) ./{DEFAULT_CONFIG_FILENAME}
-      3) ~/.{DEFAULT_CONFIG_FILENAME}
-      4) script-directory/{DEFAULT_CONFIG_FILENAME}
+      2) ./{DEFAULT_TOML_CONFIG_FILENAME} or ./{DEFAULT_CONFIG_FILENAME}
+      3) ~/.{DEFAULT_TOML_CONFIG_FILENAME} or ~/.{DEFAULT_CONFIG_FILENAME}
+      4) script-directory/{DEFAULT_TOML_CONFIG_FILENAME} or script-directory/{DEFAULT_CONFIG_FILENAME}
     """
 
     if cli_path:
@@ -918,8 +1874,11 @@ def find_config_file(cli_path=None):
         return str(p) if p.is_file() else None
 
     candidates = [
+        Path.cwd() / DEFAULT_TOML_CONFIG_FILENAME,
         Path.cwd() / DEFAULT_CONFIG_FILENAME,
+        Path.home() / f".{DEFAULT_TOML_CONFIG_FILENAME}",
         Path.home() / f".{DEFAULT_CONFIG_FILENAME}",
+        Path(__file__).parent / DEFAULT_TOML_CONFIG_FILENAME,
         Path(__file__).parent / DEFAULT_CONFIG_FILENAME,
     ]
 
@@ -929,6 +1888,248 @@ def find_config_file(cli_path=None):
     return None
 
 
+# Returns True if the config file is in TOML format (.toml extension), other config files are Python
+def is_toml_config_file(path):
+    return Path(path).suffix.lower() == ".toml"
+
+
+# Returns default values of all options from CONFIG_BLOCK, used as the schema of the TOML config file
+@functools.cache
+def get_config_defaults():
+    defaults = {}
+    exec(CONFIG_BLOCK, {}, defaults)
+    return defaults
+
+
+# Parses the TOML config file, uses tomllib (Python 3.11+) or the tomli library on Python 3.10
+def read_toml_file(path):
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        try:
+            import tomli as tomllib
+        except ModuleNotFoundError:
+            raise RuntimeError("TOML config files need Python 3.11+ or the tomli library, to install it run: pip3 install tomli")
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+# Checks the option value against the type of its default value and its allowed range, returns (value, error message)
+def validate_config_value(name, value, default):
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            return None, "expected true or false"
+    elif isinstance(default, (int, float)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (isinstance(default, int) and isinstance(value, float)):
+            return None, "expected an integer" if isinstance(default, int) else "expected a number"
+        low, high = CONFIG_VALUE_RANGES.get(name, (0, None))
+        if value < low or (high is not None and value > high):
+            return None, f"expected a value from {low} to {high}" if high is not None else f"expected a value of at least {low}"
+        if isinstance(default, float):
+            value = float(value)
+    elif not isinstance(value, str):
+        return None, "expected a string"
+    elif name == "FRIENDS_FILTER" and value:
+        try:
+            re.compile(value)
+        except re.error as e:
+            return None, f"not a valid regex: {e}"
+    return value, None
+
+
+# Validates the parsed TOML config file against the defaults in CONFIG_BLOCK: unknown options, value types and ranges
+# Option names are case-insensitive; returns (options, per-user options, list of errors)
+def parse_toml_config(data):
+    import difflib
+
+    defaults = get_config_defaults()
+    options = {}
+    users = {}
+    errors = []
+
+    for key, value in data.items():
+        if key.lower() == "users" and isinstance(value, dict):
+            for psn_user_id, user_data in value.items():
+                if not isinstance(user_data, dict):
+                    errors.append(f"users.{psn_user_id}: expected a table of options")
+                    continue
+                users[psn_user_id] = {}
+                for user_key, user_value in user_data.items():
+                    name = user_key.upper()
+                    if name not in CONFIG_USER_KEYS:
+                        errors.append(f"users.{psn_user_id}.{user_key}: not a per-user option (allowed: {', '.join(CONFIG_USER_KEYS)})")
+                        continue
+                    user_value, error = validate_config_value(name, user_value, defaults[name])
+                    if error:
+                        errors.append(f"users.{psn_user_id}.{user_key}: {error}")
+                    else:
+                        users[psn_user_id][name] = user_value
+            continue
+
+        name = key.upper()
+        if name not in defaults:
+            hint = difflib.get_close_matches(name, defaults, n=1)
+            errors.append(f"{key}: unknown option" + (f", did you mean {hint[0]}?" if hint else ""))
+            continue
+        value, error = validate_config_value(name, value, defaults[name])
+        if error:
+            errors.append(f"{key}: {error}")
+        else:
+            options[name] = value
+
+    return options, users, errors
+
+
+# Loads and validates the TOML config file, all invalid options are reported at once
+def load_toml_config(path):
+    options, users, errors = parse_toml_config(read_toml_file(path))
+    if errors:
+        raise ValueError(f"{len(errors)} invalid option(s):\n  - " + "\n  - ".join(errors))
+    return options, users
+
+
+# Returns per-user options of the user from the TOML config file, PSN IDs are matched exactly first, then case-insensitively
+def get_user_config(users, psn_user_id):
+    if psn_user_id in users:
+        return users[psn_user_id]
+    return next((options for user, options in users.items() if user.lower() == psn_user_id.lower()), {})
+
+
+# Sets per-user option of the TOML config file in the user state, None removes the override
+# Notification overrides are ignored while SMTP is not configured, like the global notification options
+def set_user_config_option(state, name, value):
+    if name in CONFIG_USER_INTERVAL_KEYS:
+        state[f"config_{CONFIG_USER_INTERVAL_KEYS[name]}"] = value or 0
+    elif value is None or SMTP_HOST.startswith("your_smtp_server_"):
+        state["sink_ctx"]["notify"].pop(name, None)
+    else:
+        state["sink_ctx"]["notify"][name] = value
+
+
+# Applies per-user options of the TOML config file to a new user state
+def apply_user_config(state):
+    for name, value in get_user_config(CONFIG["users"], state["psn_user_id"]).items():
+        set_user_config_option(state, name, value)
+
+
+# Returns the TOML config file in the format printed by --generate-config toml, built from CONFIG_BLOCK (comments kept)
+def get_toml_config_template():
+    defaults = get_config_defaults()
+    lines = []
+    for line in CONFIG_BLOCK.strip("\n").split("\n"):
+        match = re.match(r"^([A-Z][A-Z0-9_]*) = .*?(\s+#.*)?$", line)
+        if not match:
+            lines.append(line)
+            continue
+        value = defaults[match.group(1)]
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False)
+        lines.append(f"{match.group(1)} = {value}{match.group(2) or ''}")
+    lines += [
+        "",
+        "# Per-user overrides of polling intervals and notifications (" + ", ".join(CONFIG_USER_KEYS) + ")",
+        '# [users."psn_user_id"]',
+        "# PSN_CHECK_INTERVAL = 60",
+        "# GAME_CHANGE_NOTIFICATION = true",
+    ]
+    return "\n".join(lines)
+
+
+# Returns the modification time and size of the config file, None if it cannot be read
+def get_config_file_stamp(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+# Starts the thread checking the TOML config file for changes every CONFIG_RELOAD_INTERVAL seconds, a change wakes up
+# the monitoring loop, which reloads the config (see reload_toml_config())
+def start_config_watcher(path):
+    get_wakeup_selector()
+
+    def watch():
+        stamp = get_config_file_stamp(path)
+        while True:
+            time.sleep(CONFIG_RELOAD_INTERVAL)
+            new_stamp = get_config_file_stamp(path)
+            if new_stamp is not None and new_stamp != stamp:
+                stamp = new_stamp
+                WAKEUP["config"] = True
+                wake_up_loop()
+
+    threading.Thread(target=watch, name="config_watcher", daemon=True).start()
+
+
+# Returns value of the option to print, secrets are masked
+def format_config_value(name, value):
+    return "***" if name in SECRET_KEYS and value else repr(value)
+
+
+# Applies changes of the TOML config file to the running tool, without a restart and PSN re-authentication (unless
+# PSN_NPSSO changed): only changed options are set, options used only at startup (CONFIG_RESTART_KEYS) and options
+# set by command-line flags or .env are reported and left alone; an invalid config file keeps the current config
+def reload_toml_config(ctx):
+    global LIVENESS_CHECK_COUNTER
+
+    try:
+        options, users = load_toml_config(CONFIG["path"])
+    except Exception as e:
+        print(f"* Error reloading config file '{CONFIG['path']}', current config is kept: {e}")
+        print_cur_ts("Timestamp:\t\t\t")
+        return
+
+    defaults = get_config_defaults()
+    changes = []
+    applied = set()
+    for name in sorted(set(CONFIG["options"]) | set(options)):
+        old_value = CONFIG["options"].get(name, defaults[name])
+        value = options.get(name, defaults[name])
+        if value == old_value:
+            continue
+        if name in CONFIG_RESTART_KEYS or (name in CONFIG_REFRESH_KEYS and globals()[name] <= 0 < value):
+            changes.append(f"{name}: not applied, needs a restart")
+        elif name in CONFIG["overridden"]:
+            changes.append(f"{name}: not applied, overridden at startup (command-line flag, .env or missing SMTP settings)")
+        else:
+            globals()[name] = value
+            applied.add(name)
+            changes.append(f"{name}: {format_config_value(name, old_value)} -> {format_config_value(name, value)}")
+
+    if SMTP_HOST.startswith("your_smtp_server_"):
+        for name in ("ACTIVE_INACTIVE_NOTIFICATION", "GAME_CHANGE_NOTIFICATION", "TROPHY_NOTIFICATION", "PROFILE_CHANGE_NOTIFICATION", "ERROR_NOTIFICATION"):
+            globals()[name] = False
+    if not HEADLESS_MODE and applied & {"PSN_CHECK_INTERVAL", "LIVENESS_CHECK_INTERVAL"}:
+        LIVENESS_CHECK_COUNTER = LIVENESS_CHECK_INTERVAL / PSN_CHECK_INTERVAL
+
+    states = ctx["states"]()
+    for state in states:
+        old_user_options = get_user_config(CONFIG["users"], state["psn_user_id"])
+        user_options = get_user_config(users, state["psn_user_id"])
+        for name in CONFIG_USER_KEYS:
+            if user_options.get(name) != old_user_options.get(name):
+                set_user_config_option(state, name, user_options.get(name))
+                overridden = name in CONFIG_USER_INTERVAL_KEYS and state[CONFIG_USER_INTERVAL_KEYS[name]]
+                changes.append(f"{name} of {state['psn_user_id']}: {old_user_options.get(name, 'global')} -> {user_options.get(name, 'global')}" + (" (overridden via the control socket until set back to default)" if overridden else ""))
+
+    CONFIG["options"] = options
+    CONFIG["users"] = users
+
+    if not changes:
+        return
+    print(f"* Config file '{CONFIG['path']}' reloaded:")
+    for change in changes:
+        print(f"  - {change}")
+    if "PSN_NPSSO" in applied:
+        apply_psn_npsso_change()
+    else:
+        print_cur_ts("Timestamp:\t\t\t")
+    reschedule_user_polls(ctx, states)
+
+
 # Resolves an executable path by checking if it's a valid file or searching in $PATH
 def resolve_executable(path):
     if os.path.isfile(path) and os.access(path, os.X_OK):
@@ -962,50 +2163,60 @@ def normalize_ascii(s):
     return s.strip()
 
 
-# Prints the last N earned trophies across titles with game, type and earn date
-def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
+# Returns the first attribute of the object (from given names, to support different psnawp versions) which is not None
+def get_first_attr(obj, *names, default=None):
+    for n in names:
+        if hasattr(obj, n):
+            v = getattr(obj, n)
+            if v is not None:
+                return v
+    return default
+
+
+# Returns platforms to try when fetching trophies of the title, the title's own platform first
+def get_trophy_platforms(title):
     PT = None
     try:
         from psnawp_api.models.trophies import PlatformType as PT  # 3.x
     except Exception:
         PT = None  # fallback to string platforms later
 
-    def _get(obj, *names, default=None):
-        for n in names:
-            if hasattr(obj, n):
-                v = getattr(obj, n)
-                if v is not None:
-                    return v
-        return default
-
-    def _platforms_to_try(title):
-        raw = getattr(title, "platform", None)
-        raw_val = getattr(raw, "value", raw)
-        s = (str(raw_val).lower() if raw_val else "")
-        if PT:
-            if "ps5" in s:
-                return [PT.PS5, PT.PS4]
-            if "ps4" in s:
-                return [PT.PS4, PT.PS5]
-            return [PT.PS5, PT.PS4]
-        # string fallback
+    raw = get_first_attr(title, "platform", "title_platform")
+    if isinstance(raw, (set, frozenset, list, tuple)):
+        raw = next(iter(raw), None)
+    raw_val = getattr(raw, "value", raw)
+    s = (str(raw_val).lower() if raw_val else "")
+    if PT:
         if "ps5" in s:
-            return ["ps5", "ps4"]
+            return [PT.PS5, PT.PS4]
         if "ps4" in s:
-            return ["ps4", "ps5"]
+            return [PT.PS4, PT.PS5]
+        return [PT.PS5, PT.PS4]
+    # string fallback
+    if "ps5" in s:
         return ["ps5", "ps4"]
+    if "ps4" in s:
+        return ["ps4", "ps5"]
+    return ["ps5", "ps4"]
+
+
+# Returns datetime when the trophy was earned
+def get_trophy_earned_dt(tr):
+    return get_first_attr(tr, "earned_date_time", "earnedDateTime", default=None)
+
 
-    def _earn_dt(tr):
-        return _get(tr, "earned_date_time", "earnedDateTime", default=None)
+# Returns trophy type as upper case string (PLATINUM, GOLD, SILVER, BRONZE)
+def get_trophy_type_str(tr):
+    raw = get_first_attr(tr, "trophy_type", "trophyType", default=None)
+    if raw is None:
+        return "UNKNOWN"
+    if hasattr(raw, "name"):
+        return raw.name
+    return str(raw).upper()
 
-    def _trophy_type_str(tr):
-        raw = _get(tr, "trophy_type", "trophyType", default=None)
-        if raw is None:
-            return "UNKNOWN"
-        if hasattr(raw, "name"):
-            return raw.name
-        return str(raw).upper()
 
+# Prints the last N earned trophies across titles with game, type and earn date
+def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
     # title-name resolver (cache)
     _title_name_cache = {}
 
@@ -1038,6 +2249,7 @@ def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
 
         # A) groups often carry the title name
         try:
+            rate_limit_acquire("trophies")
             for g in psn_user.trophy_groups(np_communication_id=npcomm, platform=platform):
                 name = _first_name_like(g)
                 if name:
@@ -1048,6 +2260,7 @@ def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
         # B) per-title summary
         if not name:
             try:
+                rate_limit_acquire("trophies")
                 summ = psn_user.trophy_summary(np_communication_id=npcomm, platform=platform)
                 name = _first_name_like(summ)
             except Exception:
@@ -1056,6 +2269,7 @@ def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
         # C) scan titles
         if not name:
             try:
+                rate_limit_acquire("trophies")
                 for tt in psn_user.trophy_titles(limit=title_limit):
                     nc = getattr(tt, "np_communication_id", None) or getattr(tt, "npCommunicationId", None)
                     if nc == npcomm:
@@ -1076,24 +2290,28 @@ def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
 
     # 1) list titles (no special args for cross-version compat)
     try:
+        rate_limit_acquire("trophies")
         titles_iter = psn_user.trophy_titles(limit=title_limit)
     except Exception:
         titles_iter = []
 
     for tt in titles_iter:
-        npcomm = _get(tt, "np_communication_id", "npCommunicationId", default=None)
+        npcomm = get_first_attr(tt, "np_communication_id", "npCommunicationId", default=None)
         if not npcomm:
             continue
 
-        for plat in _platforms_to_try(tt):
+        for plat in get_trophy_platforms(tt):
             try:
+                rate_limit_acquire("trophies")
                 it = psn_user.trophies(
                     np_communication_id=npcomm,
                     platform=plat,
                     include_progress=True,
                     trophy_group_id="all",
                 )
-            except Exception:
+            except Exception as e:
+                if is_rate_limited(e):
+                    rate_limit_throttled(get_retry_after(e))
                 continue
 
             got_any_for_title = False
@@ -1101,13 +2319,13 @@ def print_last_earned_trophies(psn_user, max_items=5, title_limit=15):
                 got_any_for_title = True
                 if not getattr(tr, "earned", False):
                     continue
-                dt = _earn_dt(tr)
+                dt = get_trophy_earned_dt(tr)
                 if not dt:
                     continue
 
                 game_name = normalize_ascii(_resolve_title_name(npcomm, plat))
-                ttype = _trophy_type_str(tr)
-                tname = _get(tr, "trophy_name", "trophyName", default=None)
+                ttype = get_trophy_type_str(tr)
+                tname = get_first_attr(tr, "trophy_name", "trophyName", default=None)
                 if not tname:
                     tname = "(hidden)" if getattr(tr, "hidden", False) else "(unknown)"
                 tname = normalize_ascii(tname)
@@ -1159,10 +2377,13 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
 
     print_step("Authenticating with PSN...")
     try:
-        psnawp = PSNAWP(PSN_NPSSO)
+        rate_limit_acquire("auth")
+        npsso = get_npsso_codes(PSN_NPSSO)[0]
+        psnawp = get_psnawp_class()(npsso)
+        install_psnawp_retry_after_hook(psnawp)
         psn_user = psnawp.user(online_id=psn_user_id)
     except Exception as e:
-        hint = probe_npsso_auth_error(PSN_NPSSO) if "something went wrong while authenticating" in str(e).lower() else None
+        hint = probe_npsso_auth_error(npsso) if "something went wrong while authenticating" in str(e).lower() else None
         if hint:
             print(f"\n* Error: {hint}")
         else:
@@ -1173,12 +2394,15 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
     print_step("Fetching profile info...")
     try:
         accountid = psn_user.account_id
+        rate_limit_acquire("profile")
         profile = psn_user.profile()
         aboutme = profile.get("aboutMe")
         isplus = profile.get("isPlus")
         langs = profile.get("languages") or []
         is_verified = profile.get("isOfficiallyVerified")
+        rate_limit_acquire("profile")
         fs = psn_user.friendship()
+        rate_limit_acquire("profile")
         share = psn_user.get_shareable_profile_link()
     except Exception as e:
         print(f"\n* Error: {e}")
@@ -1187,6 +2411,7 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
 
     print_step("Fetching presence info...")
     try:
+        rate_limit_acquire("presence")
         psn_user_presence = psn_user.get_presence()
         parse_presence(psn_user_presence)
     except Exception as e:
@@ -1230,32 +2455,24 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
     print_ok()
     print()
 
-    psn_last_status_file = f"psn_{psn_user_id}_last_status.json"
+    last_status_read = state_store_get(psn_user_id, "last_status", migrate=False)
     status_ts_old = int(time.time())
 
-    if os.path.isfile(psn_last_status_file):
-        try:
-            with open(psn_last_status_file, 'r', encoding="utf-8") as f:
-                last_status_read = json.load(f)
-            if last_status_read:
-                last_status_ts = last_status_read[0]
-                last_status = last_status_read[1]
-
-                if lastonline_ts and status == "offline":
-                    if lastonline_ts >= last_status_ts:
-                        status_ts_old = lastonline_ts
-                    else:
-                        status_ts_old = last_status_ts
-                elif not lastonline_ts and status == "offline":
-                    status_ts_old = last_status_ts
-                elif status and status != "offline" and status == last_status:
-                    status_ts_old = last_status_ts
-        except Exception:
-            if lastonline_ts and status == "offline":
-                status_ts_old = lastonline_ts
-    else:
+    if last_status_read:
+        last_status_ts = last_status_read[0]
+        last_status = last_status_read[1]
+
         if lastonline_ts and status == "offline":
-            status_ts_old = lastonline_ts
+            if lastonline_ts >= last_status_ts:
+                status_ts_old = lastonline_ts
+            else:
+                status_ts_old = last_status_ts
+        elif not lastonline_ts and status == "offline":
+            status_ts_old = last_status_ts
+        elif status and status != "offline" and status == last_status:
+            status_ts_old = last_status_ts
+    elif lastonline_ts and status == "offline":
+        status_ts_old = lastonline_ts
 
     print(f"PlayStation ID:\t\t\t{psn_user_id}")
     print(f"PSN account ID:\t\t\t{accountid}")
@@ -1317,19 +2534,14 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
         print(f"\n* Last time user was available:\t{last_status_dt_str}")
         print(f"* User is OFFLINE for:\t\t{calculate_timespan(now_local(), int(status_ts_old), show_seconds=False)}")
     elif status != "offline":
-        if os.path.isfile(psn_last_status_file):
-            try:
-                with open(psn_last_status_file, 'r', encoding="utf-8") as f:
-                    last_status_read = json.load(f)
-                if last_status_read and last_status_read[1] == status:
-                    print(f"* User is {str(status).upper()} for:\t\t{calculate_timespan(now_local(), int(last_status_read[0]), show_seconds=False)}")
-            except Exception:
-                pass
+        if last_status_read and last_status_read[1] == status:
+            print(f"* User is {str(status).upper()} for:\t\t{calculate_timespan(now_local(), int(last_status_read[0]), show_seconds=False)}")
 
     # Show trophy summary and last earned trophies only if requested
     if include_trophies:
         try:
-            print(f"\n* Getting trophy summary ...")
+            print("\n* Getting trophy summary ...")
+            rate_limit_acquire("trophies")
             ts = psn_user.trophy_summary()
             et = ts.earned_trophies
             prog = int(ts.progress) if ts.progress is not None else 0
@@ -1393,7 +2605,8 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
                 return f"{s[:left]}{ellipsis}{s[-right:]}"
 
             recent_entries = []
-            print(f"\n* Getting list of recently played games ...")
+            print("\n* Getting list of recently played games ...")
+            rate_limit_acquire("titles")
             for i, t in enumerate(psn_user.title_stats(limit=10, page_size=50), 1):
                 if not t:
                     continue
@@ -1411,7 +2624,6 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
 
             # Decide column widths based on terminal size
             try:
-                import shutil
                 term_width = shutil.get_terminal_size(fallback=(100, 24)).columns
             except Exception:
                 term_width = 100
@@ -1463,28 +2675,2470 @@ def get_user_info(psn_user_id, include_trophies=False, show_recent_games=True):
         print(f"\nUser is currently in-game:\t{game_name}{launchplatform_str}")
 
 
-# Main function that monitors gaming activity of the specified PSN user
-def psn_monitor_user(psn_user_id, csv_file_name):
-
-    alive_counter = 0
-    status_ts = 0
-    status_ts_old = 0
-    status_online_start_ts = 0
-    status_online_start_ts_old = 0
-    game_ts = 0
-    game_ts_old = 0
-    lastonline_ts = 0
-    status = ""
-    game_total_ts = 0
-    games_number = 0
-    game_total_after_offline_counted = False
+# Closes HTTP sessions held by the PSNAWP object
+def close_psnawp_sessions(obj):
+    try:
+        if obj and hasattr(obj, "close"):
+            try:
+                obj.close()
+            except Exception:
+                pass
+        for attr in ("session", "_session", "http", "_http", "client", "_client"):
+            s = getattr(obj, attr, None)
+            if s and hasattr(s, "close"):
+                try:
+                    s.close()
+                except Exception:
+                    pass
+    except Exception:
+        pass
+
+
+# Creates a new shared PSNAWP session with the NPSSO of the current credential replacing the previous one, raises on failure
+# Bumping the generation makes all monitored users re-resolve their PSNAWP user objects (see get_psn_user())
+def create_psn_session():
+    if not PSN_CREDENTIALS["pool"]:
+        sync_psn_credentials()
+    if PSN_SESSION["client"] is not None:
+        close_psnawp_sessions(PSN_SESSION["client"])
+        PSN_SESSION["client"] = None
+    PSN_SESSION["generation"] += 1
+    rate_limit_acquire("auth")
+    PSN_SESSION["client"] = get_psnawp_class()(PSN_SESSION["npsso"])
+    install_psnawp_retry_after_hook(PSN_SESSION["client"])
+    return PSN_SESSION["client"]
+
+
+# Recreates the shared PSNAWP session unless it was recreated recently or the circuit breaker is open
+def recreate_psn_session_rate_limited():
+    now = int(time.time())
+    if (now - PSN_SESSION["last_recreate_ts"]) < PSN_SESSION_RECREATE_COOLDOWN or circuit_breaker_wait() > 0:
+        return False
+    try:
+        create_psn_session()
+        PSN_SESSION["last_recreate_ts"] = now
+        circuit_breaker_record(True)
+        return True
+    except Exception:
+        circuit_breaker_record(False)
+        return False
+
+
+# Returns PSNAWP user object of the monitored user bound to the current shared PSNAWP session
+def get_psn_user(state):
+    if PSN_SESSION["client"] is None:
+        create_psn_session()
+    if state["psn_user"] is None or state["session_generation"] != PSN_SESSION["generation"]:
+        state["psn_user"] = resolve_psn_user(PSN_SESSION["client"], state["psn_user_id"])
+        state["session_generation"] = PSN_SESSION["generation"]
+    return state["psn_user"]
+
+
+# Default base URL of PSN user profile API used by the lean presence client if psnawp endpoints are not available
+PSN_PROFILE_API_URL = "https://m.np.playstation.com/api/userProfile/v1/internal/users"
+
+# State of the lean presence client (see RAW_PRESENCE_CLIENT): kept-alive HTTP connections of the process (pid) per
+# host, JSON decoder and the reason the client is not usable with the installed psnawp (PSNAWP is used instead)
+RAW_PRESENCE = {"connections": {}, "pid": None, "loads": None, "unavailable": ""}
+
+
+# HTTP error returned by the lean presence client, response exposes status_code & headers like requests responses do
+class PsnRawHttpError(Exception):
+    def __init__(self, status_code, headers, body):
+        super().__init__(f"HTTP {status_code} from PSN presence API: {body[:200]!r}")
+        self.status_code = status_code
+        self.response = self
+        self.headers = headers
+
+
+# Returns the fastest available JSON decoder: orjson.loads if installed, json.loads otherwise
+def get_json_loads():
+    if RAW_PRESENCE["loads"] is None:
+        try:
+            import orjson
+            RAW_PRESENCE["loads"] = orjson.loads
+        except ImportError:
+            RAW_PRESENCE["loads"] = json.loads
+    return RAW_PRESENCE["loads"]
+
+
+# Returns the current access token of the PSNAWP session (client or user object), None if the installed psnawp version
+# does not expose it; psnawp versions with obtain_fresh_access_token() refresh an expired token first (a request to PSN),
+# with older ones the stored token is returned as is and, if expired, rejected by PSN and refreshed by the PSNAWP fallback
+def get_psnawp_access_token(client):
+    auth = getattr(client, "authenticator", None) or getattr(client, "_request_builder", None)
+    for obj in (auth, getattr(auth, "authenticator", None)):
+        if obj is None:
+            continue
+        if callable(getattr(obj, "obtain_fresh_access_token", None)):
+            return obj.obtain_fresh_access_token()
+        for attr in ("token_response", "_auth_properties"):
+            props = getattr(obj, attr, None)
+            if isinstance(props, dict) and props.get("access_token"):
+                return props["access_token"]
+    return None
+
+
+# Returns base URL of PSN user profile API, following PSN_API_BASE_URL (see apply_psn_api_base_url())
+def get_psn_profile_api_url():
+    try:
+        from psnawp_api.utils.endpoints import BASE_PATH
+        return BASE_PATH["profile_uri"]
+    except Exception:
+        return re.sub(r"^https?://[^/]+", PSN_API_BASE_URL.rstrip("/"), PSN_PROFILE_API_URL) if PSN_API_BASE_URL else PSN_PROFILE_API_URL
+
+
+# Returns base URL of PSN user profile API serving presences, taken from the installed psnawp (v2 API with PSNAWP 3.x,
+# v1 before), so the lean client and PSNAWP fetch presence from the same endpoint; follows PSN_API_BASE_URL
+def get_psn_presence_api_url():
+    try:
+        from psnawp_api.utils.endpoints import BASE_PATH
+        return BASE_PATH.get("profile_uri_v2") or BASE_PATH["profile_uri"]
+    except Exception:
+        return get_psn_profile_api_url()
+
+
+# Returns URL of the presence endpoint of the user
+def get_raw_presence_url(account_id):
+    return f"{get_psn_presence_api_url()}/{account_id}/basicPresences?type=primary"
+
+
+# Sends GET request over the kept-alive connection to the host of the URL and returns the status, headers and body
+# A connection closed by the server while idle is reopened once, connections are not shared with forked processes
+def raw_http_get(url, headers):
+    import http.client
+    from urllib.parse import urlsplit
+
+    if RAW_PRESENCE["pid"] != os.getpid():
+        RAW_PRESENCE["connections"] = {}
+        RAW_PRESENCE["pid"] = os.getpid()
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+
+    for attempt in range(2):
+        conn = RAW_PRESENCE["connections"].get(key)
+        reused = conn is not None
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = RAW_PRESENCE["connections"][key] = conn_class(parts.netloc, timeout=FUNCTION_TIMEOUT)
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except BaseException as e:
+            conn.close()
+            RAW_PRESENCE["connections"].pop(key, None)
+            if reused and attempt == 0 and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)):
+                continue
+            raise
+        if response.will_close:
+            conn.close()
+            RAW_PRESENCE["connections"].pop(key, None)
+        return response.status, response.headers, body
+
+
+# Fetches presence of the user directly from the PSN API with the given access token and returns it in the shape
+# returned by PSNAWP's get_presence() reduced to the fields parse_presence() needs; raises PsnRawHttpError on HTTP errors
+def fetch_raw_presence(account_id, access_token):
+    status_code, headers, body = raw_http_get(get_raw_presence_url(account_id), {"Authorization": f"Bearer {access_token}", "Accept": "application/json"})
+    if status_code != 200:
+        raise PsnRawHttpError(status_code, headers, body)
+    try:
+        basic = get_json_loads()(body).get("basicPresence")
+    except (ValueError, AttributeError) as e:
+        raise PsnMalformedResponse(f"malformed presence response: {e}")
+    if not isinstance(basic, dict):
+        return {"basicPresence": basic}
+    presence = {"availability": basic.get("availability"), "primaryPlatformInfo": basic.get("primaryPlatformInfo")}
+    if "gameTitleInfoList" in basic:
+        gtil = basic["gameTitleInfoList"]
+        presence["gameTitleInfoList"] = gtil[:1] if isinstance(gtil, list) else gtil
+    return {"basicPresence": presence}
+
+
+# Sends GET request to the PSN API with the session of the current credential and returns the decoded JSON response
+# The lean client (see raw_http_get()) is used with the access token of the PSNAWP session, PSNAWP's request builder
+# when the token is not exposed by the installed psnawp version or was rejected (PSNAWP refreshes it)
+def psn_api_get_json(url):
+    if PSN_SESSION["client"] is None:
+        create_psn_session()
+    client = PSN_SESSION["client"]
+    access_token = get_psnawp_access_token(client)
+    if access_token:
+        status_code, headers, body = raw_http_get(url, {"Authorization": f"Bearer {access_token}", "Accept": "application/json"})
+        if status_code == 200:
+            try:
+                return get_json_loads()(body)
+            except ValueError as e:
+                raise PsnMalformedResponse(f"malformed response from {url.split('?')[0]}: {e}")
+        if status_code != 401:
+            raise PsnRawHttpError(status_code, headers, body)
+        metric_inc("raw_presence_fallbacks")
+    auth = getattr(client, "authenticator", None) or getattr(client, "_request_builder", None)
+    return auth.get(url=url).json()
+
+
+# Returns parsed presence of the user (see parse_presence()), fetched by the lean presence client if RAW_PRESENCE_CLIENT
+# is enabled and by PSNAWP otherwise; PSNAWP is also used when the token is rejected (it refreshes it) or not available
+def get_user_presence(state):
+    psn_user = get_psn_user(state)
+    if RAW_PRESENCE_CLIENT and not RAW_PRESENCE["unavailable"]:
+        access_token = get_psnawp_access_token(PSN_SESSION["client"])
+        account_id = getattr(psn_user, "account_id", None)
+        if access_token and account_id:
+            try:
+                return parse_presence(fetch_raw_presence(account_id, access_token))
+            except PsnRawHttpError as e:
+                if e.status_code != 401:
+                    raise
+                metric_inc("raw_presence_fallbacks")
+                rate_limit_acquire("presence")
+        else:
+            RAW_PRESENCE["unavailable"] = "access token" if not access_token else "account ID"
+            print(f"* Raw presence client cannot get {RAW_PRESENCE['unavailable']} from the installed psnawp version, using PSNAWP")
+    return parse_presence(psn_user.get_presence())
+
+
+# Cache of account IDs loaded from PSN_ID_CACHE_FILE: lower-case online ID -> {"account_id", "online_id", "updated"}
+PSN_ID_CACHE = {"entries": None}
+
+
+# Returns cache of account IDs, loaded from PSN_ID_CACHE_FILE on first use
+def get_psn_id_cache():
+    if PSN_ID_CACHE["entries"] is None:
+        PSN_ID_CACHE["entries"] = {}
+        if PSN_ID_CACHE_FILE and os.path.isfile(PSN_ID_CACHE_FILE):
+            try:
+                with open(PSN_ID_CACHE_FILE, "r", encoding="utf-8") as f:
+                    PSN_ID_CACHE["entries"] = json.load(f)
+            except Exception as e:
+                print(f"* Cannot load account ID cache from '{PSN_ID_CACHE_FILE}' file: {e}")
+    return PSN_ID_CACHE["entries"]
+
+
+# Stores account ID of the monitored user in the cache and writes the cache file (atomically) unless write is False
+def save_psn_id(psn_user_id, account_id, online_id, write=True):
+    entries = get_psn_id_cache()
+    entries[psn_user_id.lower()] = {"account_id": str(account_id), "online_id": online_id, "updated": int(time.time())}
+    if write:
+        write_psn_id_cache()
+
+
+# Merges two caches of account IDs: the newest entry of every account ID wins, so renames seen by one process replace
+# the old online ID cached by another
+def merge_psn_id_caches(entries, other):
+    newest = {}
+    for key, entry in list(other.items()) + list(entries.items()):
+        cur = newest.get(entry["account_id"])
+        if cur is None or entry.get("updated", 0) >= cur[1].get("updated", 0):
+            newest[entry["account_id"]] = (key, entry)
+    return {key: entry for key, entry in newest.values()}
+
+
+# Writes the cache of account IDs to PSN_ID_CACHE_FILE (atomically), merged with the file under a lock so processes
+# sharing the file (workers) do not overwrite each other's entries
+def write_psn_id_cache():
+    entries = get_psn_id_cache()
+    if not PSN_ID_CACHE_FILE:
+        return
+    tmp_file = f"{PSN_ID_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(f"{PSN_ID_CACHE_FILE}.lock", "a", encoding="utf-8") as lock_f:
+            lock_file(lock_f)
+            try:
+                if os.path.isfile(PSN_ID_CACHE_FILE):
+                    try:
+                        with open(PSN_ID_CACHE_FILE, "r", encoding="utf-8") as f:
+                            entries = merge_psn_id_caches(entries, json.load(f))
+                    except ValueError:
+                        pass
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, indent=2, sort_keys=True)
+                os.replace(tmp_file, PSN_ID_CACHE_FILE)
+            finally:
+                lock_file(lock_f, lock=False)
+        PSN_ID_CACHE["entries"] = entries
+    except Exception as e:
+        print(f"* Cannot write account ID cache to '{PSN_ID_CACHE_FILE}' file: {e}")
+
+
+# Returns PSNAWP user object built from the cached account ID without a request to PSN, None if the installed
+# psnawp version does not allow it
+def build_psn_user(client, online_id, account_id):
+    try:
+        from psnawp_api.models.user import User
+    except Exception:
+        return None
+    for attr in ("authenticator", "_request_builder"):
+        auth = getattr(client, attr, None)
+        if auth is not None:
+            try:
+                return User(auth, online_id, account_id)
+            except Exception:
+                return None
+    return None
+
+
+# Returns PSNAWP user object of the PSN user, using the cached account ID when possible (refreshed by online ID
+# lookup on cache miss); a lookup returning account ID cached under another online ID means the user was renamed
+def resolve_psn_user(client, psn_user_id):
+    entry = get_psn_id_cache().get(psn_user_id.lower())
+    if entry:
+        psn_user = build_psn_user(client, entry["online_id"], entry["account_id"])
+        if psn_user is None:
+            try:
+                rate_limit_acquire("profile")
+                psn_user = client.user(account_id=entry["account_id"])
+            except Exception as e:
+                if classify_psn_exception(e) in ("auth", "ratelimited", "transient"):
+                    raise
+                psn_user = None
+            if psn_user is not None and psn_user.online_id != entry["online_id"]:
+                report_online_id_change(psn_user_id, entry["online_id"], psn_user.online_id, entry["account_id"])
+        if psn_user is not None:
+            metric_inc("psn_id_cache_hits")
+            return psn_user
+
+    metric_inc("psn_id_cache_misses")
+    rate_limit_acquire("profile")
+    psn_user = client.user(online_id=psn_user_id)
+    for cached in list(get_psn_id_cache().values()):
+        if cached["account_id"] == str(psn_user.account_id) and cached["online_id"].lower() != psn_user.online_id.lower():
+            report_online_id_change(psn_user_id, cached["online_id"], psn_user.online_id, psn_user.account_id)
+    save_psn_id(psn_user_id, psn_user.account_id, psn_user.online_id)
+    return psn_user
+
+
+# Emits user renamed event when the online ID of the account changed and updates the cache
+def report_online_id_change(psn_user_id, old_online_id, online_id, account_id):
+    for key, cached in list(get_psn_id_cache().items()):
+        if cached["account_id"] == str(account_id) and key != psn_user_id.lower():
+            del get_psn_id_cache()[key]
+    save_psn_id(psn_user_id, account_id, online_id)
+    emit_event(make_event("user_renamed", psn_user_id, int(time.time()), old_online_id=old_online_id, online_id=online_id, account_id=str(account_id)), {"user": psn_user_id})
+    print_cur_ts("Timestamp:\t\t\t")
+
+
+# Detects online ID renames of the user in refreshed profile data (see REFRESH_TASKS), compared with the cached online
+# ID or, without a cache entry, with the previous snapshot
+def check_online_id_rename(state, old_snapshot, new_snapshot, since_ts):
+    entry = get_psn_id_cache().get(state["psn_user_id"].lower())
+    online_id = new_snapshot.get("online_id")
+    old_online_id = entry["online_id"] if entry else (old_snapshot or {}).get("online_id")
+    if online_id and old_online_id and online_id != old_online_id:
+        account_id = entry["account_id"] if entry else getattr(state.get("psn_user"), "account_id", "")
+        report_online_id_change(state["psn_user_id"], old_online_id, online_id, account_id)
+
+
+# Returns NPSSO codes given in PSN_NPSSO (several codes are separated by commas)
+def get_npsso_codes(npsso):
+    return list(dict.fromkeys(code.strip() for code in str(npsso).split(",") if code.strip()))
+
+
+# Returns short label of the NPSSO credential used in messages, never the whole code
+def get_credential_label(credential):
+    return f"#{credential['id']} (...{credential['session']['npsso'][-4:]})"
+
+
+# Makes the credential current: PSN calls made from now on use its session and rate limiter
+def use_psn_credential(credential):
+    global PSN_SESSION, RATE_LIMITER
+    PSN_SESSION = credential["session"]
+    RATE_LIMITER = credential["limiter"]
+
+
+# Rebuilds the pool of NPSSO credentials when PSN_NPSSO changed (e.g. .env updated + SIGHUP), returns True if it changed
+# Credentials with unchanged codes keep their sessions and health, sessions of removed codes are closed
+def sync_psn_credentials():
+    if PSN_NPSSO == PSN_CREDENTIALS["source"] and PSN_CREDENTIALS["pool"]:
+        return False
+    old_pool = {credential["session"]["npsso"]: credential for credential in PSN_CREDENTIALS["pool"]}
+    pool = []
+    for i, code in enumerate(get_npsso_codes(PSN_NPSSO), 1):
+        credential = old_pool.pop(code, None)
+        if credential is None:
+            credential = {"session": {"client": None, "generation": 0, "npsso": code, "last_recreate_ts": 0}, "limiter": {"rate": 0.0, "tokens": 0.0, "updated": 0.0, "blocked_until": 0.0}, "healthy": True, "error": "", "users": 0, "retry_ts": 0, "retry_delay": 0}
+        credential["id"] = i
+        pool.append(credential)
+    for credential in old_pool.values():
+        if credential["session"]["client"] is not None:
+            close_psnawp_sessions(credential["session"]["client"])
+            credential["session"]["client"] = None
+    PSN_CREDENTIALS["source"] = PSN_NPSSO
+    PSN_CREDENTIALS["pool"] = pool
+    if pool and not any(PSN_SESSION is credential["session"] for credential in pool):
+        use_psn_credential(pool[0])
+    METRICS["credentials_total"] = len(pool)
+    METRICS["credentials_healthy"] = sum(1 for credential in pool if credential["healthy"])
+    return True
+
+
+# Returns NPSSO credential the user is polled with: the user stays on its credential while it is healthy and not
+# overloaded, otherwise it is moved to the healthy credential with the fewest users (the first one in the pool on ties)
+# If no credential is healthy all of them are used, so auth errors keep being reported until the pool is reloaded
+def select_psn_credential(state):
+    probe_psn_credentials()
+    pool = PSN_CREDENTIALS["pool"]
+    credential = state["credential"]
+    candidates = [c for c in pool if c["healthy"]] or pool
+    best = min(candidates, key=lambda c: c["users"])
+    if credential is not None and any(credential is c for c in candidates) and credential["users"] - best["users"] <= 1:
+        return credential
+    if credential is not None:
+        credential["users"] -= 1
+    best["users"] += 1
+    state["credential"] = best
+    state["psn_user"] = None
+    return best
+
+
+# Unassigns the NPSSO credential of the user which is no longer monitored, so it does not count in later selections
+def release_psn_credential(state):
+    if state["credential"] is not None:
+        state["credential"]["users"] -= 1
+        state["credential"] = None
+
+
+# Probes NPSSO credentials taken out of rotation whose retry time came (see NPSSO_RETRY_INTERVAL) by creating their
+# session; credentials which authenticate again are put back into rotation, the others wait twice as long
+# The current credential is restored afterwards
+def probe_psn_credentials():
+    now = time.time()
+    due = [c for c in PSN_CREDENTIALS["pool"] if not c["healthy"] and c["retry_ts"] and c["retry_ts"] <= now]
+    if not due:
+        return
+    current = next((c for c in PSN_CREDENTIALS["pool"] if c["session"] is PSN_SESSION), None)
+    for credential in due:
+        use_psn_credential(credential)
+        try:
+            create_psn_session()
+        except Exception as e:
+            credential["error"] = str(e)
+            credential["retry_delay"] = min(max(credential["retry_delay"] * 2, NPSSO_RETRY_INTERVAL, 60), 86400)
+            credential["retry_ts"] = now + credential["retry_delay"]
+            print(f"* NPSSO credential {get_credential_label(credential)} still fails authentication, next probe in {display_time(credential['retry_delay'])}: {e}")
+            continue
+        credential.update(healthy=True, error="", retry_ts=0, retry_delay=0)
+        metric_inc("credentials_recovered")
+        print(f"* NPSSO credential {get_credential_label(credential)} authenticated again and is back in rotation")
+    if current is not None:
+        use_psn_credential(current)
+    METRICS["credentials_healthy"] = sum(1 for c in PSN_CREDENTIALS["pool"] if c["healthy"])
+    print_cur_ts("Timestamp:\t\t\t")
+
+
+# Makes NPSSO credentials taken out of rotation due for a probe right away (SIGHUP with unchanged PSN_NPSSO)
+def schedule_psn_credentials_probe():
+    for credential in PSN_CREDENTIALS["pool"]:
+        if not credential["healthy"]:
+            credential["retry_ts"] = 1
+
+
+# Creates PSNAWP session with the first healthy NPSSO credential of the pool which authenticates and makes it current
+# Credentials failing authentication on the way are taken out of rotation, other errors are raised
+def create_pool_psn_session():
+    sync_psn_credentials()
+    for credential in PSN_CREDENTIALS["pool"]:
+        if not credential["healthy"]:
+            continue
+        use_psn_credential(credential)
+        try:
+            return create_psn_session()
+        except Exception as e:
+            if classify_psn_exception(e) != "auth" or not disable_psn_credential(credential, e):
+                raise
+
+
+# Takes the credential which failed authentication out of rotation and reports it, users assigned to it move to the
+# other credentials on their next poll; returns False if it is the last healthy credential (it is kept)
+def disable_psn_credential(credential, error):
+    pool = PSN_CREDENTIALS["pool"]
+    healthy = [c for c in pool if c["healthy"]]
+    if not credential["healthy"] or len(healthy) <= 1:
+        return False
+    credential["healthy"] = False
+    credential["error"] = str(error)
+    credential["retry_delay"] = NPSSO_RETRY_INTERVAL
+    credential["retry_ts"] = time.time() + NPSSO_RETRY_INTERVAL if NPSSO_RETRY_INTERVAL > 0 else 0
+    metric_inc("credentials_auth_failures")
+    METRICS["credentials_healthy"] = len(healthy) - 1
+    msg = f"NPSSO credential {get_credential_label(credential)} failed authentication and was taken out of rotation ({len(healthy) - 1} of {len(pool)} credentials left): {error}"
+    print(f"* {msg}")
+    print("* Hint: update PSN_NPSSO in your .env and send SIGHUP to this process (or restart)" + (f", it is probed again in {display_time(NPSSO_RETRY_INTERVAL)}." if NPSSO_RETRY_INTERVAL > 0 else "."))
+    if ERROR_NOTIFICATION:
+        print(f"Sending email notification to {RECEIVER_EMAIL}")
+        send_email(f"psn_monitor: PSN NPSSO credential {get_credential_label(credential)} error!", f"{msg}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}", "", SMTP_SSL)
+    return True
+
+
+# Returns health summary of the NPSSO credentials pool
+def get_credentials_summary():
+    return ", ".join(f"{get_credential_label(c)}: {'healthy' if c['healthy'] else 'failed'} ({c['users']} users)" for c in PSN_CREDENTIALS["pool"])
+
+
+# Returns profile snapshot compared between refreshes from PSN profile and friendship responses
+def get_profile_snapshot(profile, fs):
+    return {
+        "online_id": profile.get("onlineId"),
+        "about_me": profile.get("aboutMe") or "",
+        "ps_plus": profile.get("isPlus"),
+        "languages": list(profile.get("languages") or []),
+        "verified": profile.get("isOfficiallyVerified"),
+        "relation": (fs or {}).get("friendRelation"),
+    }
+
+
+# Fetches profile snapshot of the user
+def fetch_profile_snapshot(psn_user):
+    rate_limit_acquire("profile")
+    profile = psn_user.profile()
+    rate_limit_acquire("profile")
+    fs = psn_user.friendship()
+    return get_profile_snapshot(profile, fs)
+
+
+# Fetches trophy summary snapshot of the user
+def fetch_trophies_snapshot(psn_user):
+    rate_limit_acquire("trophies")
+    ts = psn_user.trophy_summary()
+    et = ts.earned_trophies
+    return {
+        "trophy_level": ts.trophy_level,
+        "progress": ts.progress,
+        "tier": ts.tier,
+        "platinum": et.platinum,
+        "gold": et.gold,
+        "silver": et.silver,
+        "bronze": et.bronze,
+    }
+
+
+# Fetches play count and play time of the 10 recently played titles of the user
+def fetch_titles_snapshot(psn_user):
+    rate_limit_acquire("titles")
+    titles = {}
+    for t in psn_user.title_stats(limit=10, page_size=50):
+        if not t:
+            continue
+        titles[normalize_ascii(t.name or "(unknown)")] = {
+            "play_count": t.play_count,
+            "play_duration": str(t.play_duration) if t.play_duration else "0:00:00",
+        }
+    return titles
+
+
+# Returns Unix timestamp of the datetime returned by psnawp, 0 if it is missing
+def get_dt_ts(dt):
+    try:
+        return int(dt.timestamp())
+    except Exception:
+        return 0
+
+
+# Runs the PSN API call under the FUNCTION_TIMEOUT alarm (not available on Windows), so calls made in a loop get their
+# own timeout each and rate limiter waits between them do not count against it
+def call_with_timeout(func):
+    if platform.system() == 'Windows':
+        return func()
+    signal.signal(signal.SIGALRM, timeout_handler)
+    signal.alarm(FUNCTION_TIMEOUT)
+    try:
+        return func()
+    finally:
+        signal.alarm(0)
+
+
+# Returns the number of earned trophies in the trophy set of a trophy title (object or dict), None if it is missing
+def get_trophy_set_total(trophy_set):
+    if trophy_set is None:
+        return None
+    if isinstance(trophy_set, dict):
+        return sum(int(trophy_set.get(t) or 0) for t in ("platinum", "gold", "silver", "bronze"))
+    return sum(int(getattr(trophy_set, t, 0) or 0) for t in ("platinum", "gold", "silver", "bronze"))
+
+
+# Returns the marker of a trophy title kept by the trophy tracker: (last updated timestamp, progress, earned trophies)
+def get_trophy_title_marker(tt):
+    updated_ts = get_dt_ts(get_first_attr(tt, "last_updated_datetime", "last_updated_date_time", "lastUpdatedDateTime"))
+    return (updated_ts, get_first_attr(tt, "progress"), get_trophy_set_total(get_first_attr(tt, "earned_trophies", "earnedTrophies")))
+
+
+# Fetches trophies earned by the user since the previous trophy refresh and emits trophy earned events
+# The first refresh only records markers of the recently updated titles (baseline), later ones run when earned trophy
+# counts in the trophy summary grew and fetch trophies only of titles whose marker changed, instead of rescanning all
+# titles like print_last_earned_trophies()
+# New trophies are told apart by trophy IDs earned at the previous fetch of the title, not by earned time, so trophies
+# earned offline and synced later are reported too; for a title fetched for the first time the number of trophies
+# earned since its marker was recorded (or, for titles without one, since the previous trophy summary) is used
+# Titles are marked as seen only once their trophies were fetched; if any title failed, an exception is raised after
+# emitting the trophies found, so the refresh keeps the previous snapshot and the next one retries the failed titles
+# Markers and trophy IDs are kept only for the TROPHY_TRACKER_TITLE_LIMIT most recently updated titles
+def track_earned_trophies(state, old_snapshot, new_snapshot, since_ts):
+    trophy_types = ("platinum", "gold", "silver", "bronze")
+    if old_snapshot and all(new_snapshot[t] <= old_snapshot[t] for t in trophy_types):
+        return
+
+    psn_user = get_psn_user(state)
+    metric_inc("trophy_tracker_scans")
+    rate_limit_acquire("trophies")
+    titles = call_with_timeout(lambda: list(psn_user.trophy_titles(limit=TROPHY_TRACKER_TITLE_LIMIT)))
+    markers = {}
+    for tt in titles:
+        npcomm = get_first_attr(tt, "np_communication_id", "npCommunicationId")
+        if npcomm:
+            markers[npcomm] = (tt, get_trophy_title_marker(tt))
+
+    if not old_snapshot:
+        state["trophy_titles"] = {npcomm: marker for npcomm, (tt, marker) in markers.items()}
+        state["trophies_seen"] = {npcomm: ids for npcomm, ids in state["trophies_seen"].items() if npcomm in markers}
+        return
+
+    earned = []
+    unknown = []
+    titles_seen = {}
+    failed = []
+    for npcomm, (tt, marker) in markers.items():
+        seen = state["trophy_titles"].get(npcomm)
+        if seen == marker:
+            titles_seen[npcomm] = marker
+            continue
+
+        game_name = normalize_ascii(get_first_attr(tt, "title_name", "trophy_title_name", "name", default=npcomm))
+        fetched = False
+        for plat in get_trophy_platforms(tt):
+            try:
+                rate_limit_acquire("trophies")
+                trophies = call_with_timeout(lambda: list(psn_user.trophies(np_communication_id=npcomm, platform=plat, include_progress=True, trophy_group_id="all")))
+            except Exception:
+                continue
+            fetched = True
+            metric_inc("trophy_tracker_titles_fetched")
+            title_earned = []
+            for tr in trophies:
+                if not getattr(tr, "earned", False):
+                    continue
+                tname = get_first_attr(tr, "trophy_name", "trophyName")
+                if not tname:
+                    tname = "(hidden)" if getattr(tr, "hidden", False) else "(unknown)"
+                title_earned.append((get_dt_ts(get_trophy_earned_dt(tr)), get_first_attr(tr, "trophy_id", "trophyId"), game_name, get_trophy_type_str(tr), normalize_ascii(tname), getattr(plat, "value", plat)))
+            title_earned.sort(key=lambda tr: tr[0])
+            ids_seen = state["trophies_seen"].get(npcomm)
+            if ids_seen is not None:
+                earned.extend(tr for tr in title_earned if tr[1] not in ids_seen)
+            elif seen is not None and len(seen) > 2 and seen[2] is not None:
+                earned.extend(title_earned[min(len(title_earned), seen[2]):])
+            else:
+                unknown.extend(title_earned)
+            state["trophies_seen"][npcomm] = {tr[1] for tr in title_earned}
+            if trophies:
+                break
+        if fetched:
+            titles_seen[npcomm] = marker
+        else:
+            failed.append(game_name)
+
+    # Trophies of titles without a marker are new up to the growth of the trophy summary not explained by other titles
+    if unknown:
+        grown = sum(max(0, new_snapshot[t] - old_snapshot[t]) for t in trophy_types)
+        unknown.sort(key=lambda tr: tr[0])
+        earned.extend(unknown[len(unknown) - min(len(unknown), max(0, grown - len(earned))):])
+
+    # Failed titles keep their previous marker, so they are fetched again by the next refresh
+    state["trophy_titles"] = {npcomm: titles_seen.get(npcomm) or state["trophy_titles"][npcomm] for npcomm in markers if npcomm in titles_seen or npcomm in state["trophy_titles"]}
+    state["trophies_seen"] = {npcomm: ids for npcomm, ids in state["trophies_seen"].items() if npcomm in markers}
+    for earned_ts, trophy_id, game_name, trophy_type, trophy_name, plat in sorted(earned, key=lambda tr: tr[0]):
+        emit_event(make_event("trophy_earned", state["psn_user_id"], earned_ts, game=game_name, trophy_type=trophy_type, trophy_name=trophy_name, platform=str(plat).upper()), state["sink_ctx"])
+    if earned:
+        print_cur_ts("Timestamp:\t\t\t")
+    if failed:
+        metric_inc("trophy_tracker_titles_failed", len(failed))
+        raise RuntimeError(f"cannot fetch trophies of {len(failed)} title(s): {', '.join(failed)}, retrying with the next refresh")
+
+
+# Data classes refreshed on their own cadence next to presence polling, interval returns the refresh interval in seconds
+# on_refresh (optional) is called with the state, previous snapshot, new snapshot and timestamp of the previous refresh
+# Changes of fields listed in ignore (optional) are not reported as profile change (e.g. renames have their own event)
+REFRESH_TASKS = (
+    {"name": "profile", "fetch": fetch_profile_snapshot, "interval": lambda: PROFILE_REFRESH_INTERVAL, "on_refresh": check_online_id_rename, "ignore": ("online_id",)},
+    {"name": "trophies", "fetch": fetch_trophies_snapshot, "interval": lambda: TROPHIES_REFRESH_INTERVAL, "on_refresh": track_earned_trophies},
+    {"name": "titles", "fetch": fetch_titles_snapshot, "interval": lambda: TITLES_REFRESH_INTERVAL},
+)
+
+
+# Returns differences between two snapshots as list of {"field", "old", "new"}, nested dicts are compared field by field
+def diff_snapshots(old, new, prefix=""):
+    changes = []
+    for key in sorted(set(old) | set(new), key=str):
+        old_val, new_val = old.get(key), new.get(key)
+        if old_val == new_val:
+            continue
+        if isinstance(old_val, dict) and isinstance(new_val, dict):
+            changes.extend(diff_snapshots(old_val, new_val, f"{prefix}{key}."))
+        else:
+            changes.append({"field": f"{prefix}{key}", "old": old_val, "new": new_val})
+    return changes
+
+
+# Refreshes the data class of the user and emits profile change event if it differs from the previous snapshot
+# Returns the delay before the next refresh in seconds, None if the refresh is disabled
+def refresh_user_data(state, task):
+    interval = task["interval"]()
+    if interval <= 0:
+        return None
+
+    breaker_wait = circuit_breaker_wait()
+    if breaker_wait > 0:
+        return breaker_wait
+
+    fetch_ts = int(time.time())
+    if platform.system() != 'Windows':
+        signal.signal(signal.SIGALRM, timeout_handler)
+        signal.alarm(FUNCTION_TIMEOUT)
+    try:
+        snapshot = task["fetch"](get_psn_user(state))
+    except Exception as e:
+        metric_inc(f"refresh_errors_{task['name']}")
+        if not isinstance(e, TimeoutException) and classify_psn_exception(e) == "ratelimited":
+            rate_limit_throttled(get_retry_after(e))
+        else:
+            circuit_breaker_record(False)
+        print(f"* Cannot refresh {task['name']} data of PSN user {state['psn_user_id']}: {e}")
+        print_cur_ts("Timestamp:\t\t\t")
+        return min(interval, RETRY_MAX_DELAY)
+    finally:
+        if platform.system() != 'Windows':
+            signal.alarm(0)
+
+    metric_inc(f"refresh_{task['name']}_total")
+    circuit_breaker_record(True)
+    entry = state["refresh"][task["name"]]
+    old_snapshot, since_ts = entry["snapshot"], entry["ts"]
+
+    # The snapshot is saved only after on_refresh succeeded, otherwise the next refresh repeats it against the previous
+    # snapshot; on_refresh applies timeouts to its PSN calls itself (see call_with_timeout())
+    if task.get("on_refresh"):
+        try:
+            task["on_refresh"](state, old_snapshot, snapshot, since_ts)
+        except Exception as e:
+            metric_inc(f"refresh_errors_{task['name']}")
+            print(f"* Cannot process refreshed {task['name']} data of PSN user {state['psn_user_id']}: {e}")
+            print_cur_ts("Timestamp:\t\t\t")
+            return min(interval, RETRY_MAX_DELAY)
+
+    if old_snapshot is not None:
+        changes = [change for change in diff_snapshots(old_snapshot, snapshot) if change["field"] not in task.get("ignore", ())]
+        if changes:
+            emit_event(make_event("profile_change", state["psn_user_id"], int(time.time()), data=task["name"], changes=changes), state["sink_ctx"])
+            print_cur_ts("Timestamp:\t\t\t")
+    entry["snapshot"] = snapshot
+    entry["ts"] = fetch_ts
+    return interval
+
+
+# Returns a new monitoring state of the user, i.e. everything the polling loop keeps between polls of the user
+def new_user_state(psn_user_id, csv_file_name):
+    state = {
+        "psn_user_id": psn_user_id,
+        "psn_user": None,
+        "session_generation": 0,
+        "csv_file": csv_file_name,
+        "status": "",
+        "status_ts_old": 0,
+        "status_online_start_ts": 0,
+        "status_online_start_ts_old": 0,
+        "game_name": "",
+        "game_title_id": "",
+        "game_concept_id": "",
+        "launchplatform": "",
+        "game_ts_old": 0,
+        "game_total_ts": 0,
+        "games_number": 0,
+        "game_total_after_offline_counted": False,
+        "alive_counter": 0,
+        "liveness_check": True,
+        "email_sent": False,
+        "error_streak": 0,
+        "retry_delay": 0,
+        "shed_count": 0,
+        "poll_interval": 0,
+        # Deadline of the next presence poll in the scheduler, earlier schedule entries of the user are skipped
+        "poll_deadline": 0,
+        "last_poll_ts": 0,
+        # Polling intervals of the user set via the control socket and the TOML config file (config_*), the control socket
+        # ones take precedence; 0 uses the next one, then PSN_CHECK_INTERVAL / PSN_ACTIVE_CHECK_INTERVAL
+        "check_interval": 0,
+        "active_check_interval": 0,
+        "config_check_interval": 0,
+        "config_active_check_interval": 0,
+        "burst_start_ts": 0,
+        "burst_budget": float(BURST_BUDGET_PER_HOUR),
+        "burst_budget_ts": 0,
+        "activity_profile": None,
+        # Last fetched snapshot of each data class refreshed on its own cadence (see REFRESH_TASKS)
+        "refresh": {task["name"]: {"snapshot": None, "ts": 0} for task in REFRESH_TASKS},
+        # Trophy titles seen by the trophy tracker: np_communication_id -> (last updated timestamp, progress, earned
+        # trophies) and np_communication_id -> IDs of trophies earned at the last fetch (see track_earned_trophies())
+        "trophy_titles": {},
+        "trophies_seen": {},
+        "npsso_seen": PSN_NPSSO,
+        # NPSSO credential the user is polled with (see select_psn_credential())
+        "credential": None,
+        # None without LEASE_BACKEND, otherwise True if this node holds the lease of the user and polls it
+        "lease": None,
+        # Per-user context passed to output sinks together with events, notify keeps per-user notification options
+        "sink_ctx": {"user": psn_user_id, "csv_file": csv_file_name, "csv_last_row": None, "notify": {}},
+    }
+    apply_user_config(state)
+    return state
+
+
+# Keys of the user state handed over between processes, the rest (PSNAWP objects, counters of the current process)
+# is rebuilt by the receiving process
+EXPORTED_STATE_KEYS = (
+    "status", "status_ts_old", "status_online_start_ts", "status_online_start_ts_old",
+    "game_name", "game_title_id", "game_concept_id", "launchplatform", "game_ts_old", "game_total_ts", "games_number", "game_total_after_offline_counted",
+    "email_sent", "burst_start_ts", "burst_budget", "burst_budget_ts", "activity_profile",
+    "refresh", "trophy_titles", "trophies_seen",
+)
+
+
+# Returns a copy of the user state which can be handed over to another process (see import_user_state())
+def export_user_state(state):
+    import copy
+    exported = {key: copy.deepcopy(state[key]) for key in EXPORTED_STATE_KEYS}
+    exported["csv_last_row"] = state["sink_ctx"]["csv_last_row"]
+    return exported
+
+
+# Restores the user state exported by export_user_state(), so monitoring continues without the startup presence fetch
+def import_user_state(state, exported):
+    for key in EXPORTED_STATE_KEYS:
+        if key in exported:
+            state[key] = exported[key]
+    state["sink_ctx"]["csv_last_row"] = exported.get("csv_last_row")
+
+
+# Returns user state exported by export_user_state() converted to a JSON-serializable dict
+def user_state_to_json(exported):
+    data = dict(exported)
+    data["trophies_seen"] = {npcomm: sorted(ids, key=str) for npcomm, ids in exported["trophies_seen"].items()}
+    profile = exported.get("activity_profile")
+    if profile:
+        data["activity_profile"] = dict(profile, first_dt=profile["first_dt"].isoformat() if profile["first_dt"] else None)
+    return data
+
+
+# Returns user state converted by user_state_to_json() back to the form expected by import_user_state()
+def user_state_from_json(data):
+    exported = dict(data)
+    # Checkpoints of older versions keep trophies_seen as a list of [np_communication_id, trophy ID] pairs
+    trophies_seen = data.get("trophies_seen") or {}
+    if isinstance(trophies_seen, list):
+        exported["trophies_seen"] = {}
+        for npcomm, trophy_id in trophies_seen:
+            exported["trophies_seen"].setdefault(npcomm, set()).add(trophy_id)
+    else:
+        exported["trophies_seen"] = {npcomm: set(ids) for npcomm, ids in trophies_seen.items()}
+    exported["trophy_titles"] = {npcomm: tuple(seen) for npcomm, seen in data.get("trophy_titles", {}).items()}
+    if data.get("csv_last_row"):
+        exported["csv_last_row"] = tuple(data["csv_last_row"])
+    profile = data.get("activity_profile")
+    if profile:
+        exported["activity_profile"] = dict(profile, first_dt=datetime.fromisoformat(profile["first_dt"]) if profile["first_dt"] else None, last_week=[tuple(week) if week else None for week in profile["last_week"]])
+    return exported
+
+
+# Opens lease backend storing leases in SQLite database shared by all nodes (the file must be on storage with working
+# file locks, e.g. local disk for nodes on one host); returns dict of backend functions:
+# - acquire(psn_user_ids, node, ttl): takes free or expired leases, returns {psn_user_id: handed over state or None}
+# - renew(states, node, ttl): extends leases still held by the node and stores {psn_user_id: state}, returns held IDs
+# - release(states, node): releases leases held by the node storing their final state
+def open_sqlite_lease_backend(path):
+    import sqlite3
+
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS psn_leases (psn_user_id TEXT PRIMARY KEY, node TEXT NOT NULL, expires REAL NOT NULL, state TEXT)")
+
+    def transaction(func):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(time.time())
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(psn_user_ids, node, ttl):
+        def _acquire(now):
+            acquired = {}
+            for psn_user_id in psn_user_ids:
+                row = conn.execute("SELECT node, expires, state FROM psn_leases WHERE psn_user_id = ?", (psn_user_id,)).fetchone()
+                if row and row[0] != node and row[1] > now:
+                    continue
+                conn.execute("INSERT INTO psn_leases (psn_user_id, node, expires) VALUES (?, ?, ?) ON CONFLICT(psn_user_id) DO UPDATE SET node = excluded.node, expires = excluded.expires", (psn_user_id, node, now + ttl))
+                acquired[psn_user_id] = json.loads(row[2]) if row and row[2] else None
+            return acquired
+        return transaction(_acquire) if psn_user_ids else {}
+
+    def renew(states, node, ttl):
+        def _renew(now):
+            held = set()
+            for psn_user_id, state in states.items():
+                if conn.execute("UPDATE psn_leases SET expires = ?, state = ? WHERE psn_user_id = ? AND node = ?", (now + ttl, json.dumps(state), psn_user_id, node)).rowcount == 1:
+                    held.add(psn_user_id)
+            return held
+        return transaction(_renew) if states else set()
+
+    def release(states, node):
+        def _release(now):
+            for psn_user_id, state in states.items():
+                conn.execute("UPDATE psn_leases SET expires = 0, state = COALESCE(?, state) WHERE psn_user_id = ? AND node = ?", (json.dumps(state) if state is not None else None, psn_user_id, node))
+        if states:
+            transaction(_release)
+
+    return {"acquire": acquire, "renew": renew, "release": release}
+
+
+# Lease backends by URL scheme (see open_lease_backend())
+LEASE_BACKENDS = {"sqlite": open_sqlite_lease_backend}
+
+# State of lease coordination in this process, the backend is reopened in forked worker processes
+LEASES = {"backend": None, "pid": 0, "node": "", "renew_ts": 0.0}
+
+
+# Registers lease backend opener for the URL scheme, opener gets the rest of the URL and returns dict of backend functions
+def register_lease_backend(scheme, opener):
+    LEASE_BACKENDS[scheme] = opener
+
+
+# Returns lease backend of this process opened from LEASE_BACKEND URL
+def get_lease_backend():
+    if LEASES["backend"] is None or LEASES["pid"] != os.getpid():
+        scheme, sep, path = LEASE_BACKEND.partition("://")
+        if not sep:
+            scheme, path = "sqlite", LEASE_BACKEND
+        if scheme not in LEASE_BACKENDS:
+            raise ValueError(f"unknown lease backend '{scheme}'")
+        LEASES["backend"] = LEASE_BACKENDS[scheme](os.path.expanduser(path))
+        LEASES["pid"] = os.getpid()
+    return LEASES["backend"]
+
+
+# Returns ID of this node in the lease backend
+def get_lease_node_id():
+    if not LEASES["node"]:
+        LEASES["node"] = LEASE_NODE_ID or f"{platform.node()}:{os.getpid()}"
+    return LEASES["node"]
+
+
+# Starts polling of the user whose lease was acquired, from the state handed over by the previous holder if any
+def activate_user_lease(state, handed_state):
+    try:
+        if handed_state:
+            import_user_state(state, user_state_from_json(handed_state))
+        else:
+            start_user_monitoring(state)
+    except Exception as e:
+        print(f"* Error: cannot start monitoring of PSN user {state['psn_user_id']}: {e}")
+        get_lease_backend()["release"]({state["psn_user_id"]: None}, get_lease_node_id())
+        return
+    state["lease"] = True
+    metric_inc("lease_acquired")
+    print(f"* Lease of PSN user {state['psn_user_id']} acquired by node {get_lease_node_id()}" + (" (state handed over)" if handed_state else ""))
+
+
+# Renews leases of users polled by this node (storing their state for handover) and takes over free or expired leases
+# of other users, at most every LEASE_TTL / 3 seconds; users whose lease was taken by another node are not polled anymore
+def renew_user_leases(states, force=False):
+    now = time.time()
+    if not force and now - LEASES["renew_ts"] < LEASE_TTL / 3:
+        return
+    LEASES["renew_ts"] = now
+    node = get_lease_node_id()
+    try:
+        backend = get_lease_backend()
+        held = backend["renew"]({state["psn_user_id"]: user_state_to_json(export_user_state(state)) for state in states if state["lease"]}, node, LEASE_TTL)
+        acquired = backend["acquire"]([state["psn_user_id"] for state in states if not state["lease"]], node, LEASE_TTL)
+    except Exception as e:
+        metric_inc("lease_errors")
+        print(f"* Cannot renew leases in '{LEASE_BACKEND}': {e}")
+        print_cur_ts("Timestamp:\t\t\t")
+        return
+
+    changed = False
+    for state in states:
+        if state["lease"] and state["psn_user_id"] not in held:
+            state["lease"] = False
+            metric_inc("lease_lost")
+            print(f"* Lease of PSN user {state['psn_user_id']} taken over by another node, polling stopped")
+            changed = True
+        elif not state["lease"] and state["psn_user_id"] in acquired:
+            activate_user_lease(state, acquired[state["psn_user_id"]])
+            changed = True
+    METRICS["lease_held"] = sum(1 for state in states if state["lease"])
+    if changed:
+        print_cur_ts("Timestamp:\t\t\t")
+
+
+# Releases leases held by this node storing the final user state, so other nodes take over the users immediately
+def release_user_leases(states):
+    if not LEASE_BACKEND:
+        return
+    try:
+        get_lease_backend()["release"]({state["psn_user_id"]: user_state_to_json(export_user_state(state)) for state in states if state["lease"]}, get_lease_node_id())
+    except Exception as e:
+        print(f"* Cannot release leases in '{LEASE_BACKEND}': {e}")
+
+
+# State store of all monitored users loaded from STATE_STORE_FILE and its journal: PSN user ID -> key -> value
+# (keys: last_status, checkpoint); journal is the open journal file of the process (pid) which appends changes to it,
+# appended counts journal entries since the last compaction and dirty tells if the journal needs fsync
+STATE_STORE = {"data": None, "journal": None, "pid": None, "appended": 0, "dirty": False, "sync_ts": 0.0}
+
+
+# Returns name of the journal file of the state store
+def get_state_store_journal_file():
+    return f"{STATE_STORE_FILE}.journal"
+
+
+# Locks (or unlocks) the open file exclusively, so processes sharing a file (workers) do not interleave their writes,
+# e.g. appends to the journal of the state store with its compaction; no-op on Windows
+def lock_file(f, lock=True):
+    try:
+        import fcntl
+    except ImportError:
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX if lock else fcntl.LOCK_UN)
+
+
+# Reads the snapshot file of the state store and replays its journal on top of it (the latest entry of a key wins)
+# A partially written last journal line (crash during append) is ignored, returns the data and number of journal entries
+def read_state_store_files():
+    data = {}
+    entries = 0
+    if os.path.isfile(STATE_STORE_FILE):
+        try:
+            with open(STATE_STORE_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"* Cannot load state store from '{STATE_STORE_FILE}' file: {e}")
+    journal_file = get_state_store_journal_file()
+    if os.path.isfile(journal_file):
+        try:
+            with open(journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        psn_user_id, key, value = json.loads(line)
+                    except ValueError:
+                        continue
+                    data.setdefault(psn_user_id, {})[key] = value
+                    entries += 1
+        except Exception as e:
+            print(f"* Cannot load state store journal from '{journal_file}' file: {e}")
+    return data, entries
+
+
+# Returns data of the state store, loaded on first use
+def get_state_store():
+    if STATE_STORE["data"] is None:
+        STATE_STORE["data"], STATE_STORE["appended"] = read_state_store_files() if STATE_STORE_FILE else ({}, 0)
+    return STATE_STORE["data"]
+
+
+# Returns the journal file of the state store opened for appending, reopened in forked worker processes
+# A partially written last line is terminated first (under the journal lock, so a line being appended by another worker
+# is not cut in two), so the next entry is not glued to it
+def open_state_store_journal():
+    if STATE_STORE["journal"] is None or STATE_STORE["pid"] != os.getpid():
+        f = open(get_state_store_journal_file(), "a", encoding="utf-8")
+        lock_file(f)
+        try:
+            if os.fstat(f.fileno()).st_size > 0:
+                with open(get_state_store_journal_file(), "rb") as journal_f:
+                    journal_f.seek(-1, os.SEEK_END)
+                    if journal_f.read(1) != b"\n":
+                        f.write("\n")
+                        f.flush()
+        finally:
+            lock_file(f, lock=False)
+        STATE_STORE["journal"] = f
+        STATE_STORE["pid"] = os.getpid()
+        STATE_STORE["dirty"] = False
+    return STATE_STORE["journal"]
+
+
+# Returns the value stored for the user under the key (from memory), None if not available
+# Values missing in the store are migrated from the legacy psn_<psn_user_id>_<key>.json file, which is then removed
+# (only when STATE_STORE_FILE is set, an in-memory store keeps the legacy file as the only copy on disk); with migrate
+# set to False (info mode) the legacy file is only read
+def state_store_get(psn_user_id, key, migrate=True):
+    user_data = get_state_store().get(psn_user_id, {})
+    if key in user_data:
+        return user_data[key]
+
+    legacy_file = f"psn_{psn_user_id}_{key}.json"
+    if not os.path.isfile(legacy_file):
+        return None
+    try:
+        with open(legacy_file, "r", encoding="utf-8") as f:
+            value = json.load(f)
+    except Exception as e:
+        print(f"* Cannot load legacy state from '{legacy_file}' file: {e}")
+        return None
+    if not migrate:
+        return value
+    if state_store_put(psn_user_id, key, value) and STATE_STORE_FILE and state_store_sync(force=True):
+        try:
+            os.remove(legacy_file)
+            print(f"* Legacy file '{legacy_file}' migrated to state store '{STATE_STORE_FILE}'")
+        except OSError as e:
+            print(f"* Cannot remove migrated legacy file '{legacy_file}': {e}")
+    return value
+
+
+# Stores the value for the user under the key: in memory and as a single line appended to the journal, which is
+# flushed to disk in batches (see state_store_sync()) and compacted every STATE_STORE_COMPACT_ENTRIES entries
+# Returns False if the journal cannot be written
+def state_store_put(psn_user_id, key, value):
+    get_state_store().setdefault(psn_user_id, {})[key] = value
+    if not STATE_STORE_FILE:
+        return True
+
+    line = json.dumps([psn_user_id, key, value], separators=(",", ":"), ensure_ascii=False) + "\n"
+    try:
+        f = open_state_store_journal()
+        lock_file(f)
+        try:
+            f.write(line)
+            f.flush()
+        finally:
+            lock_file(f, lock=False)
+    except Exception as e:
+        print(f"* Cannot write state of {psn_user_id} to '{get_state_store_journal_file()}' file: {e}")
+        return False
+
+    STATE_STORE["appended"] += 1
+    STATE_STORE["dirty"] = True
+    if STATE_STORE_COMPACT_ENTRIES and STATE_STORE["appended"] >= STATE_STORE_COMPACT_ENTRIES:
+        state_store_compact()
+    else:
+        state_store_sync()
+    return True
+
+
+# Flushes the journal of the state store to disk (fsync) if it was not flushed for STATE_STORE_SYNC_INTERVAL seconds
+# (or force is set), so frequent status changes of many users cost one fsync per interval; returns False on error
+def state_store_sync(force=False):
+    if not STATE_STORE["dirty"] or STATE_STORE["pid"] != os.getpid():
+        return True
+    if not force and time.time() - STATE_STORE["sync_ts"] < STATE_STORE_SYNC_INTERVAL:
+        return True
+    try:
+        os.fsync(STATE_STORE["journal"].fileno())
+    except Exception as e:
+        print(f"* Cannot sync state store journal '{get_state_store_journal_file()}': {e}")
+        return False
+    STATE_STORE["dirty"] = False
+    STATE_STORE["sync_ts"] = time.time()
+    return True
+
+
+# Compacts the journal of the state store into the snapshot file: the snapshot is rebuilt from the files (so entries
+# appended by other processes are kept), written to a temporary file, synced and atomically replaces the old one,
+# then the journal is truncated; a crash in between only replays the journal over the new snapshot again
+def state_store_compact():
+    try:
+        f = open_state_store_journal()
+        lock_file(f)
+        try:
+            data, _ = read_state_store_files()
+            tmp_file = f"{STATE_STORE_FILE}.{os.getpid()}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as tmp_f:
+                json.dump(data, tmp_f, separators=(",", ":"), ensure_ascii=False)
+                tmp_f.flush()
+                os.fsync(tmp_f.fileno())
+            os.replace(tmp_file, STATE_STORE_FILE)
+            f.truncate(0)
+            os.fsync(f.fileno())
+        finally:
+            lock_file(f, lock=False)
+    except Exception as e:
+        print(f"* Cannot compact state store '{STATE_STORE_FILE}': {e}")
+        return
+    metric_inc("state_store_compactions")
+    STATE_STORE["appended"] = 0
+    STATE_STORE["dirty"] = False
+    STATE_STORE["sync_ts"] = time.time()
+
+
+# Saves the status and its timestamp of the user to the state store
+def save_last_status(psn_user_id, status_ts, status):
+    state_store_put(psn_user_id, "last_status", [status_ts, status])
+
+
+# Restores status timestamps of the user from the last status in the state store and saves the current status to it
+# start_ts is the timestamp the monitoring started at, returns the last status read from the store ("" if not available)
+def restore_last_status(state, lastonline_ts, start_ts):
+    psn_user_id = state["psn_user_id"]
+    status = state["status"]
+    status_ts_old = start_ts
+
+    if status and status != "offline":
+        state["status_online_start_ts"] = status_ts_old
+        state["status_online_start_ts_old"] = status_ts_old
+
+    last_status_read = state_store_get(psn_user_id, "last_status")
+    last_status_ts = 0
+    last_status = ""
+
+    if last_status_read:
+        last_status_ts = last_status_read[0]
+        last_status = last_status_read[1]
+
+        if last_status_ts > 0:
+            last_status_dt_str = get_short_date_from_ts(last_status_ts, show_weekday=False, always_show_year=True)
+            last_status_str = str(last_status.upper())
+            print(f"* Last status read from state store: {last_status_str} ({last_status_dt_str})")
+
+            if lastonline_ts and status == "offline":
+                if lastonline_ts >= last_status_ts:
+                    status_ts_old = lastonline_ts
+                else:
+                    status_ts_old = last_status_ts
+            if not lastonline_ts and status == "offline":
+                status_ts_old = last_status_ts
+            if status and status != "offline" and status == last_status:
+                state["status_online_start_ts"] = last_status_ts
+                state["status_online_start_ts_old"] = last_status_ts
+                status_ts_old = last_status_ts
+
+    if last_status_ts > 0 and status != last_status:
+        save_last_status(psn_user_id, status_ts_old, status)
+
+    if last_status_ts == 0:
+        if lastonline_ts and status == "offline":
+            status_ts_old = lastonline_ts
+        save_last_status(psn_user_id, status_ts_old, status)
+
+    state["status_ts_old"] = status_ts_old
+    return last_status
+
+
+# Saves checkpoint of the full monitoring state of the user (status, session & game counters, snapshots) to the state store
+def save_checkpoint(state):
+    data = user_state_to_json(export_user_state(state))
+    data["psn_user_id"] = state["psn_user_id"]
+    data["checkpoint_ts"] = int(time.time())
+    state_store_put(state["psn_user_id"], "checkpoint", data)
+
+
+# Saves checkpoints of the users on exit, so the sessions continue after a restart (see CHECKPOINT_MAX_AGE); users
+# leased by another node are skipped
+def save_checkpoints(states):
+    for state in states:
+        if state["status"] and state["lease"] is not False:
+            save_checkpoint(state)
+
+
+# Loads checkpoint of the user saved by save_checkpoint(), returns None if it is missing, does not belong to the user
+# or is older than CHECKPOINT_MAX_AGE
+def load_checkpoint(state):
+    data = state_store_get(state["psn_user_id"], "checkpoint")
+    if not isinstance(data, dict) or data.get("psn_user_id") != state["psn_user_id"] or not data.get("status"):
+        return None
+    checkpoint_ts = data.get("checkpoint_ts", 0)
+    if CHECKPOINT_MAX_AGE > 0 and time.time() - checkpoint_ts > CHECKPOINT_MAX_AGE:
+        print(f"* Checkpoint of {state['psn_user_id']} from {get_short_date_from_ts(checkpoint_ts, show_weekday=False, always_show_year=True)} is older than {display_time(CHECKPOINT_MAX_AGE)}, starting a new session")
+        return None
+    return data
+
+
+# Continues the monitoring session of the user saved in the checkpoint: restores the full state and treats differences
+# between the checkpoint and the status & game fetched at startup as regular changes (events, CSV rows, session totals)
+# A user who got offline while the tool was not running is stamped offline (and its game stopped) at the last online
+# time reported by PSN (lastonline_ts), other changes at the current time
+def resume_user_state(state, checkpoint, status, game_name, launchplatform, game_ids=("", ""), lastonline_ts=0):
+    import_user_state(state, user_state_from_json(checkpoint))
+    if state["game_title_id"] and state["game_name"]:
+        GAME_NAMES.setdefault(state["game_title_id"], state["game_name"])
+    checkpoint_dt_str = get_short_date_from_ts(checkpoint["checkpoint_ts"], show_weekday=False, always_show_year=True)
+    print(f"* Session state of {state['psn_user_id']} restored from checkpoint ({checkpoint_dt_str}): {state['status'].upper()}" + (f", in-game: {state['game_name']}" if state["game_name"] else ""))
+
+    if ADAPTIVE_POLLING and state["activity_profile"] is None:
+        try:
+            state["activity_profile"] = build_activity_profile(state["csv_file"])
+        except Exception as e:
+            print(f"* Cannot build activity profile from '{state['csv_file']}' file: {e}")
+            state["activity_profile"] = new_activity_profile()
+
+    try:
+        if state["csv_file"]:
+            init_csv_file(state["csv_file"])
+    except Exception as e:
+        print(f"* Error: {e}")
+
+    change_ts = None
+    if status == "offline" and state["status"] != "offline" and max(state["status_ts_old"], state["game_ts_old"]) < lastonline_ts <= time.time():
+        change_ts = lastonline_ts
+    if not apply_user_presence(state, status, game_name, launchplatform, game_ids, change_ts):
+        save_checkpoint(state)
+
+
+# Sets the initial status & game of the user fetched at startup and writes it to CSV file if it changed since the last run
+# If the checkpoint of the user exists the session is continued from it instead (see resume_user_state())
+# game_ids is a tuple of title ID and concept ID of the game (empty strings if not available)
+def start_user_state(state, status, game_name, launchplatform, lastonline_ts, start_ts, game_ids=("", "")):
+    checkpoint = load_checkpoint(state)
+    if checkpoint:
+        resume_user_state(state, checkpoint, status, game_name, launchplatform, game_ids, lastonline_ts)
+        return
+
+    state["status"] = status
+    state["game_name"] = game_name
+    state["game_title_id"], state["game_concept_id"] = game_ids
+    state["launchplatform"] = launchplatform
+
+    last_status = restore_last_status(state, lastonline_ts, start_ts)
+
+    if ADAPTIVE_POLLING:
+        try:
+            state["activity_profile"] = build_activity_profile(state["csv_file"])
+        except Exception as e:
+            print(f"* Cannot build activity profile from '{state['csv_file']}' file: {e}")
+            state["activity_profile"] = new_activity_profile()
+        profile = state["activity_profile"]
+        print(f"* Activity profile of {state['psn_user_id']}: {profile['sessions']} sessions, most active: {get_activity_profile_summary(profile)}")
 
     try:
-        if csv_file_name:
-            init_csv_file(csv_file_name)
+        if state["csv_file"]:
+            init_csv_file(state["csv_file"])
+        if state["csv_file"] and (status != last_status):
+            write_csv_entry(state["csv_file"], now_local_naive(), status, game_name)
     except Exception as e:
         print(f"* Error: {e}")
 
+    if status != "offline" and game_name:
+        state["game_ts_old"] = int(time.time())
+        state["games_number"] += 1
+
+    save_checkpoint(state)
+
+
+# Returns status, game name, launch platform and game IDs (title ID, concept ID) from the parsed presence (see parse_presence())
+def get_presence_fields(parsed):
+    if not parsed["status"]:
+        raise PsnMalformedResponse("onlineStatus is empty")
+    status = str(parsed["status"]).lower()
+    game_name = get_game_name(parsed["title_id"], parsed["game_name"])
+    launchplatform = str(parsed["launch_platform"]).upper() if parsed["launch_platform"] else ""
+    return status, game_name, launchplatform, (parsed["title_id"] or "", parsed["concept_id"] or "")
+
+
+# Starts monitoring of the user in multi-user mode: fetches the current presence and prints a short summary
+def start_user_monitoring(state):
+    sync_psn_credentials()
+    use_psn_credential(select_psn_credential(state))
+    rate_limit_acquire("presence")
+    start_user_from_presence(state, get_user_presence(state))
+
+
+# Starts monitoring of the user from the parsed presence (see parse_presence()) and prints a short summary
+def start_user_from_presence(state, parsed):
+    status, game_name, launchplatform, game_ids = get_presence_fields(parsed)
+    lastonline_dt = convert_iso_str_to_datetime(parsed["last_online"])
+    lastonline_ts = int(lastonline_dt.timestamp()) if lastonline_dt else 0
+
+    start_user_state(state, status, game_name, launchplatform, lastonline_ts, int(time.time()), game_ids)
+
+    in_game_str = f", in-game: {game_name}" + (f" ({launchplatform})" if launchplatform else "") if status != "offline" and game_name else ""
+    print(f"* PSN user {state['psn_user_id']} is {status.upper()} since {get_short_date_from_ts(state['status_ts_old'])}{in_game_str}")
+
+
+# Returns hour-of-week bucket (0 = Monday 00:00-00:59, 167 = Sunday 23:00-23:59) of the naive local datetime
+def get_hour_of_week(dt):
+    return dt.weekday() * 24 + dt.hour
+
+
+# Returns a new empty hour-of-week activity profile: number of distinct weeks the user was online in each hour of the week
+def new_activity_profile():
+    return {"active": [0] * 168, "last_week": [None] * 168, "first_dt": None, "sessions": 0}
+
+
+# Adds the online session (naive local datetimes) to the activity profile, sessions must be added in chronological order
+def add_activity_session(profile, start_dt, end_dt):
+    if profile["first_dt"] is None:
+        profile["first_dt"] = start_dt
+    end_dt = min(end_dt, start_dt + timedelta(hours=24))
+    profile["sessions"] += 1
+    dt = start_dt.replace(minute=0, second=0, microsecond=0)
+    while dt <= end_dt:
+        bucket = get_hour_of_week(dt)
+        week = dt.isocalendar()[:2]
+        if profile["last_week"][bucket] != week:
+            profile["active"][bucket] += 1
+            profile["last_week"][bucket] = week
+        dt += timedelta(hours=1)
+
+
+# Builds the activity profile of the user from the last ADAPTIVE_HISTORY_DAYS of the CSV file history
+def build_activity_profile(csv_file_name):
+    import csv
+    profile = new_activity_profile()
+    if not csv_file_name or not os.path.isfile(csv_file_name):
+        return profile
+    since_dt = now_local_naive() - timedelta(days=ADAPTIVE_HISTORY_DAYS)
+    online_start_dt = None
+    with open(csv_file_name, 'r', newline='', encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                dt = datetime.fromisoformat(str(row["Date"]))
+            except (KeyError, ValueError):
+                continue
+            if dt < since_dt:
+                continue
+            if profile["first_dt"] is None:
+                profile["first_dt"] = dt
+            status = str(row.get("Status") or "").lower()
+            if status and status != "offline":
+                if online_start_dt is None:
+                    online_start_dt = dt
+            elif online_start_dt is not None:
+                add_activity_session(profile, online_start_dt, dt)
+                online_start_dt = None
+    return profile
+
+
+# Returns the most active hours of the week from the activity profile, e.g. "Mon 20:00, Sat 14:00"
+def get_activity_profile_summary(profile, top=3):
+    days = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+    buckets = sorted((b for b in range(168) if profile["active"][b]), key=lambda b: -profile["active"][b])[:top]
+    return ", ".join(f"{days[b // 24]} {b % 24:02d}:00" for b in buckets) or "none"
+
+
+# Returns polling interval for the given activity probability: zero -> ADAPTIVE_MAX_INTERVAL, ADAPTIVE_HOT_PROBABILITY
+# or more -> PSN_ACTIVE_CHECK_INTERVAL, in between the interval shrinks geometrically from PSN_CHECK_INTERVAL; in seconds
+def get_interval_for_probability(probability):
+    if probability <= 0:
+        return max(PSN_CHECK_INTERVAL, ADAPTIVE_MAX_INTERVAL)
+    if probability >= ADAPTIVE_HOT_PROBABILITY:
+        return PSN_ACTIVE_CHECK_INTERVAL
+    return int(PSN_CHECK_INTERVAL * (PSN_ACTIVE_CHECK_INTERVAL / PSN_CHECK_INTERVAL) ** (probability / ADAPTIVE_HOT_PROBABILITY))
+
+
+# Returns polling interval of the offline user adapted to the user's hour-of-week activity profile; in seconds
+# The interval is clipped so the next poll does not happen later than the start of the next hour which requires faster polling
+def get_adaptive_interval(state):
+    profile = state.get("activity_profile")
+    if not profile or profile["first_dt"] is None:
+        return PSN_CHECK_INTERVAL
+    now_dt = now_local_naive()
+    days = (now_dt - profile["first_dt"]).total_seconds() / 86400
+    if days < ADAPTIVE_MIN_HISTORY_DAYS:
+        return PSN_CHECK_INTERVAL
+    weeks = max(1.0, days / 7)
+    interval = get_interval_for_probability(profile["active"][get_hour_of_week(now_dt)] / weeks)
+    hour_dt = now_dt.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    while (hour_dt - now_dt).total_seconds() < interval:
+        interval = min(interval, max(get_interval_for_probability(profile["active"][get_hour_of_week(hour_dt)] / weeks), int((hour_dt - now_dt).total_seconds())))
+        hour_dt += timedelta(hours=1)
+    return interval
+
+
+# Records the interval used after an offline poll and the delay of login detection, to compare adaptive polling with fixed PSN_CHECK_INTERVAL
+def record_adaptive_poll(state, interval, login_detected=False):
+    if login_detected and state.get("poll_interval"):
+        metric_inc("adaptive_logins_total")
+        metric_inc("adaptive_login_max_delay_seconds_total", state["poll_interval"])
+    if interval is not None:
+        metric_inc("adaptive_offline_polls_total")
+        metric_inc("adaptive_baseline_polls_total", round(interval / PSN_CHECK_INTERVAL, 3))
+
+
+# Returns adaptive polling trade-off summary: offline polls made vs fixed PSN_CHECK_INTERVAL and worst-case login detection delay
+def get_adaptive_summary():
+    polls = METRICS.get("adaptive_offline_polls_total", 0)
+    baseline = METRICS.get("adaptive_baseline_polls_total", 0)
+    if not polls:
+        return "no offline polls yet"
+    summary = f"{polls} offline polls instead of {int(baseline)} ({(polls - baseline) / baseline * 100:+.0f}%)"
+    logins = METRICS.get("adaptive_logins_total", 0)
+    if logins:
+        summary += f", worst-case login detection delay {display_time(int(METRICS['adaptive_login_max_delay_seconds_total'] / logins))} on average (fixed: {display_time(PSN_CHECK_INTERVAL)})"
+    return summary
+
+
+# Returns True if the user is within the burst polling window after the last status or game change
+def is_bursting(state, now=None):
+    return BURST_POLLING and state["burst_start_ts"] > 0 and (now or time.time()) - state["burst_start_ts"] < BURST_WINDOW
+
+
+# Returns the polling interval shortened by burst polling after a recent change, charging the extra polls to the user's budget; in seconds
+# A poll after interval I instead of the normal interval N costs 1 - I/N extra polls, the budget refills at BURST_BUDGET_PER_HOUR per hour
+def get_burst_interval(state, interval):
+    now = time.time()
+    if not is_bursting(state, now) or interval <= BURST_INTERVAL:
+        return interval
+    if state["burst_budget_ts"]:
+        state["burst_budget"] = min(float(BURST_BUDGET_PER_HOUR), state["burst_budget"] + (now - state["burst_budget_ts"]) * BURST_BUDGET_PER_HOUR / 3600)
+    state["burst_budget_ts"] = now
+    burst_interval = int(BURST_INTERVAL + (interval - BURST_INTERVAL) * (now - state["burst_start_ts"]) / BURST_WINDOW)
+    extra = 1 - burst_interval / interval
+    if extra <= 0:
+        return interval
+    if state["burst_budget"] < extra:
+        metric_inc("burst_budget_exhausted_total")
+        return interval
+    state["burst_budget"] -= extra
+    metric_inc("burst_polls_total")
+    metric_inc("burst_extra_polls_total", round(extra, 3))
+    return burst_interval
+
+
+# Returns polling interval of the user depending on the user's status (and activity profile in adaptive polling), intervals
+# set for the user via the control socket take precedence over the ones of the TOML config file
+def get_user_interval(state):
+    if state["status"] and state["status"] != "offline":
+        return state["active_check_interval"] or state["config_active_check_interval"] or PSN_ACTIVE_CHECK_INTERVAL
+    if state["check_interval"] or state["config_check_interval"]:
+        return state["check_interval"] or state["config_check_interval"]
+    if ADAPTIVE_POLLING:
+        return get_adaptive_interval(state)
+    return PSN_CHECK_INTERVAL
+
+
+# Sends error email notification about the user (at most once until the next successful poll)
+def send_user_error_email(state, m_subject, m_body):
+    if state["sink_ctx"]["notify"].get("ERROR_NOTIFICATION", ERROR_NOTIFICATION) and not state["email_sent"]:
+        print(f"Sending email notification to {RECEIVER_EMAIL}")
+        send_email(m_subject, m_body, "", SMTP_SSL)
+        state["email_sent"] = True
+
+
+# Handles a failed presence fetch of the user and returns the delay before the next poll of the user; in seconds
+def handle_poll_error(state, e):
+    psn_user_id = state["psn_user_id"]
+
+    kind = classify_psn_exception(e)
+    metric_inc(f"poll_errors_{kind}")
+    write_metrics_file()
+
+    # Fatal local fd exhaustion — cannot recover in-process
+    if kind == "exhausted":
+        hint = ""
+        msg_l = str(e).lower()
+        if "oauth/token" in msg_l or "authz" in msg_l or "npsso" in msg_l:
+            hint = "\n* Note: this can be a secondary effect of repeated PSN auth refresh attempts (e.g. expired NPSSO). After fixing NOFILE verify your NPSSO."
+        msg = (f"* Fatal: Too many open files (errno 24). "
+               f"This is a local limit/file-descriptor exhaustion problem not an NPSSO expiry.\n"
+               f"* Last error: {e}\n"
+               f"* Fix: increase your process NOFILE/ulimit (e.g. `ulimit -n 4096`) "
+               f"and if running under systemd set `LimitNOFILE=`. Then restart the tool.{hint}")
+        print(msg)
+        send_user_error_email(state, f"psn_monitor: fatal error - too many open files (user: {psn_user_id})", f"{msg}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}")
+        print_cur_ts("Timestamp:\t\t\t")
+        sys.exit(2)
+
+    state["error_streak"] += 1
+    error_streak = state["error_streak"]
+    if kind != "ratelimited":
+        circuit_breaker_record(False)
+
+    if kind == "ratelimited":
+        throttle_delay = rate_limit_throttled(get_retry_after(e))
+        print(f"* PSN rate limit hit (HTTP 429), lowering request rate to {METRICS['ratelimit_rate_per_minute']}/min and retrying in {display_time(throttle_delay)}")
+        print_cur_ts("Timestamp:\t\t\t")
+        return 0
+
+    # With a pool of NPSSO credentials the failing one is taken out of rotation and the user is polled again right away
+    # with another credential; errors of the last healthy credential are handled as before
+    if kind == "auth" and state["credential"] is not None and disable_psn_credential(state["credential"], e):
+        print_cur_ts("Timestamp:\t\t\t")
+        return 0
+
+    if kind == "auth":
+        state["retry_delay"] = get_retry_delay(state["retry_delay"], max(60, get_user_interval(state)))
+        hint = probe_npsso_auth_error(PSN_SESSION["npsso"]) if "something went wrong while authenticating" in str(e).lower() else None
+        if hint:
+            print(f"* PSN auth failed: {hint}")
+        else:
+            print(f"* PSN authentication failed (NPSSO may be expired/invalid): {e}")
+            print("* Hint: update PSN_NPSSO in your .env and send SIGHUP to this process (or restart).")
+        body_reason = hint if hint else f"PSN authentication failed (NPSSO may be expired/invalid): {e}"
+        send_user_error_email(state, f"psn_monitor: PSN NPSSO key error! (user: {psn_user_id})", f"{body_reason}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}")
+        print_cur_ts("Timestamp:\t\t\t")
+        recreate_psn_session_rate_limited()
+        return state["retry_delay"]
+
+    if kind == "malformed":
+        state["retry_delay"] = get_retry_delay(state["retry_delay"], max(60, get_user_interval(state)))
+        hint = probe_npsso_auth_error(PSN_SESSION["npsso"])
+        if hint:
+            print(f"* PSN returned a malformed response and auth probe reports: {hint}")
+        else:
+            print(f"* PSN returned an unexpected response shape will recreate session: {e}")
+        if recreate_psn_session_rate_limited():
+            print("* Recreated PSNAWP session after malformed response")
+        if error_streak >= 3:
+            body_reason = hint if hint else f"PSN returned unexpected response shape ({error_streak} in a row). Last error: {e}"
+            send_user_error_email(state, f"psn_monitor: PSN returned malformed responses (user: {psn_user_id})", f"{body_reason}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}")
+        print_cur_ts("Timestamp:\t\t\t")
+        return state["retry_delay"]
+
+    if kind == "transient":
+        state["retry_delay"] = get_retry_delay(state["retry_delay"], RETRY_BASE_DELAY)
+        if error_streak >= 3:
+            if recreate_psn_session_rate_limited():
+                print(f"* Recreated PSNAWP session after {error_streak} consecutive connection errors")
+        if error_streak >= 20:
+            send_user_error_email(state, f"psn_monitor: persistent connection errors (user: {psn_user_id})", f"Persistent connection errors detected ({error_streak} in a row). Last error: {e}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}")
+        if error_streak >= 3:
+            print(f"* Error (connection) retrying in {display_time(state['retry_delay'])}: {e}")
+            print_cur_ts("Timestamp:\t\t\t")
+        return state["retry_delay"]
+
+    # kind == "unknown": safety net. After a few streaks we probe auth and recreate session so a novel error shape cannot silently loop forever
+    state["retry_delay"] = get_retry_delay(state["retry_delay"], get_user_interval(state))
+    hint = None
+    if error_streak >= 3:
+        hint = probe_npsso_auth_error(PSN_SESSION["npsso"])
+        if hint:
+            print(f"* Error (unknown {error_streak} in a row) auth probe reports: {hint}")
+        else:
+            print(f"* Error (unknown {error_streak} in a row) will recreate session: {e}")
+        recreate_psn_session_rate_limited()
+    else:
+        print(f"* Error retrying in {display_time(state['retry_delay'])}: {e}")
+    if error_streak >= 5:
+        body_reason = hint if hint else f"Persistent unexpected errors ({error_streak} in a row). Last error: {e}"
+        send_user_error_email(state, f"psn_monitor: persistent unexpected errors (user: {psn_user_id})", f"{body_reason}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}")
+    print_cur_ts("Timestamp:\t\t\t")
+    return state["retry_delay"]
+
+
+# Detects status & game changes of the user in the fetched presence, updates the state and emits events
+# game_ids is a tuple of title ID and concept ID of the game; games are compared by their IDs (see is_same_game())
+# change_ts is the time the changes are stamped with, the current time if not given
+def apply_user_presence(state, status, game_name, launchplatform, game_ids=("", ""), change_ts=None):
+    psn_user_id = state["psn_user_id"]
+    status_old = state["status"]
+    game_name_old = state["game_name"]
+    title_id, concept_id = game_ids
+
+    change = False
+
+    status_ts = int(change_ts or time.time())
+    game_ts = status_ts
+
+    # Player status changed
+    if status != status_old:
+
+        save_last_status(psn_user_id, status_ts, status)
+
+        event = make_event("status_change", psn_user_id, status_ts, status_old=status_old, status=status, status_ts_old=state["status_ts_old"], game=game_name, title_id=title_id, platform=launchplatform, notify=False)
+
+        # Player got online
+        if status_old == "offline" and status and status != "offline":
+            state["game_total_after_offline_counted"] = False
+            if (status_ts - state["status_ts_old"]) > OFFLINE_INTERRUPT or not state["status_online_start_ts_old"]:
+                state["status_online_start_ts"] = status_ts
+                state["game_total_ts"] = 0
+                state["games_number"] = 0
+            elif (status_ts - state["status_ts_old"]) <= OFFLINE_INTERRUPT and state["status_online_start_ts_old"] > 0:
+                state["status_online_start_ts"] = state["status_online_start_ts_old"]
+                event["online_start_restored_ts"] = state["status_online_start_ts_old"]
+            event["notify"] = True
+            if ADAPTIVE_POLLING:
+                record_adaptive_poll(state, None, login_detected=True)
+
+        # Player got offline
+        if status_old and status_old != "offline" and status == "offline":
+            event["online_start_ts"] = state["status_online_start_ts"]
+            if state["games_number"] > 0:
+                if game_name_old and not game_name:
+                    state["game_total_ts"] += (int(game_ts) - int(state["game_ts_old"]))
+                    state["game_total_after_offline_counted"] = True
+                event["games_number"] = state["games_number"]
+                event["game_total_ts"] = state["game_total_ts"]
+            if state["activity_profile"] is not None:
+                online_start_ts = state["status_online_start_ts"] or state["status_ts_old"]
+                add_activity_session(state["activity_profile"], datetime.fromtimestamp(online_start_ts, get_local_tz()).replace(tzinfo=None), datetime.fromtimestamp(status_ts, get_local_tz()).replace(tzinfo=None))
+            state["status_online_start_ts_old"] = state["status_online_start_ts"]
+            state["status_online_start_ts"] = 0
+            event["notify"] = True
+
+        emit_event(event, state["sink_ctx"])
+        change = True
+
+        state["status_ts_old"] = status_ts
+        print_cur_ts("Timestamp:\t\t\t")
+
+    # Player started/stopped/changed the game
+    if not is_same_game(game_ids, (state["game_title_id"], state["game_concept_id"]), game_name, game_name_old):
+
+        event = make_event("game_change", psn_user_id, game_ts, game_old=game_name_old, game=game_name, title_id_old=state["game_title_id"], title_id=title_id, concept_id=concept_id, status=status, platform=launchplatform, game_ts_old=state["game_ts_old"])
+
+        # User changed the game
+        if game_name_old and game_name:
+            event["kind"] = "changed"
+            state["game_total_ts"] += (int(game_ts) - int(state["game_ts_old"]))
+            state["games_number"] += 1
+
+        # User started playing new game
+        elif not game_name_old and game_name:
+            event["kind"] = "started"
+            state["games_number"] += 1
+
+        # User stopped playing the game
+        elif game_name_old and not game_name:
+            event["kind"] = "stopped"
+            if not state["game_total_after_offline_counted"]:
+                state["game_total_ts"] += (int(game_ts) - int(state["game_ts_old"]))
+
+        emit_event(event, state["sink_ctx"])
+        change = True
+
+        state["game_ts_old"] = game_ts
+        print_cur_ts("Timestamp:\t\t\t")
+
+    state["status"] = status
+    state["game_name"] = game_name
+    state["game_title_id"], state["game_concept_id"] = title_id, concept_id
+    state["launchplatform"] = launchplatform
+
+    if change:
+        save_checkpoint(state)
+
+    return change
+
+
+# Polls presence of the user once and returns the delay before the next poll of the user; in seconds
+def poll_user(state):
+    psn_user_id = state["psn_user_id"]
+
+    # If PSN_NPSSO changed (e.g. .env updated + SIGHUP), reload the credentials pool and recreate the PSNAWP session immediately.
+    if sync_psn_credentials():
+        try:
+            use_psn_credential(select_psn_credential(state))
+            if PSN_SESSION["client"] is None:
+                create_psn_session()
+                PSN_SESSION["last_recreate_ts"] = int(time.time())
+            get_psn_user(state)
+            if len(PSN_CREDENTIALS["pool"]) > 1:
+                print(f"* PSN_NPSSO updated - reloaded pool of {len(PSN_CREDENTIALS['pool'])} NPSSO credentials")
+            else:
+                print("* PSN_NPSSO updated - recreated PSNAWP session")
+            print_cur_ts("Timestamp:\t\t\t")
+        except Exception as e:
+            print(f"* Warning: failed to recreate PSNAWP session after PSN_NPSSO update: {e}")
+            send_user_error_email(state, f"psn_monitor: failed to recreate PSNAWP session (user: {psn_user_id})", f"Failed to recreate PSNAWP session after PSN_NPSSO update: {e}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}")
+            print_cur_ts("Timestamp:\t\t\t")
+    if PSN_NPSSO != state["npsso_seen"]:
+        state["npsso_seen"] = PSN_NPSSO
+        # allow notifications again after token rotation
+        state["email_sent"] = False
+        state["error_streak"] = 0
+
+    # PSN calls are suspended while the circuit breaker is open
+    breaker_wait = circuit_breaker_wait()
+    if breaker_wait > 0:
+        return breaker_wait
+
+    rate_limit_acquire("presence")
+
+    # Sometimes PSN network functions halt, so we use alarm signal functionality to kill it inevitably, not available on Windows
+    if platform.system() != 'Windows':
+        signal.signal(signal.SIGALRM, timeout_handler)
+        signal.alarm(FUNCTION_TIMEOUT)
+    metric_inc("polls_total")
+    state["last_poll_ts"] = time.time()
+    try:
+        parsed = get_user_presence(state)
+        status = parsed["status"]
+        game_name = get_game_name(parsed["title_id"], parsed["game_name"])
+        game_ids = (parsed["title_id"] or "", parsed["concept_id"] or "")
+        launch_platform_raw = parsed["launch_platform"]
+        launchplatform = str(launch_platform_raw).upper() if launch_platform_raw else ""
+        if platform.system() != 'Windows':
+            signal.alarm(0)
+        rate_limit_success()
+        if not status:
+            raise PsnMalformedResponse('onlineStatus is empty')
+        else:
+            status = str(status).lower()
+    except TimeoutException:
+        if platform.system() != 'Windows':
+            signal.alarm(0)
+        metric_inc("poll_errors_timeout")
+        circuit_breaker_record(False)
+        state["retry_delay"] = get_retry_delay(state["retry_delay"], FUNCTION_TIMEOUT)
+        print(f"psn_user.get_presence() timeout, retrying in {display_time(state['retry_delay'])}")
+        print_cur_ts("Timestamp:\t\t\t")
+        write_metrics_file()
+        return state["retry_delay"]
+
+    except Exception as e:
+        if platform.system() != 'Windows':
+            signal.alarm(0)
+        return handle_poll_error(state, e)
+
+    else:
+        state["email_sent"] = False
+        state["error_streak"] = 0
+        state["retry_delay"] = 0
+        circuit_breaker_record(True)
+
+    finally:
+        if platform.system() != 'Windows':
+            signal.alarm(0)
+
+    if apply_user_presence(state, status, game_name, launchplatform, game_ids):
+        state["alive_counter"] = 0
+        state["burst_start_ts"] = int(time.time())
+
+    state["alive_counter"] += 1
+
+    state["poll_interval"] = get_user_interval(state)
+    if ADAPTIVE_POLLING and status == "offline":
+        record_adaptive_poll(state, state["poll_interval"])
+    if BURST_POLLING:
+        state["poll_interval"] = get_burst_interval(state, state["poll_interval"])
+
+    if state["liveness_check"] and LIVENESS_CHECK_COUNTER and state["alive_counter"] >= LIVENESS_CHECK_COUNTER and (status == "offline" or not status):
+        if ADAPTIVE_POLLING:
+            print(f"* Adaptive polling: {get_adaptive_summary()}")
+        print_cur_ts("Liveness check, timestamp:\t")
+        state["alive_counter"] = 0
+
+    write_metrics_file()
+    state_store_sync()
+
+    return state["poll_interval"]
+
+
+# Returns the selector watching the wakeup socket pair of this process, which is created on first use (and again after fork)
+# Has to be called from the main thread, the only one allowed to set the wakeup fd of signals
+def get_wakeup_selector():
+    import selectors
+    import socket
+    if WAKEUP["pid"] == os.getpid():
+        return WAKEUP["selector"]
+    if WAKEUP["selector"] is not None:
+        WAKEUP["selector"].close()
+        for sock in WAKEUP["socks"]:
+            sock.close()
+    reader, writer = socket.socketpair()
+    reader.setblocking(False)
+    writer.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(reader, selectors.EVENT_READ)
+    signal.set_wakeup_fd(writer.fileno(), warn_on_full_buffer=False)
+    WAKEUP.update(pid=os.getpid(), selector=selector, socks=(reader, writer))
+    return selector
+
+
+# Wakes the monitoring loop up from wait_for_wakeup(); can be called from any thread
+def wake_up_loop():
+    if WAKEUP["pid"] != os.getpid():
+        return
+    try:
+        WAKEUP["socks"][1].send(b"\0")
+    except OSError:
+        pass
+
+
+# Waits for the given time or until the monitoring loop is woken up by a signal or a control command; in seconds
+def wait_for_wakeup(timeout):
+    selector = get_wakeup_selector()
+    WAKEUP["waiting"] = True
+    try:
+        if selector.select(max(0.0, timeout)):
+            while True:
+                try:
+                    if not WAKEUP["socks"][0].recv(4096):
+                        break
+                except OSError:
+                    break
+    finally:
+        WAKEUP["waiting"] = False
+
+
+# Stops the tool from a signal handler; while the monitoring loop polls, stop() is deferred to the end of the current
+# poll (see handle_wakeup()), so outputs and the state store are written completely; in waits between polls, outside
+# of the loop and on a repeated signal it is called at once
+def stop_from_signal(stop):
+    if WAKEUP["loop"] and not WAKEUP["waiting"] and WAKEUP["stop"] is None:
+        WAKEUP["stop"] = stop
+        return
+    stop()
+
+
+# Applies what the monitoring loop was woken up for: stop request (SIGINT/SIGTERM), PSN_NPSSO change (SIGHUP), changed
+# polling intervals (SIGTRAP/SIGABRT) and control commands; ctx is the same as for run_control_commands()
+def handle_wakeup(ctx):
+    if WAKEUP["stop"] is not None:
+        WAKEUP["stop"]()
+    if WAKEUP["reload"]:
+        WAKEUP["reload"] = False
+        apply_psn_npsso_change()
+    if WAKEUP["config"]:
+        WAKEUP["config"] = False
+        reload_toml_config(ctx)
+    if WAKEUP["reschedule"]:
+        WAKEUP["reschedule"] = False
+        reschedule_user_polls(ctx, ctx["states"]())
+    if CONTROL["server"]:
+        run_control_commands(ctx)
+
+
+# Recreates PSN sessions right after PSN_NPSSO changed (e.g. .env updated + SIGHUP) instead of with the next poll
+# With unchanged PSN_NPSSO the credentials taken out of rotation are probed again with the next poll
+def apply_psn_npsso_change():
+    if not sync_psn_credentials():
+        schedule_psn_credentials_probe()
+        return
+    try:
+        create_pool_psn_session()
+        PSN_SESSION["last_recreate_ts"] = int(time.time())
+        if len(PSN_CREDENTIALS["pool"]) > 1:
+            print(f"* PSN_NPSSO updated - reloaded pool of {len(PSN_CREDENTIALS['pool'])} NPSSO credentials")
+        else:
+            print("* PSN_NPSSO updated - recreated PSNAWP session")
+    except Exception as e:
+        print(f"* Warning: failed to recreate PSNAWP session after PSN_NPSSO update: {e}")
+    print_cur_ts("Timestamp:\t\t\t")
+
+
+# Moves the next polls of the users earlier when their polling interval got shorter than the time left to the poll,
+# longer intervals are used from the next poll on; users retrying after errors keep their retry delay
+def reschedule_user_polls(ctx, states):
+    now = time.time()
+    for state in states:
+        if not state["poll_deadline"] or not state["last_poll_ts"] or state["error_streak"]:
+            continue
+        deadline = state["last_poll_ts"] + get_user_interval(state)
+        if deadline < state["poll_deadline"]:
+            ctx["poll"](state, max(now, deadline))
+
+
+# Returns True if another process accepts connections on the Unix domain socket
+def is_unix_socket_in_use(path):
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+# Starts the control socket server (see CONTROL_SOCKET) in a background thread; every line received is a command
+# and every reply is one line of JSON, commands are queued and run by the monitoring loop (see run_control_commands())
+# The socket is accessible to the owner only, a stale socket file left by a killed process is replaced
+def start_control_server(path):
+    import queue
+    import socketserver
+
+    class ControlHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                line = line.decode("utf-8", "replace").strip()
+                if not line:
+                    continue
+                reply = submit_control_command(line)
+                self.wfile.write((json.dumps(reply, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+
+    if os.path.exists(path):
+        if is_unix_socket_in_use(path):
+            raise RuntimeError(f"control socket {path} is used by another process")
+        os.unlink(path)
+
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, ControlHandler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+    get_wakeup_selector()
+    CONTROL.update(server=server, path=path, commands=queue.Queue(), lock=threading.Lock())
+    threading.Thread(target=server.serve_forever, name="control_socket", daemon=True).start()
+
+
+# Stops the control socket server and removes its socket file
+def stop_control_server():
+    server = CONTROL["server"]
+    if server is None:
+        return
+    CONTROL["server"] = None
+    server.shutdown()
+    server.server_close()
+    try:
+        os.unlink(CONTROL["path"])
+    except OSError:
+        pass
+
+
+# Queues the command for the monitoring loop and waits for its reply; called by threads of the control socket server
+# A command not started by the loop before the client gives up expires and is never run
+def submit_control_command(line):
+    import queue
+    command = {"line": line, "reply": queue.Queue(), "state": "queued"}
+    CONTROL["commands"].put(command)
+    wake_up_loop()
+    try:
+        return command["reply"].get(timeout=max(30, FUNCTION_TIMEOUT * 2))
+    except queue.Empty:
+        pass
+    with CONTROL["lock"]:
+        if command["state"] == "queued":
+            command["state"] = "expired"
+            return {"ok": False, "error": "monitoring loop is busy, the command was not run"}
+    return command["reply"].get()
+
+
+# Runs all queued control commands, ctx gives access to the monitoring loop:
+# states() returns states of monitored users, poll(state, deadline) reschedules the next presence poll of the user
+# and add(state) / remove(state) (None in friends mode) add a new user whose monitoring was already started and drop
+# a monitored user
+# Commands whose client already gave up waiting (see submit_control_command()) are dropped
+def run_control_commands(ctx):
+    import queue
+    while True:
+        try:
+            command = CONTROL["commands"].get_nowait()
+        except queue.Empty:
+            return
+        with CONTROL["lock"]:
+            expired = command["state"] == "expired"
+            command["state"] = "running"
+        if expired:
+            metric_inc("control_commands_expired")
+            continue
+        metric_inc("control_commands_total")
+        try:
+            reply = run_control_command(command["line"], ctx)
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        if not reply.get("ok"):
+            metric_inc("control_commands_failed")
+        command["reply"].put(reply)
+
+
+# Runs a single control command (see CONTROL_COMMANDS) and returns its reply
+def run_control_command(line, ctx):
+    name, *args = line.split()
+    command = CONTROL_COMMANDS.get(name.lower())
+    if command is None:
+        return {"ok": False, "error": f"unknown command '{name}', use 'help' to list commands"}
+    handler, min_args, max_args, usage = command
+    if not min_args <= len(args) <= max_args:
+        return {"ok": False, "error": f"usage: {name.lower()} {usage}".rstrip()}
+    reply = handler(ctx, *args)
+    reply.setdefault("ok", True)
+    return reply
+
+
+# Returns states of monitored users matching the PSN ID (case-insensitive) or all of them for 'all'
+def find_control_users(ctx, psn_user_id):
+    states = ctx["states"]()
+    if psn_user_id.lower() == "all":
+        return states
+    matches = [state for state in states if state["psn_user_id"] == psn_user_id]
+    return matches or [state for state in states if state["psn_user_id"].lower() == psn_user_id.lower()]
+
+
+# Parses on/off argument of control commands
+def parse_control_switch(value):
+    if value.lower() not in ("on", "off"):
+        raise ValueError(f"expected on or off, got '{value}'")
+    return value.lower() == "on"
+
+
+# Prints a change made via the control socket, like the signal handlers do
+def print_control_change(msg):
+    print(f"* Control socket: {msg}")
+    print_cur_ts("Timestamp:\t\t\t")
+
+
+# Control command: lists commands
+def control_help(ctx):
+    return {"commands": {name: f"{name} {command[3]}".rstrip() for name, command in CONTROL_COMMANDS.items()}}
+
+
+# Control command: lists monitored users with their status, polling interval and next poll
+def control_users(ctx):
+    now = time.time()
+    users = []
+    for state in ctx["states"]():
+        users.append({
+            "user": state["psn_user_id"],
+            "status": state["status"],
+            "game": state["game_name"],
+            "platform": state["launchplatform"],
+            "interval": get_user_interval(state),
+            "check_interval": state["check_interval"] or state["config_check_interval"] or None,
+            "active_check_interval": state["active_check_interval"] or state["config_active_check_interval"] or None,
+            "next_poll_in": round(max(0.0, state["poll_deadline"] - now), 1) if state["poll_deadline"] else None,
+        })
+    return {"users": users}
+
+
+# Control command: returns counters (see METRICS_FILE) and current settings
+def control_stats(ctx):
+    return {
+        "users": len(ctx["states"]()),
+        "intervals": {"offline": PSN_CHECK_INTERVAL, "online": PSN_ACTIVE_CHECK_INTERVAL},
+        "notifications": {"status": ACTIVE_INACTIVE_NOTIFICATION, "game": GAME_CHANGE_NOTIFICATION, "trophies": TROPHY_NOTIFICATION, "profile": PROFILE_CHANGE_NOTIFICATION, "errors": ERROR_NOTIFICATION},
+        "sinks": {sink["name"]: sink["active"] for sink in EVENT_SINKS},
+        "metrics": dict(METRICS),
+    }
+
+
+# Control command: returns the full monitoring state of the user in the form saved in checkpoints
+def control_dump(ctx, psn_user_id):
+    states = find_control_users(ctx, psn_user_id)
+    if not states or psn_user_id.lower() == "all":
+        return {"ok": False, "error": f"PSN user {psn_user_id} is not monitored"}
+    state = states[0]
+    data = user_state_to_json(export_user_state(state))
+    data.update(psn_user_id=state["psn_user_id"], check_interval=state["check_interval"] or state["config_check_interval"], active_check_interval=state["active_check_interval"] or state["config_active_check_interval"], poll_interval=state["poll_interval"], error_streak=state["error_streak"])
+    return {"state": data}
+
+
+# Control command: starts monitoring of a new user
+def control_add(ctx, psn_user_id):
+    if ctx["add"] is None:
+        return {"ok": False, "error": "users cannot be added in friends mode, the friends list decides who is monitored"}
+    if LEASE_BACKEND:
+        return {"ok": False, "error": "users cannot be added with LEASE_BACKEND, all nodes need the same users"}
+    if psn_user_id.lower() == "all":
+        return {"ok": False, "error": "'all' cannot be used here"}
+    if find_control_users(ctx, psn_user_id):
+        return {"ok": False, "error": f"PSN user {psn_user_id} is already monitored"}
+    state = new_user_state(psn_user_id, get_user_file_name(CSV_FILE, psn_user_id) if CSV_FILE else "")
+    if state["csv_file"]:
+        init_csv_file(state["csv_file"])
+    start_user_monitoring(state)
+    ctx["add"](state)
+    print_control_change(f"monitoring of PSN user {psn_user_id} started")
+    return {"user": psn_user_id, "status": state["status"]}
+
+
+# Control command: stops monitoring of the user, its saved state is kept so it continues when added again
+def control_remove(ctx, psn_user_id):
+    if ctx["add"] is None:
+        return {"ok": False, "error": "users cannot be removed in friends mode, use FRIENDS_FILTER instead"}
+    if LEASE_BACKEND:
+        return {"ok": False, "error": "users cannot be removed with LEASE_BACKEND, all nodes need the same users"}
+    states = find_control_users(ctx, psn_user_id)
+    if not states or psn_user_id.lower() == "all":
+        return {"ok": False, "error": f"PSN user {psn_user_id} is not monitored"}
+    ctx["remove"](states[0])
+    save_checkpoint(states[0])
+    print_control_change(f"monitoring of PSN user {states[0]['psn_user_id']} stopped")
+    return {"user": states[0]["psn_user_id"]}
+
+
+# Control command: sets the offline or online polling interval of the user (or all users), 'default' goes back to
+# PSN_CHECK_INTERVAL / PSN_ACTIVE_CHECK_INTERVAL (see reschedule_user_polls())
+def control_interval(ctx, psn_user_id, kind, seconds):
+    if kind.lower() not in ("offline", "online"):
+        return {"ok": False, "error": f"expected offline or online, got '{kind}'"}
+    interval = 0 if seconds.lower() == "default" else int(seconds)
+    if interval < 0 or (0 < interval < 5):
+        return {"ok": False, "error": "interval must be at least 5 seconds"}
+    states = find_control_users(ctx, psn_user_id)
+    if not states:
+        return {"ok": False, "error": f"PSN user {psn_user_id} is not monitored"}
+    key = "check_interval" if kind.lower() == "offline" else "active_check_interval"
+    for state in states:
+        state[key] = interval
+    reschedule_user_polls(ctx, states)
+    print_control_change(f"{kind.lower()} polling interval of {psn_user_id if psn_user_id.lower() != 'all' else 'all users'} set to " + (display_time(interval) if interval else "default"))
+    return {"users": [state["psn_user_id"] for state in states], "intervals": [get_user_interval(state) for state in states]}
+
+
+# Control command: polls presence of the user (or all users) right away
+def control_poll(ctx, psn_user_id):
+    states = find_control_users(ctx, psn_user_id)
+    if not states:
+        return {"ok": False, "error": f"PSN user {psn_user_id} is not monitored"}
+    now = time.time()
+    for state in states:
+        ctx["poll"](state, now)
+    return {"users": [state["psn_user_id"] for state in states]}
+
+
+# Control command: lists output sinks or switches one on/off (see register_event_sink())
+def control_sink(ctx, name=None, value=None):
+    if name is not None:
+        if value is None:
+            return {"ok": False, "error": f"usage: sink {CONTROL_COMMANDS['sink'][3]}"}
+        active = parse_control_switch(value)
+        if not set_event_sink_active(name, active):
+            return {"ok": False, "error": f"unknown sink '{name}'"}
+        print_control_change(f"{name} output " + ("enabled" if active else "disabled"))
+    return {"sinks": {sink["name"]: sink["active"] for sink in EVENT_SINKS}}
+
+
+# Control command: switches email notifications on/off, like SIGUSR1/SIGUSR2 do
+def control_notify(ctx, kind, value):
+    global ACTIVE_INACTIVE_NOTIFICATION, GAME_CHANGE_NOTIFICATION, TROPHY_NOTIFICATION, PROFILE_CHANGE_NOTIFICATION, ERROR_NOTIFICATION
+    enabled = parse_control_switch(value)
+    kind = kind.lower()
+    if kind == "status":
+        ACTIVE_INACTIVE_NOTIFICATION = enabled
+    elif kind == "game":
+        GAME_CHANGE_NOTIFICATION = enabled
+    elif kind == "trophies":
+        TROPHY_NOTIFICATION = enabled
+    elif kind == "profile":
+        PROFILE_CHANGE_NOTIFICATION = enabled
+    elif kind == "errors":
+        ERROR_NOTIFICATION = enabled
+    else:
+        return {"ok": False, "error": f"expected status, game, trophies, profile or errors, got '{kind}'"}
+    print_control_change(f"email notifications: [{kind} = {enabled}]")
+    return {"notifications": {"status": ACTIVE_INACTIVE_NOTIFICATION, "game": GAME_CHANGE_NOTIFICATION, "trophies": TROPHY_NOTIFICATION, "profile": PROFILE_CHANGE_NOTIFICATION, "errors": ERROR_NOTIFICATION}}
+
+
+# Commands of the control socket: name -> (handler, min args, max args, usage)
+CONTROL_COMMANDS = {
+    "help": (control_help, 0, 0, ""),
+    "users": (control_users, 0, 0, ""),
+    "stats": (control_stats, 0, 0, ""),
+    "dump": (control_dump, 1, 1, "<psn_user_id>"),
+    "add": (control_add, 1, 1, "<psn_user_id>"),
+    "remove": (control_remove, 1, 1, "<psn_user_id>"),
+    "interval": (control_interval, 3, 3, "<psn_user_id|all> <offline|online> <seconds|default>"),
+    "poll": (control_poll, 1, 1, "<psn_user_id|all>"),
+    "sink": (control_sink, 0, 2, "[<name> <on|off>]"),
+    "notify": (control_notify, 2, 2, "<status|game|trophies|profile|errors> <on|off>"),
+}
+
+
+# Sends a command to the control socket of the running tool and prints the reply, returns True if the command succeeded
+def send_control_command(path, line):
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(max(30, FUNCTION_TIMEOUT * 2) + 5)
+        sock.connect(path)
+        sock.sendall((line.strip() + "\n").encode("utf-8"))
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    data = json.loads(reply.decode("utf-8")) if reply else {"ok": False, "error": "no reply"}
+    print(json.dumps(data, indent=2, ensure_ascii=False))
+    return bool(data.get("ok"))
+
+
+# Returns the scheduling priority of the user (index in PRIORITY_CLASSES): in-game > online > recently offline > long offline
+def get_user_priority(state, now):
+    status = state["status"]
+    if status and status != "offline":
+        return 0 if state["game_name"] else 1
+    if now - state["status_ts_old"] <= SCHEDULER_RECENTLY_OFFLINE:
+        return 2
+    return 3
+
+
+# Records how late the poll of a user in the given priority class started compared to its deadline; in seconds
+def record_scheduler_lag(priority_class, lag):
+    lag = max(0.0, lag)
+    metric_inc(f"scheduler_polls_{priority_class}")
+    avg_key = f"scheduler_lag_avg_{priority_class}"
+    METRICS[avg_key] = round(lag if avg_key not in METRICS else METRICS[avg_key] * 0.9 + lag * 0.1, 3)
+    METRICS[f"scheduler_lag_max_{priority_class}"] = round(max(METRICS.get(f"scheduler_lag_max_{priority_class}", 0), lag), 3)
+
+
+# Returns per-class scheduler lag summary, e.g. "in_game: 0.2s/1.5s, online: ..." (average/max)
+def get_scheduler_lag_summary():
+    parts = []
+    for priority_class in PRIORITY_CLASSES + ("refresh",):
+        if f"scheduler_lag_avg_{priority_class}" in METRICS:
+            parts.append(f"{priority_class}: {METRICS[f'scheduler_lag_avg_{priority_class}']}s/{METRICS[f'scheduler_lag_max_{priority_class}']}s")
+    return ", ".join(parts) if parts else "n/a"
+
+
+# Polls all monitored users forever, each user has its own deadline and priority
+# Due polls are served in priority order (in-game > online > recently offline > long offline); when the request budget
+# is exhausted (rate limiter out of tokens) or polls lag behind, polls of offline users are postponed by their interval
+# (at most SCHEDULER_MAX_SHED times in a row), so game changes of active users are caught promptly
+# on_tick (optional) is called on every scheduler iteration and at least every SUPERVISOR_REPORT_INTERVAL seconds
+# With LEASE_BACKEND only users whose lease is held by this node are polled
+def run_scheduler(states, on_tick=None):
+    import heapq
+    import itertools
+
+    now = time.time()
+    multi_user = False
+    schedule = []
+    ready = []
+
+    # Schedule entries refer to users by slot, which stays the same while users are added and removed
+    slots = dict(enumerate(states))
+    slot_ids = itertools.count(len(states))
+
+    def get_slot(state):
+        return next(i for i, s in slots.items() if s is state)
+
+    # Load shedding and the scheduler-wide liveness check (instead of the per-user one) apply while more than one user
+    # is monitored, so they follow users added and removed via the control socket
+    def update_multi_user():
+        nonlocal multi_user
+        multi_user = len(states) > 1
+        for state in states:
+            state["liveness_check"] = not multi_user
+
+    # Presence polls are rescheduled by pushing a new entry, older entries of the user are skipped when they come up
+    def schedule_task(deadline, i, task_name):
+        if task_name == "presence":
+            slots[i]["poll_deadline"] = deadline
+        heapq.heappush(schedule, (deadline, i, task_name))
+
+    # Users added via the control socket are polled after their polling interval (their presence was just fetched)
+    # while other data classes are refreshed right away
+    def add_state(state):
+        i = next(slot_ids)
+        slots[i] = state
+        states.append(state)
+        update_multi_user()
+        schedule_task(time.time() + get_user_interval(state), i, "presence")
+        for task in REFRESH_TASKS:
+            if task["interval"]() > 0:
+                schedule_task(time.time(), i, task["name"])
+
+    # Users removed via the control socket are dropped, their schedule entries are skipped when they come up
+    def remove_state(state):
+        del slots[get_slot(state)]
+        states.remove(state)
+        update_multi_user()
+        release_psn_credential(state)
+
+    control_ctx = {
+        "states": lambda: list(states),
+        "poll": lambda state, deadline: schedule_task(deadline, get_slot(state), "presence"),
+        "add": add_state,
+        "remove": remove_state,
+    }
+
+    # The first polls are spread over the polling interval so many users are not polled at once, the same
+    # applies to the first refresh of other data classes (spread over their interval, at most an hour)
+    update_multi_user()
+    for i, state in enumerate(states):
+        schedule_task(now + get_user_interval(state) * (i + 1) / len(states), i, "presence")
+        for task in REFRESH_TASKS:
+            if task["interval"]() > 0:
+                schedule_task(now + min(task["interval"](), 3600) * (i + 1) / len(states), i, task["name"])
+
+    last_liveness_ts = now
+
+    WAKEUP["loop"] = True
+    while True:
+        handle_wakeup(control_ctx)
+        if on_tick:
+            on_tick()
+        if LEASE_BACKEND:
+            renew_user_leases(states)
+        now = time.time()
+        while schedule and schedule[0][0] <= now:
+            deadline, i, task_name = heapq.heappop(schedule)
+            if i not in slots:
+                continue
+            priority = get_user_priority(slots[i], now) if task_name == "presence" else len(PRIORITY_CLASSES)
+            heapq.heappush(ready, (priority, deadline, i, task_name))
+
+        # Without any monitored user (all removed via the control socket) the loop only waits for control commands
+        if not ready:
+            sleep_time = max(0.0, schedule[0][0] - now) if schedule else 3600
+            if on_tick:
+                sleep_time = min(sleep_time, SUPERVISOR_REPORT_INTERVAL)
+            if LEASE_BACKEND:
+                sleep_time = min(sleep_time, LEASE_TTL / 3)
+            wait_for_wakeup(sleep_time)
+            continue
+
+        priority, deadline, i, task_name = heapq.heappop(ready)
+        state = slots.get(i)
+        lag = now - deadline
+
+        if state is None or (task_name == "presence" and deadline != state["poll_deadline"]):
+            continue
+
+        # Users leased by another node keep their schedule, so polling resumes soon after the lease is taken over
+        if state["lease"] is False:
+            schedule_task(now + LEASE_TTL / 3, i, task_name)
+            continue
+
+        # PSN calls of the user (and the request budget checks below) use the NPSSO credential assigned to the user
+        use_psn_credential(select_psn_credential(state))
+
+        # Refreshes of other data classes have the lowest priority and wait while the request budget is exhausted
+        if task_name != "presence":
+            if rate_limit_tokens() < 1 or lag > SCHEDULER_MAX_LAG:
+                metric_inc("scheduler_shed_refresh")
+                schedule_task(now + 60, i, task_name)
+                continue
+            record_scheduler_lag("refresh", lag)
+            task = next(task for task in REFRESH_TASKS if task["name"] == task_name)
+            delay = refresh_user_data(state, task)
+            if delay is not None:
+                schedule_task(time.time() + delay, i, task_name)
+            continue
+
+        priority_class = PRIORITY_CLASSES[priority]
+
+        if multi_user and priority >= SCHEDULER_SHED_PRIORITY and state["shed_count"] < SCHEDULER_MAX_SHED and not is_bursting(state, now) and (rate_limit_tokens() < 1 or lag > SCHEDULER_MAX_LAG):
+            state["shed_count"] += 1
+            metric_inc(f"scheduler_shed_{priority_class}")
+            schedule_task(now + get_user_interval(state), i, "presence")
+            continue
+
+        state["shed_count"] = 0
+        record_scheduler_lag(priority_class, lag)
+        delay = poll_user(state)
+        schedule_task(time.time() + delay, i, "presence")
+
+        if multi_user and LIVENESS_CHECK_INTERVAL and time.time() - last_liveness_ts >= LIVENESS_CHECK_INTERVAL:
+            print(f"* Scheduler lag (avg/max): {get_scheduler_lag_summary()}")
+            if len(PSN_CREDENTIALS["pool"]) > 1:
+                print(f"* NPSSO credentials: {get_credentials_summary()}")
+            if ADAPTIVE_POLLING:
+                print(f"* Adaptive polling: {get_adaptive_summary()}")
+            print_cur_ts("Liveness check, timestamp:\t")
+            last_liveness_ts = time.time()
+
+
+# Reads PSN IDs from the users file: one ID per line, empty lines and comments (#) are ignored
+def read_users_file(users_file):
+    psn_user_ids = []
+    with open(users_file, 'r', encoding="utf-8") as f:
+        for line in f:
+            psn_user_id = line.split("#", 1)[0].strip()
+            if psn_user_id:
+                psn_user_ids.append(psn_user_id)
+    return psn_user_ids
+
+
+# Returns per-user variant of the file name used in multi-user mode, e.g. psn.csv -> psn_<psn_user_id>.csv
+def get_user_file_name(file_name, psn_user_id):
+    root, ext = os.path.splitext(file_name)
+    return f"{root}_{psn_user_id}{ext}"
+
+
+# Main function that monitors gaming activity of the specified PSN user
+def psn_monitor_user(psn_user_id, csv_file_name):
+
+    state = new_user_state(psn_user_id, csv_file_name)
+    lastonline_ts = 0
+    status = ""
+
     print("Sneaking into PlayStation like a ninja ...\n")
 
     # Helper to print step message
@@ -1498,10 +5152,11 @@ def psn_monitor_user(psn_user_id, csv_file_name):
 
     print_step("Authenticating with PSN...")
     try:
-        psnawp = PSNAWP(PSN_NPSSO)
-        psn_user = psnawp.user(online_id=psn_user_id)
+        create_pool_psn_session()
+        use_psn_credential(select_psn_credential(state))
+        psn_user = get_psn_user(state)
     except Exception as e:
-        hint = probe_npsso_auth_error(PSN_NPSSO) if "something went wrong while authenticating" in str(e).lower() else None
+        hint = probe_npsso_auth_error(PSN_SESSION["npsso"]) if "something went wrong while authenticating" in str(e).lower() else None
         if hint:
             print(f"\n* Error: {hint}")
         else:
@@ -1512,22 +5167,26 @@ def psn_monitor_user(psn_user_id, csv_file_name):
     print_step("Fetching profile info...")
     try:
         accountid = psn_user.account_id
+        rate_limit_acquire("profile")
         profile = psn_user.profile()
         aboutme = profile.get("aboutMe")
         isplus = profile.get("isPlus")
         langs = profile.get("languages") or []
         is_verified = profile.get("isOfficiallyVerified")
+        rate_limit_acquire("profile")
         fs = psn_user.friendship()
+        rate_limit_acquire("profile")
         share = psn_user.get_shareable_profile_link()
     except Exception as e:
         print(f"\n* Error: {e}")
         sys.exit(1)
     print_ok()
 
+    # Presence is fetched like in later polls, by the lean presence client if RAW_PRESENCE_CLIENT is enabled
     print_step("Fetching presence info...")
     try:
-        psn_user_presence = psn_user.get_presence()
-        parse_presence(psn_user_presence)
+        rate_limit_acquire("presence")
+        parsed = get_user_presence(state)
     except Exception as e:
         print(f"\n* Error: Cannot get presence for user {psn_user_id}: {e}")
         sys.exit(1)
@@ -1535,7 +5194,7 @@ def psn_monitor_user(psn_user_id, csv_file_name):
 
     print_step("Fetching game title info...")
     try:
-        status = psn_user_presence["basicPresence"]["primaryPlatformInfo"].get("onlineStatus")
+        status = parsed["status"]
 
         if not status:
             print(f"\n* Error: Cannot get status for user {psn_user_id}")
@@ -1543,26 +5202,23 @@ def psn_monitor_user(psn_user_id, csv_file_name):
 
         status = str(status).lower()
 
-        psn_platform_raw = psn_user_presence["basicPresence"]["primaryPlatformInfo"].get("platform")
-        psn_platform = format_platform_display(psn_platform_raw)
-        lastonline = psn_user_presence["basicPresence"]["primaryPlatformInfo"].get("lastOnlineDate")
-        availability = psn_user_presence["basicPresence"].get("availability")
+        psn_platform = format_platform_display(parsed["platform"])
+        availability = parsed["availability"]
 
-        lastonline_dt = convert_iso_str_to_datetime(lastonline)
+        lastonline_dt = convert_iso_str_to_datetime(parsed["last_online"])
         if lastonline_dt:
             lastonline_ts = int(lastonline_dt.timestamp())
         else:
             lastonline_ts = 0
 
-        gametitleinfolist = psn_user_presence["basicPresence"].get("gameTitleInfoList")
         game_name = ""
+        game_ids = ("", "")
         launchplatform = ""
 
-        if gametitleinfolist:
-            game_name_raw = gametitleinfolist[0].get("titleName")
-            game_name = normalize_ascii(game_name_raw) if game_name_raw else ""
-            launchplatform = gametitleinfolist[0].get("launchPlatform")
-            launchplatform = str(launchplatform).upper()
+        if parsed["game_name"] or parsed["title_id"]:
+            game_ids = (parsed["title_id"] or "", parsed["concept_id"] or "")
+            game_name = get_game_name(game_ids[0], parsed["game_name"])
+            launchplatform = str(parsed["launch_platform"]).upper() if parsed["launch_platform"] else ""
     except Exception as e:
         print(f"\n* Error: {e}")
         sys.exit(1)
@@ -1570,63 +5226,14 @@ def psn_monitor_user(psn_user_id, csv_file_name):
 
     print()
 
-    status_ts_old = int(time.time())
-    status_ts_old_bck = status_ts_old
-
-    if status and status != "offline":
-        status_online_start_ts = status_ts_old
-        status_online_start_ts_old = status_online_start_ts
-
-    psn_last_status_file = f"psn_{psn_user_id}_last_status.json"
-    last_status_read = []
-    last_status_ts = 0
-    last_status = ""
-
-    if os.path.isfile(psn_last_status_file):
-        try:
-            with open(psn_last_status_file, 'r', encoding="utf-8") as f:
-                last_status_read = json.load(f)
-        except Exception as e:
-            print(f"* Cannot load last status from '{psn_last_status_file}' file: {e}")
-        if last_status_read:
-            last_status_ts = last_status_read[0]
-            last_status = last_status_read[1]
-            psn_last_status_file_mdate_dt = datetime.fromtimestamp(int(os.path.getmtime(psn_last_status_file)), pytz.timezone(LOCAL_TIMEZONE))
-
-            print(f"* Last status loaded from file '{psn_last_status_file}' ({get_short_date_from_ts(psn_last_status_file_mdate_dt, show_weekday=False, always_show_year=True)})")
-
-            if last_status_ts > 0:
-                last_status_dt_str = get_short_date_from_ts(last_status_ts, show_weekday=False, always_show_year=True)
-                last_status_str = str(last_status.upper())
-                print(f"* Last status read from file: {last_status_str} ({last_status_dt_str})")
-
-                if lastonline_ts and status == "offline":
-                    if lastonline_ts >= last_status_ts:
-                        status_ts_old = lastonline_ts
-                    else:
-                        status_ts_old = last_status_ts
-                if not lastonline_ts and status == "offline":
-                    status_ts_old = last_status_ts
-                if status and status != "offline" and status == last_status:
-                    status_online_start_ts = last_status_ts
-                    status_online_start_ts_old = status_online_start_ts
-                    status_ts_old = last_status_ts
-
-    if last_status_ts > 0 and status != last_status:
-        last_status_to_save = []
-        last_status_to_save.append(status_ts_old)
-        last_status_to_save.append(status)
-        try:
-            with open(psn_last_status_file, 'w', encoding="utf-8") as f:
-                json.dump(last_status_to_save, f, indent=2)
-        except Exception as e:
-            print(f"* Cannot save last status to '{psn_last_status_file}' file: {e}")
+    print()
 
-    try:
-        if csv_file_name and (status != last_status):
-            write_csv_entry(csv_file_name, now_local_naive(), status, game_name)
-    except Exception as e:
-        print(f"* Error: {e}")
+    start_ts = int(time.time())
+    start_user_state(state, status, game_name, launchplatform, lastonline_ts, start_ts, game_ids)
+    if state["refresh"]["profile"]["snapshot"] is None:
+        state["refresh"]["profile"]["snapshot"] = get_profile_snapshot(profile, fs)
+        state["refresh"]["profile"]["ts"] = start_ts
+    status_ts_old = state["status_ts_old"]
 
     print(f"\nPlayStation ID:\t\t\t{psn_user_id}")
     print(f"PSN account ID:\t\t\t{accountid}")
@@ -1672,424 +5279,536 @@ def psn_monitor_user(psn_user_id, csv_file_name):
             else:
                 print("Mutual friends:\t\t\thidden")
         else:
-            # Don't print mutual friends at all
-            pass
+            # Don't print mutual friends at all
+            pass
+
+    except Exception:
+        pass
+
+    try:
+        print(f"\nProfile URL:\t\t\t{share.get('shareUrl')}")
+        # print(f"Profile QR image:\t\t{share.get('shareImageUrl')}")
+    except Exception:
+        pass
+
+    if status != "offline" and game_name:
+        launchplatform_str = ""
+        if launchplatform:
+            launchplatform_str = f" ({launchplatform})"
+        print(f"\nUser is currently in-game:\t{game_name}{launchplatform_str}")
+
+
+    if status_ts_old != start_ts:
+        if status == "offline":
+            last_status_dt_str = get_date_from_ts(status_ts_old)
+            print(f"\n* Last time user was available:\t{last_status_dt_str}")
+        print(f"\n* User is {str(status).upper()} for:\t\t{calculate_timespan(now_local(), int(status_ts_old), show_seconds=False)}")
+
+
+    print_cur_ts("\nTimestamp:\t\t\t")
+
+    try:
+        run_scheduler([state])
+    finally:
+        save_checkpoints([state])
+
+
+# Main function that monitors gaming activity of multiple PSN users sharing one PSNAWP session
+# csv_file_names maps PSN user ID to its CSV file name
+def psn_monitor_users(psn_user_ids, csv_file_names):
+
+    print("Sneaking into PlayStation like a ninja ...\n")
+
+    try:
+        create_pool_psn_session()
+    except Exception as e:
+        hint = probe_npsso_auth_error(PSN_SESSION["npsso"]) if "something went wrong while authenticating" in str(e).lower() else None
+        if hint:
+            print(f"* Error: {hint}")
+        else:
+            print(f"* Error: {e}")
+        sys.exit(1)
+
+    states = start_monitored_users(psn_user_ids, csv_file_names)
+
+    if not states:
+        print("* Error: none of the PSN users can be monitored")
+        sys.exit(1)
+
+    if LEASE_BACKEND:
+        print(f"\n* Monitoring {sum(1 for state in states if state['lease'])} of {len(psn_user_ids)} PSN users (leases held by node {get_lease_node_id()})")
+    else:
+        print(f"\n* Monitoring {len(states)} of {len(psn_user_ids)} PSN users")
+    print_cur_ts("\nTimestamp:\t\t\t")
+
+    try:
+        run_scheduler(states)
+    finally:
+        save_checkpoints(states)
+        release_user_leases(states)
+
+
+# Creates states of the monitored users and starts their monitoring, returns states of users which can be monitored
+# handed_states maps PSN user ID to state exported by export_user_state() to continue from instead of fetching presence
+# With LEASE_BACKEND all users are kept and only users whose lease this node acquires are started (from the state
+# handed over with the lease)
+def start_monitored_users(psn_user_ids, csv_file_names, handed_states=None):
+    states = []
+    for psn_user_id in psn_user_ids:
+        state = new_user_state(psn_user_id, csv_file_names.get(psn_user_id, ""))
+        if LEASE_BACKEND:
+            state["lease"] = False
+        elif handed_states and psn_user_id in handed_states:
+            import_user_state(state, handed_states[psn_user_id])
+        else:
+            try:
+                start_user_monitoring(state)
+            except Exception as e:
+                print(f"* Error: cannot start monitoring of PSN user {psn_user_id}: {e}")
+                continue
+        states.append(state)
+
+    if LEASE_BACKEND:
+        renew_user_leases(states, force=True)
+    return states
+
+
+# Returns account IDs of all friends of the PSN account of the current credential
+def fetch_friend_account_ids():
+    account_ids = []
+    offset = 0
+    while True:
+        rate_limit_acquire("friends")
+        data = psn_api_get_json(f"{get_psn_profile_api_url()}/me/friends?limit=1000&offset={offset}")
+        friends = data.get("friends") if isinstance(data, dict) else None
+        if not isinstance(friends, list):
+            raise PsnMalformedResponse(f"malformed friends list response: friends is {type(friends).__name__}")
+        account_ids += [str(account_id) for account_id in friends]
+        if not data.get("nextOffset"):
+            return account_ids
+        offset = data["nextOffset"]
+
+
+# Returns online IDs of the accounts (account ID -> online ID) from the account ID cache, accounts missing in the cache
+# are looked up in bulk (FRIENDS_PRESENCE_BATCH accounts per request) and cached
+def lookup_online_ids(account_ids):
+    cached = {entry["account_id"]: entry["online_id"] for entry in get_psn_id_cache().values()}
+    online_ids = {account_id: cached[account_id] for account_id in account_ids if account_id in cached}
+    missing = [account_id for account_id in account_ids if account_id not in online_ids]
+    for i in range(0, len(missing), FRIENDS_PRESENCE_BATCH):
+        batch = missing[i:i + FRIENDS_PRESENCE_BATCH]
+        rate_limit_acquire("profile")
+        data = psn_api_get_json(f"{get_psn_profile_api_url()}/profiles?accountIds={','.join(batch)}")
+        profiles = data.get("profiles") if isinstance(data, dict) else None
+        if not isinstance(profiles, list):
+            raise PsnMalformedResponse(f"malformed profiles response: profiles is {type(profiles).__name__}")
+        for account_id, profile in zip(batch, profiles):
+            if isinstance(profile, dict) and profile.get("onlineId"):
+                online_ids[account_id] = profile["onlineId"]
+                save_psn_id(profile["onlineId"], account_id, profile["onlineId"], write=False)
+    if missing:
+        write_psn_id_cache()
+    return online_ids
+
+
+# Fetches presences of the accounts in bulk (FRIENDS_PRESENCE_BATCH accounts per request), returns account ID -> presence
+# in the shape returned by PSNAWP's get_presence(); accounts whose presence is not visible are missing
+def fetch_bulk_presences(account_ids):
+    presences = {}
+    for i in range(0, len(account_ids), FRIENDS_PRESENCE_BATCH):
+        batch = account_ids[i:i + FRIENDS_PRESENCE_BATCH]
+        rate_limit_acquire("presence")
+        data = psn_api_get_json(f"{get_psn_presence_api_url()}/basicPresences?type=primary&accountIds={','.join(batch)}")
+        entries = data.get("basicPresences") if isinstance(data, dict) else None
+        if not isinstance(entries, list):
+            raise PsnMalformedResponse(f"malformed bulk presence response: basicPresences is {type(entries).__name__}")
+        for entry in entries:
+            if isinstance(entry, dict) and entry.get("accountId"):
+                presences[str(entry["accountId"])] = {"basicPresence": entry}
+    return presences
+
+
+# Returns True if the friend with the PSN ID is watched: listed on the command line (if any) and matching FRIENDS_FILTER
+def is_watched_friend(ctx, online_id):
+    if ctx["only"] and online_id.lower() not in ctx["only"]:
+        return False
+    return not FRIENDS_FILTER or re.search(FRIENDS_FILTER, online_id, re.IGNORECASE) is not None
+
+
+# Updates watched friends from the friends list of the account: only new friends are looked up and get a user state
+# (started with the next bulk presence poll), monitoring of removed friends stops
+def sync_friends(ctx):
+    account_ids = fetch_friend_account_ids()
+    new_account_ids = [account_id for account_id in account_ids if account_id not in ctx["friends"]]
+    online_ids = lookup_online_ids(new_account_ids) if new_account_ids else {}
+
+    current = set(account_ids)
+    for account_id in [account_id for account_id in ctx["friends"] if account_id not in current]:
+        online_id = ctx["friends"].pop(account_id)
+        if ctx["states"].pop(account_id, None) is not None:
+            print(f"* PSN user {online_id} is no longer a friend, monitoring stopped")
+
+    # Friends whose online ID cannot be looked up are retried with the next friends list refresh
+    for account_id in new_account_ids:
+        online_id = online_ids.get(account_id)
+        if not online_id:
+            continue
+        ctx["friends"][account_id] = online_id
+        if is_watched_friend(ctx, online_id):
+            ctx["states"][account_id] = new_user_state(online_id, get_user_file_name(CSV_FILE, online_id) if CSV_FILE else "")
+            if ctx["synced_ts"]:
+                print(f"* PSN user {online_id} is a new friend, monitoring started")
+
+    ctx["synced_ts"] = time.time()
+    METRICS["friends_total"] = len(ctx["friends"])
+    METRICS["friends_watched"] = len(ctx["states"])
+
+
+# Polls presences of all watched friends in bulk (refreshing the friends list every FRIENDS_REFRESH_INTERVAL seconds)
+# and runs each friend through the normal change detection; returns the delay before the next poll; in seconds
+# Requests are bounded by socket timeouts of the lean client (see raw_http_get()), so no SIGALRM is used here
+def poll_friends(ctx):
+    group_state = ctx["group_state"]
+
+    # PSN calls are suspended while the circuit breaker is open
+    breaker_wait = circuit_breaker_wait()
+    if breaker_wait > 0:
+        return breaker_wait
+
+    metric_inc("polls_total")
+    try:
+        if time.time() - ctx["synced_ts"] >= FRIENDS_REFRESH_INTERVAL:
+            sync_friends(ctx)
+        presences = fetch_bulk_presences(list(ctx["states"]))
+        rate_limit_success()
+    except Exception as e:
+        return handle_poll_error(group_state, e)
+    group_state["email_sent"] = False
+    group_state["error_streak"] = 0
+    group_state["retry_delay"] = 0
+    circuit_breaker_record(True)
+
+    for account_id, state in ctx["states"].items():
+        state["last_poll_ts"] = time.time()
+        presence = presences.get(account_id)
+        if presence is None:
+            metric_inc("friends_presence_missing")
+            continue
+        try:
+            parsed = parse_presence(presence)
+            if not state["status"]:
+                start_user_from_presence(state, parsed)
+                continue
+            status, game_name, launchplatform, game_ids = get_presence_fields(parsed)
+            apply_user_presence(state, status, game_name, launchplatform, game_ids)
+        except Exception as e:
+            metric_inc(f"poll_errors_{classify_psn_exception(e)}")
+            print(f"* Cannot process presence of PSN user {state['psn_user_id']}: {e}")
+            print_cur_ts("Timestamp:\t\t\t")
+
+    write_metrics_file()
+    state_store_sync()
+
+    interval = min((get_user_interval(state) for state in ctx["states"].values()), default=PSN_CHECK_INTERVAL)
+    return max(1, min(interval, ctx["synced_ts"] + FRIENDS_REFRESH_INTERVAL - time.time()))
+
+
+# Main function of friends mode: watches all friends of the PSN account with bulk presence polls (see FRIENDS_MODE)
+# psn_user_ids (optional) limits it to these friends
+def psn_monitor_friends(psn_user_ids):
+
+    print("Sneaking into PlayStation like a ninja ...\n")
+
+    try:
+        create_pool_psn_session()
+    except Exception as e:
+        hint = probe_npsso_auth_error(PSN_SESSION["npsso"]) if "something went wrong while authenticating" in str(e).lower() else None
+        if hint:
+            print(f"* Error: {hint}")
+        else:
+            print(f"* Error: {e}")
+        sys.exit(1)
 
-    except Exception:
-        pass
+    # group_state keeps error streaks, retry delays and error emails of the bulk polls
+    ctx = {"group_state": new_user_state("friends", ""), "only": {psn_user_id.lower() for psn_user_id in psn_user_ids}, "friends": {}, "states": {}, "synced_ts": 0}
 
     try:
-        print(f"\nProfile URL:\t\t\t{share.get('shareUrl')}")
-        # print(f"Profile QR image:\t\t{share.get('shareImageUrl')}")
-    except Exception:
-        pass
+        sync_friends(ctx)
+    except Exception as e:
+        print(f"* Error: cannot get friends list: {e}")
+        sys.exit(1)
 
-    if status != "offline" and game_name:
-        launchplatform_str = ""
-        if launchplatform:
-            launchplatform_str = f" ({launchplatform})"
-        print(f"\nUser is currently in-game:\t{game_name}{launchplatform_str}")
-        game_ts_old = int(time.time())
-        games_number += 1
+    print(f"* Watching {len(ctx['states'])} of {len(ctx['friends'])} friends ({-(-len(ctx['states']) // FRIENDS_PRESENCE_BATCH)} presence requests per poll)\n")
 
-    if last_status_ts == 0:
-        if lastonline_ts and status == "offline":
-            status_ts_old = lastonline_ts
-        last_status_to_save = []
-        last_status_to_save.append(status_ts_old)
-        last_status_to_save.append(status)
-        try:
-            with open(psn_last_status_file, 'w', encoding="utf-8") as f:
-                json.dump(last_status_to_save, f, indent=2)
-        except Exception as e:
-            print(f"* Cannot save last status to '{psn_last_status_file}' file: {e}")
+    # All friends are polled together, so a poll of any friend requested via the control socket moves the next bulk poll
+    def poll_at(state, deadline):
+        ctx["poll_ts"] = min(ctx["poll_ts"], deadline)
+        for friend_state in ctx["states"].values():
+            friend_state["poll_deadline"] = ctx["poll_ts"]
 
-    if status_ts_old != status_ts_old_bck:
-        if status == "offline":
-            last_status_dt_str = get_date_from_ts(status_ts_old)
-            print(f"\n* Last time user was available:\t{last_status_dt_str}")
-        print(f"\n* User is {str(status).upper()} for:\t\t{calculate_timespan(now_local(), int(status_ts_old), show_seconds=False)}")
+    control_ctx = {"states": lambda: list(ctx["states"].values()), "poll": poll_at, "add": None, "remove": None}
 
-    status_old = status
-    game_name_old = game_name
+    ctx["poll_ts"] = 0
+    last_liveness_ts = time.time()
+    WAKEUP["loop"] = True
+    try:
+        while True:
+            handle_wakeup(control_ctx)
+            if time.time() < ctx["poll_ts"]:
+                wait_for_wakeup(ctx["poll_ts"] - time.time())
+                continue
+            ctx["poll_ts"] = float("inf")
+            poll_at(None, time.time() + poll_friends(ctx))
+            if LIVENESS_CHECK_INTERVAL and time.time() - last_liveness_ts >= LIVENESS_CHECK_INTERVAL:
+                print(f"* Watching {len(ctx['states'])} of {len(ctx['friends'])} friends")
+                print_cur_ts("Liveness check, timestamp:\t")
+                last_liveness_ts = time.time()
+    finally:
+        save_checkpoints(ctx["states"].values())
 
-    print_cur_ts("\nTimestamp:\t\t\t")
 
-    alive_counter = 0
-    email_sent = False
+# Returns 64-bit hash of the key used to place workers and users on the consistent hash ring
+def get_ring_hash(key):
+    return int.from_bytes(hashlib.sha1(str(key).encode("utf-8")).digest()[:8], "big")
 
-    m_subject = m_body = ""
-    error_streak = 0
-    last_recreate_ts = 0
-    recreate_cooldown = 300  # avoid recreating PSNAWP session too frequently
-    last_npsso_seen = PSN_NPSSO
 
-    def _close_psnawp_sessions(obj):
-        try:
-            if obj and hasattr(obj, "close"):
-                try:
-                    obj.close()
-                except Exception:
-                    pass
-            for attr in ("session", "_session", "http", "_http", "client", "_client"):
-                s = getattr(obj, attr, None)
-                if s and hasattr(s, "close"):
-                    try:
-                        s.close()
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+# Returns consistent hash ring of workers: sorted list of (hash, worker ID) with HASH_RING_VNODES points per worker
+def build_hash_ring(worker_ids):
+    return sorted((get_ring_hash(f"worker-{worker_id}#{vnode}"), worker_id) for worker_id in worker_ids for vnode in range(max(HASH_RING_VNODES, 1)))
 
-    def get_sleep_interval():
-        return PSN_ACTIVE_CHECK_INTERVAL if status and status != "offline" else PSN_CHECK_INTERVAL
 
-    def _recreate_session_rate_limited():
-        nonlocal psnawp, psn_user, last_recreate_ts
-        now = int(time.time())
-        if (now - last_recreate_ts) < recreate_cooldown:
-            return False
-        try:
-            _close_psnawp_sessions(psnawp)
-        except Exception:
-            pass
-        try:
-            psnawp = PSNAWP(PSN_NPSSO)
-            psn_user = psnawp.user(online_id=psn_user_id)
-            last_recreate_ts = now
-            return True
-        except Exception:
-            return False
+# Returns users assigned to each worker on the hash ring: worker ID -> list of PSN user IDs
+def assign_users_to_workers(ring, psn_user_ids):
+    import bisect
+    assignment = {}
+    for psn_user_id in psn_user_ids:
+        idx = bisect.bisect_left(ring, (get_ring_hash(psn_user_id),)) % len(ring)
+        assignment.setdefault(ring[idx][1], []).append(psn_user_id)
+    return assignment
 
-    sleep_interval = get_sleep_interval()
 
-    time.sleep(sleep_interval)
+# Signal handler for SIGTERM in worker processes, exits the scheduler loop so the worker hands its state back
+def worker_stop_signal_handler(sig, frame):
+    stop_from_signal(lambda: sys.exit(0))
 
-    # Main loop
-    while True:
-        # If PSN_NPSSO changed (e.g. .env updated + SIGHUP), recreate the PSNAWP session immediately.
-        if PSN_NPSSO != last_npsso_seen:
-            try:
-                _close_psnawp_sessions(psnawp)
-            except Exception:
-                pass
-            try:
-                psnawp = PSNAWP(PSN_NPSSO)
-                psn_user = psnawp.user(online_id=psn_user_id)
-                last_recreate_ts = int(time.time())
-                print("* PSN_NPSSO updated - recreated PSNAWP session")
-                print_cur_ts("Timestamp:\t\t\t")
-            except Exception as e:
-                print(f"* Warning: failed to recreate PSNAWP session after PSN_NPSSO update: {e}")
-                if ERROR_NOTIFICATION and not email_sent:
-                    m_subject = f"psn_monitor: failed to recreate PSNAWP session (user: {psn_user_id})"
-                    m_body = f"Failed to recreate PSNAWP session after PSN_NPSSO update: {e}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                    print(f"Sending email notification to {RECEIVER_EMAIL}")
-                    send_email(m_subject, m_body, "", SMTP_SSL)
-                    email_sent = True
-                print_cur_ts("Timestamp:\t\t\t")
-            last_npsso_seen = PSN_NPSSO
-            # allow notifications again after token rotation
-            email_sent = False
-            error_streak = 0
-
-        # Sometimes PSN network functions halt, so we use alarm signal functionality to kill it inevitably, not available on Windows
-        if platform.system() != 'Windows':
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(FUNCTION_TIMEOUT)
-        try:
-            psn_user_presence = psn_user.get_presence()
-            parsed = parse_presence(psn_user_presence)
-            status = parsed["status"]
-            game_name_raw = parsed["game_name"]
-            game_name = normalize_ascii(game_name_raw) if game_name_raw else ""
-            launch_platform_raw = parsed["launch_platform"]
-            launchplatform = str(launch_platform_raw).upper() if launch_platform_raw else ""
-            if platform.system() != 'Windows':
-                signal.alarm(0)
-            if not status:
-                raise PsnMalformedResponse('onlineStatus is empty')
-            else:
-                status = str(status).lower()
-        except TimeoutException:
-            if platform.system() != 'Windows':
-                signal.alarm(0)
-            print(f"psn_user.get_presence() timeout, retrying in {display_time(FUNCTION_TIMEOUT)}")
-            print_cur_ts("Timestamp:\t\t\t")
-            time.sleep(FUNCTION_TIMEOUT)
-            continue
 
-        except Exception as e:
-            if platform.system() != 'Windows':
-                signal.alarm(0)
-
-            kind = classify_psn_exception(e)
-
-            # Fatal local fd exhaustion — cannot recover in-process
-            if kind == "exhausted":
-                hint = ""
-                msg_l = str(e).lower()
-                if "oauth/token" in msg_l or "authz" in msg_l or "npsso" in msg_l:
-                    hint = "\n* Note: this can be a secondary effect of repeated PSN auth refresh attempts (e.g. expired NPSSO). After fixing NOFILE verify your NPSSO."
-                msg = (f"* Fatal: Too many open files (errno 24). "
-                       f"This is a local limit/file-descriptor exhaustion problem not an NPSSO expiry.\n"
-                       f"* Last error: {e}\n"
-                       f"* Fix: increase your process NOFILE/ulimit (e.g. `ulimit -n 4096`) "
-                       f"and if running under systemd set `LimitNOFILE=`. Then restart the tool.{hint}")
-                print(msg)
-                if ERROR_NOTIFICATION and not email_sent:
-                    m_subject = f"psn_monitor: fatal error - too many open files (user: {psn_user_id})"
-                    m_body = f"{msg}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                    print(f"Sending email notification to {RECEIVER_EMAIL}")
-                    send_email(m_subject, m_body, "", SMTP_SSL)
-                    email_sent = True
-                print_cur_ts("Timestamp:\t\t\t")
-                sys.exit(2)
-
-            error_streak += 1
-
-            if kind == "auth":
-                sleep_interval = max(60, get_sleep_interval())
-                hint = probe_npsso_auth_error(PSN_NPSSO) if "something went wrong while authenticating" in str(e).lower() else None
-                if hint:
-                    print(f"* PSN auth failed: {hint}")
-                else:
-                    print(f"* PSN authentication failed (NPSSO may be expired/invalid): {e}")
-                    print("* Hint: update PSN_NPSSO in your .env and send SIGHUP to this process (or restart).")
-                if ERROR_NOTIFICATION and not email_sent:
-                    m_subject = f"psn_monitor: PSN NPSSO key error! (user: {psn_user_id})"
-                    body_reason = hint if hint else f"PSN authentication failed (NPSSO may be expired/invalid): {e}"
-                    m_body = f"{body_reason}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                    print(f"Sending email notification to {RECEIVER_EMAIL}")
-                    send_email(m_subject, m_body, "", SMTP_SSL)
-                    email_sent = True
-                print_cur_ts("Timestamp:\t\t\t")
-                _recreate_session_rate_limited()
-                time.sleep(sleep_interval)
-                continue
+# Worker process of the supervisor: monitors the assigned users in its own scheduler and PSNAWP session
+# handed_states maps PSN user ID to state exported by the previous worker of the user (see export_user_state())
+# Metrics and exported user states are sent to the supervisor every SUPERVISOR_REPORT_INTERVAL seconds and on exit
+def psn_monitor_worker(worker_id, psn_user_ids, csv_file_names, handed_states, report_queue):
+    global METRICS_FILE
 
-            if kind == "malformed":
-                sleep_interval = max(60, get_sleep_interval())
-                hint = probe_npsso_auth_error(PSN_NPSSO)
-                if hint:
-                    print(f"* PSN returned a malformed response and auth probe reports: {hint}")
-                else:
-                    print(f"* PSN returned an unexpected response shape will recreate session: {e}")
-                if _recreate_session_rate_limited():
-                    print("* Recreated PSNAWP session after malformed response")
-                if ERROR_NOTIFICATION and not email_sent and error_streak >= 3:
-                    m_subject = f"psn_monitor: PSN returned malformed responses (user: {psn_user_id})"
-                    body_reason = hint if hint else f"PSN returned unexpected response shape ({error_streak} in a row). Last error: {e}"
-                    m_body = f"{body_reason}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                    print(f"Sending email notification to {RECEIVER_EMAIL}")
-                    send_email(m_subject, m_body, "", SMTP_SSL)
-                    email_sent = True
-                print_cur_ts("Timestamp:\t\t\t")
-                time.sleep(sleep_interval)
-                continue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, worker_stop_signal_handler)
+    METRICS_FILE = ""
+    METRICS.clear()
 
-            if kind == "transient":
-                retry_delay = FUNCTION_TIMEOUT
-                if error_streak >= 3:
-                    if _recreate_session_rate_limited():
-                        print(f"* Recreated PSNAWP session after {error_streak} consecutive connection errors")
-                if ERROR_NOTIFICATION and not email_sent and error_streak >= 20:
-                    m_subject = f"psn_monitor: persistent connection errors (user: {psn_user_id})"
-                    m_body = f"Persistent connection errors detected ({error_streak} in a row). Last error: {e}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                    print(f"Sending email notification to {RECEIVER_EMAIL}")
-                    send_email(m_subject, m_body, "", SMTP_SSL)
-                    email_sent = True
-                if error_streak >= 3:
-                    print(f"* Error (connection) retrying in {display_time(retry_delay)}: {e}")
-                    print_cur_ts("Timestamp:\t\t\t")
-                time.sleep(retry_delay)
-                continue
+    try:
+        create_pool_psn_session()
+    except Exception as e:
+        print(f"* Error: worker {worker_id} cannot create PSN session: {e}")
+        sys.exit(1)
 
-            # kind == "unknown": safety net. After a few streaks we probe auth and recreate session so a novel error shape cannot silently loop forever
-            sleep_interval = get_sleep_interval()
-            hint = None
-            if error_streak >= 3:
-                hint = probe_npsso_auth_error(PSN_NPSSO)
-                if hint:
-                    print(f"* Error (unknown {error_streak} in a row) auth probe reports: {hint}")
-                else:
-                    print(f"* Error (unknown {error_streak} in a row) will recreate session: {e}")
-                _recreate_session_rate_limited()
-            else:
-                print(f"* Error retrying in {display_time(sleep_interval)}: {e}")
-            if ERROR_NOTIFICATION and not email_sent and error_streak >= 5:
-                m_subject = f"psn_monitor: persistent unexpected errors (user: {psn_user_id})"
-                body_reason = hint if hint else f"Persistent unexpected errors ({error_streak} in a row). Last error: {e}"
-                m_body = f"{body_reason}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                print(f"Sending email notification to {RECEIVER_EMAIL}")
-                send_email(m_subject, m_body, "", SMTP_SSL)
-                email_sent = True
-            print_cur_ts("Timestamp:\t\t\t")
-            time.sleep(sleep_interval)
-            continue
+    # Each worker is a separate lease holder, the ID stays the same when the worker is restarted
+    if LEASE_BACKEND:
+        LEASES["node"] = f"{LEASE_NODE_ID or platform.node()}:{os.getppid()}/w{worker_id}"
 
-        else:
-            email_sent = False
-            error_streak = 0
+    states = start_monitored_users(psn_user_ids, csv_file_names, handed_states)
+    if not states:
+        sys.exit(1)
 
-        finally:
-            if platform.system() != 'Windows':
-                signal.alarm(0)
+    last_report_ts = [time.time()]
 
-        change = False
-        act_inact_flag = False
+    def report(force=False):
+        if not force and time.time() - last_report_ts[0] < SUPERVISOR_REPORT_INTERVAL:
+            return
+        last_report_ts[0] = time.time()
+        report_queue.put((worker_id, dict(METRICS), {state["psn_user_id"]: export_user_state(state) for state in states}))
 
-        status_ts = int(time.time())
-        game_ts = int(time.time())
+    try:
+        run_scheduler(states, on_tick=report)
+    finally:
+        save_checkpoints(states)
+        report(force=True)
+        release_user_leases(states)
+        state_store_sync(force=True)
+
+
+# Main function of supervisor mode: spreads PSN users across worker processes with consistent hashing, restarts
+# crashed workers with the last state they reported, rebalances when the users file changes and merges worker metrics
+# cli_user_ids are PSN IDs given on the command line, they stay monitored when the users file changes
+def psn_monitor_supervisor(psn_user_ids, csv_file_names, workers, users_file="", cli_user_ids=()):
+    import multiprocessing
+    import queue
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("* Error: worker processes (--workers) are supported only on macOS/Linux/Unix")
+        sys.exit(1)
 
-        # Player status changed
-        if status != status_old:
+    global PSN_RATE_LIMIT, PSN_RATE_LIMIT_BURST
+    if PSN_RATE_LIMIT > 0:
+        PSN_RATE_LIMIT = max(PSN_RATE_LIMIT / workers, 1)
+        PSN_RATE_LIMIT_BURST = max(PSN_RATE_LIMIT_BURST // workers, 1)
+
+    mp = multiprocessing.get_context("fork")
+    report_queue = mp.Queue()
+    ring = build_hash_ring(range(workers))
+    assignment = assign_users_to_workers(ring, psn_user_ids)
+    handed_states = {}
+    supervisor_metrics = {"supervisor_workers": workers, "supervisor_users": len(psn_user_ids)}
+    # Counters of previous runs of restarted workers, so the summed counters never go down
+    retired_metrics = {}
+    procs = {worker_id: {"process": None, "users": [], "started_ts": 0, "restart_ts": 0, "restart_delay": 0} for worker_id in range(workers)}
+    users_file_mtime = os.path.getmtime(users_file) if users_file else 0
+
+    def drain_reports(timeout):
+        try:
+            while True:
+                worker_id, metrics, states = report_queue.get(timeout=timeout)
+                METRICS_WORKERS[worker_id] = metrics
+                handed_states.update(states)
+                timeout = 0
+        except queue.Empty:
+            pass
 
-            last_status_to_save = []
-            last_status_to_save.append(status_ts)
-            last_status_to_save.append(status)
-            try:
-                with open(psn_last_status_file, 'w', encoding="utf-8") as f:
-                    json.dump(last_status_to_save, f, indent=2)
-            except Exception as e:
-                print(f"* Cannot save last status to '{psn_last_status_file}' file: {e}")
-
-            print(f"PSN user {psn_user_id} changed status from {status_old} to {status}")
-            print(f"User was {status_old} for {calculate_timespan(int(status_ts), int(status_ts_old))} ({get_range_of_dates_from_tss(int(status_ts_old), int(status_ts), short=True)})")
-
-            m_subject_was_since = f", was {status_old}: {get_range_of_dates_from_tss(int(status_ts_old), int(status_ts), short=True)}"
-            m_subject_after = calculate_timespan(int(status_ts), int(status_ts_old), show_seconds=False)
-            m_body_was_since = f" ({get_range_of_dates_from_tss(int(status_ts_old), int(status_ts), short=True)})"
-
-            m_body_short_offline_msg = ""
-
-            # Player got online
-            if status_old == "offline" and status and status != "offline":
-                print(f"*** User got ACTIVE ! (was offline since {get_date_from_ts(status_ts_old)})")
-                game_total_after_offline_counted = False
-                if (status_ts - status_ts_old) > OFFLINE_INTERRUPT or not status_online_start_ts_old:
-                    status_online_start_ts = status_ts
-                    game_total_ts = 0
-                    games_number = 0
-                elif (status_ts - status_ts_old) <= OFFLINE_INTERRUPT and status_online_start_ts_old > 0:
-                    status_online_start_ts = status_online_start_ts_old
-                    short_offline_msg = f"Short offline interruption ({display_time(status_ts - status_ts_old)}), online start timestamp set back to {get_short_date_from_ts(status_online_start_ts_old)}"
-                    m_body_short_offline_msg = f"\n\n{short_offline_msg}"
-                    print(short_offline_msg)
-                act_inact_flag = True
-
-            m_body_played_games = ""
-
-            # Player got offline
-            if status_old and status_old != "offline" and status == "offline":
-                if status_online_start_ts > 0:
-                    m_subject_after = calculate_timespan(int(status_ts), int(status_online_start_ts), show_seconds=False)
-                    online_since_msg = f"(after {calculate_timespan(int(status_ts), int(status_online_start_ts), show_seconds=False)}: {get_range_of_dates_from_tss(int(status_online_start_ts), int(status_ts), short=True)})"
-                    m_subject_was_since = f", was available: {get_range_of_dates_from_tss(int(status_online_start_ts), int(status_ts), short=True)}"
-                    m_body_was_since = f" ({get_range_of_dates_from_tss(int(status_ts_old), int(status_ts), short=True)})\n\nUser was available for {calculate_timespan(int(status_ts), int(status_online_start_ts), show_seconds=False)} ({get_range_of_dates_from_tss(int(status_online_start_ts), int(status_ts), short=True)})"
-                else:
-                    online_since_msg = ""
-                if games_number > 0:
-                    if game_name_old and not game_name:
-                        game_total_ts += (int(game_ts) - int(game_ts_old))
-                        game_total_after_offline_counted = True
-                    m_body_played_games = f"\n\nUser played {games_number} games for total time of {display_time(game_total_ts)}"
-                    print(f"User played {games_number} games for total time of {display_time(game_total_ts)}")
-                print(f"*** User got OFFLINE ! {online_since_msg}")
-                status_online_start_ts_old = status_online_start_ts
-                status_online_start_ts = 0
-                act_inact_flag = True
-
-            m_body_user_in_game = ""
-            if status != "offline" and game_name:
-                launchplatform_str = ""
-                if launchplatform:
-                    launchplatform_str = f" ({launchplatform})"
-                print(f"User is currently in-game: {game_name}{launchplatform_str}")
-                m_body_user_in_game = f"\n\nUser is currently in-game: {game_name}{launchplatform_str}"
-
-            change = True
-
-            m_subject = f"PSN user {psn_user_id} is now {status} (after {m_subject_after}{m_subject_was_since})"
-            m_body = f"PSN user {psn_user_id} changed status from {status_old} to {status}\n\nUser was {status_old} for {calculate_timespan(int(status_ts), int(status_ts_old))}{m_body_was_since}{m_body_short_offline_msg}{m_body_user_in_game}{m_body_played_games}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-            if ACTIVE_INACTIVE_NOTIFICATION and act_inact_flag:
-                print(f"Sending email notification to {RECEIVER_EMAIL}")
-                send_email(m_subject, m_body, "", SMTP_SSL)
-
-            status_ts_old = status_ts
-            print_cur_ts("Timestamp:\t\t\t")
+    def retire_worker_metrics(worker_id):
+        for name, value in METRICS_WORKERS.pop(worker_id, {}).items():
+            if isinstance(value, (int, float)) and name not in METRICS_GAUGES and "_avg_" not in name and "_max_" not in name:
+                retired_metrics[name] = round(retired_metrics.get(name, 0) + value, 3)
+
+    def start_worker(worker_id):
+        retire_worker_metrics(worker_id)
+        users = assignment.get(worker_id, [])
+        worker = procs[worker_id]
+        worker["users"] = users
+        if not users:
+            worker["process"] = None
+            return
+        handed = {psn_user_id: handed_states[psn_user_id] for psn_user_id in users if psn_user_id in handed_states}
+        worker["process"] = mp.Process(target=psn_monitor_worker, args=(worker_id, users, csv_file_names, handed, report_queue), name=f"psn_monitor_worker_{worker_id}", daemon=True)
+        worker["process"].start()
+        worker["started_ts"] = time.time()
+        print(f"* Worker {worker_id} started (pid {worker['process'].pid}, {len(users)} users" + (f", {len(handed)} resumed" if handed else "") + ")")
+
+    # A worker stopped with SIGTERM exits its scheduler loop and reports its final state, which is drained while waiting
+    def stop_worker(worker_id):
+        process = procs[worker_id]["process"]
+        if process is None:
+            return
+        process.terminate()
+        while process.is_alive():
+            drain_reports(0.5)
+        process.join()
+        drain_reports(0)
+        procs[worker_id]["process"] = None
+
+    # Users added to or removed from the users file are moved only between the affected workers
+    def rebalance(new_user_ids):
+        nonlocal psn_user_ids, assignment
+        if new_user_ids == psn_user_ids:
+            return
+        for psn_user_id in new_user_ids:
+            if psn_user_id not in csv_file_names and CSV_FILE:
+                csv_file_names[psn_user_id] = get_user_file_name(CSV_FILE, psn_user_id)
+        new_assignment = assign_users_to_workers(ring, new_user_ids)
+        changed = [worker_id for worker_id in range(workers) if new_assignment.get(worker_id, []) != assignment.get(worker_id, [])]
+        print(f"* Users file changed: {len(new_user_ids)} users (was {len(psn_user_ids)}), rebalancing {len(changed)} of {workers} workers")
+        for worker_id in changed:
+            stop_worker(worker_id)
+        for psn_user_id in set(psn_user_ids) - set(new_user_ids):
+            handed_states.pop(psn_user_id, None)
+        psn_user_ids, assignment = new_user_ids, new_assignment
+        supervisor_metrics["supervisor_users"] = len(psn_user_ids)
+        supervisor_metrics["supervisor_rebalances"] = supervisor_metrics.get("supervisor_rebalances", 0) + 1
+        for worker_id in changed:
+            procs[worker_id]["restart_ts"] = 0
+            start_worker(worker_id)
+        print_cur_ts("Timestamp:\t\t\t")
+
+    # Runtime signals (notification toggles, polling interval changes, secrets reload) are applied by the supervisor,
+    # so restarted workers inherit the change, and forwarded to the running workers; workers inherit the handlers
+    # installed here, but only apply the signal
+    supervisor_pid = os.getpid()
+
+    def forward_signal(handler):
+        def forwarding_handler(sig, frame):
+            handler(sig, frame)
+            if os.getpid() != supervisor_pid:
+                return
+            for worker in procs.values():
+                if worker["process"] is not None and worker["process"].pid:
+                    try:
+                        os.kill(worker["process"].pid, sig)
+                    except OSError:
+                        pass
+        return forwarding_handler
 
-        # Player started/stopped/changed the game
-        if game_name != game_name_old:
-
-            launchplatform_str = ""
-            if launchplatform:
-                launchplatform_str = f" ({launchplatform})"
-
-            # User changed the game
-            if game_name_old and game_name:
-                print(f"PSN user {psn_user_id} changed game from '{game_name_old}' to '{game_name}'{launchplatform_str} after {calculate_timespan(int(game_ts), int(game_ts_old))}")
-                print(f"User played game from {get_range_of_dates_from_tss(int(game_ts_old), int(game_ts), short=True, between_sep=' to ')}")
-                game_total_ts += (int(game_ts) - int(game_ts_old))
-                games_number += 1
-                m_body = f"PSN user {psn_user_id} changed game from '{game_name_old}' to '{game_name}'{launchplatform_str} after {calculate_timespan(int(game_ts), int(game_ts_old))}\n\nUser played game from {get_range_of_dates_from_tss(int(game_ts_old), int(game_ts), short=True, between_sep=' to ')}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-                if launchplatform:
-                    launchplatform_str = f"{launchplatform}, "
-                m_subject = f"PSN user {psn_user_id} changed game to '{game_name}' ({launchplatform_str}after {calculate_timespan(int(game_ts), int(game_ts_old), show_seconds=False)}: {get_range_of_dates_from_tss(int(game_ts_old), int(game_ts), short=True)})"
-
-            # User started playing new game
-            elif not game_name_old and game_name:
-                print(f"PSN user {psn_user_id} started playing '{game_name}'{launchplatform_str}")
-                games_number += 1
-                m_subject = f"PSN user {psn_user_id} now plays '{game_name}'{launchplatform_str}"
-                m_body = f"PSN user {psn_user_id} now plays '{game_name}'{launchplatform_str}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-
-            # User stopped playing the game
-            elif game_name_old and not game_name:
-                print(f"PSN user {psn_user_id} stopped playing '{game_name_old}' after {calculate_timespan(int(game_ts), int(game_ts_old))}")
-                print(f"User played game from {get_range_of_dates_from_tss(int(game_ts_old), int(game_ts), short=True, between_sep=' to ')}")
-                if not game_total_after_offline_counted:
-                    game_total_ts += (int(game_ts) - int(game_ts_old))
-                m_subject = f"PSN user {psn_user_id} stopped playing '{game_name_old}' (after {calculate_timespan(int(game_ts), int(game_ts_old), show_seconds=False)}: {get_range_of_dates_from_tss(int(game_ts_old), int(game_ts), short=True)})"
-                m_body = f"PSN user {psn_user_id} stopped playing '{game_name_old}' after {calculate_timespan(int(game_ts), int(game_ts_old))}\n\nUser played game from {get_range_of_dates_from_tss(int(game_ts_old), int(game_ts), short=True, between_sep=' to ')}{get_cur_ts(nl_ch + nl_ch + 'Timestamp: ')}"
-
-            change = True
-
-            if GAME_CHANGE_NOTIFICATION and m_subject and m_body:
-                print(f"Sending email notification to {RECEIVER_EMAIL}")
-                send_email(m_subject, m_body, "", SMTP_SSL)
-
-            game_ts_old = game_ts
-            print_cur_ts("Timestamp:\t\t\t")
+    for sig in (signal.SIGUSR1, signal.SIGUSR2, signal.SIGTRAP, signal.SIGABRT, signal.SIGHUP):
+        handler = signal.getsignal(sig)
+        if callable(handler):
+            signal.signal(sig, forward_signal(handler))
 
-        if change:
-            alive_counter = 0
+    for worker_id in range(workers):
+        start_worker(worker_id)
+    print_cur_ts("\nTimestamp:\t\t\t")
 
-            try:
-                if csv_file_name:
-                    write_csv_entry(csv_file_name, now_local_naive(), status, game_name)
-            except Exception as e:
-                print(f"* Error: {e}")
-                print_cur_ts("Timestamp:\t\t\t")
+    last_check_ts = time.time()
+    try:
+        while True:
+            drain_reports(1)
+            now = time.time()
 
-        status_old = status
-        game_name_old = game_name
-        alive_counter += 1
+            for worker_id, worker in procs.items():
+                process = worker["process"]
+                if process is None or process.is_alive():
+                    continue
+                if not worker["restart_ts"]:
+                    supervisor_metrics["supervisor_worker_restarts"] = supervisor_metrics.get("supervisor_worker_restarts", 0) + 1
+                    if now - worker["started_ts"] > RETRY_MAX_DELAY:
+                        worker["restart_delay"] = 0
+                    worker["restart_delay"] = get_retry_delay(worker["restart_delay"], RETRY_BASE_DELAY)
+                    worker["restart_ts"] = now + worker["restart_delay"]
+                    print(f"* Worker {worker_id} exited with code {process.exitcode}, restarting in {display_time(worker['restart_delay'])}")
+                    print_cur_ts("Timestamp:\t\t\t")
+                elif now >= worker["restart_ts"]:
+                    worker["restart_ts"] = 0
+                    start_worker(worker_id)
 
-        if LIVENESS_CHECK_COUNTER and alive_counter >= LIVENESS_CHECK_COUNTER and (status == "offline" or not status):
-            print_cur_ts("Liveness check, timestamp:\t")
-            alive_counter = 0
+            if now - last_check_ts >= SUPERVISOR_REPORT_INTERVAL:
+                last_check_ts = now
 
-        sleep_interval = get_sleep_interval()
-        time.sleep(sleep_interval)
+                if users_file:
+                    try:
+                        mtime = os.path.getmtime(users_file)
+                        if mtime != users_file_mtime:
+                            users_file_mtime = mtime
+                            rebalance(list(dict.fromkeys(list(cli_user_ids) + read_users_file(users_file))))
+                    except Exception as e:
+                        print(f"* Error: cannot reload users file: {e}")
+
+                # Counters of all workers (and of previous runs of restarted workers) are summed, lag averages and
+                # maximums take the worst worker
+                METRICS.clear()
+                METRICS.update(retired_metrics)
+                for metrics in METRICS_WORKERS.values():
+                    for name, value in metrics.items():
+                        if not isinstance(value, (int, float)):
+                            continue
+                        if "_avg_" in name or "_max_" in name:
+                            METRICS[name] = max(METRICS.get(name, 0), value)
+                        else:
+                            METRICS[name] = round(METRICS.get(name, 0) + value, 3)
+                METRICS.update(supervisor_metrics)
+                METRICS["supervisor_workers_alive"] = sum(1 for worker in procs.values() if worker["process"] is not None and worker["process"].is_alive())
+                write_metrics_file(force=True)
+    finally:
+        for worker_id in procs:
+            if procs[worker_id]["process"] is not None and procs[worker_id]["process"].is_alive():
+                procs[worker_id]["process"].terminate()
 
 
 def main():
-    global CLI_CONFIG_PATH, DOTENV_FILE, LOCAL_TIMEZONE, LIVENESS_CHECK_COUNTER, PSN_NPSSO, CSV_FILE, DISABLE_LOGGING, PSN_LOGFILE, ACTIVE_INACTIVE_NOTIFICATION, GAME_CHANGE_NOTIFICATION, ERROR_NOTIFICATION, PSN_CHECK_INTERVAL, PSN_ACTIVE_CHECK_INTERVAL, SMTP_PASSWORD, stdout_bck
-
-    if "--generate-config" in sys.argv:
-        print(CONFIG_BLOCK.strip("\n"))
-        sys.exit(0)
+    global CLI_CONFIG_PATH, DOTENV_FILE, LOCAL_TIMEZONE, LIVENESS_CHECK_INTERVAL, LIVENESS_CHECK_COUNTER, PSN_NPSSO, PSN_API_BASE_URL, CSV_FILE, NDJSON_FILE, METRICS_FILE, STATE_STORE_FILE, DISABLE_LOGGING, HEADLESS_MODE, PSN_LOGFILE, ACTIVE_INACTIVE_NOTIFICATION, GAME_CHANGE_NOTIFICATION, TROPHY_NOTIFICATION, PROFILE_CHANGE_NOTIFICATION, ERROR_NOTIFICATION, PSN_CHECK_INTERVAL, PSN_ACTIVE_CHECK_INTERVAL, ADAPTIVE_POLLING, BURST_POLLING, RAW_PRESENCE_CLIENT, FRIENDS_MODE, FRIENDS_FILTER, CONTROL_SOCKET, WORKERS, LEASE_BACKEND, LEASE_NODE_ID, SMTP_PASSWORD, RATE_LIMIT_PACING, stdout_bck
 
     if "--version" in sys.argv:
         print(f"{os.path.basename(sys.argv[0])} v{VERSION}")
@@ -2100,10 +5819,6 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    clear_screen(CLEAR_SCREEN)
-
-    print(f"PSN Monitoring Tool v{VERSION}\n")
-
     parser = argparse.ArgumentParser(
         prog="psn_monitor",
         description=("Monitor a PSN user's playing status and send customizable email alerts [ https://github.com/misiektoja/psn_monitor/ ]"), formatter_class=argparse.RawTextHelpFormatter
@@ -2112,9 +5827,9 @@ def main():
     # Positional
     parser.add_argument(
         "psn_user_id",
-        nargs="?",
+        nargs="*",
         metavar="PSN_USER_ID",
-        help="User's PSN ID",
+        help="User's PSN ID (several IDs can be given to monitor multiple users)",
         type=str
     )
 
@@ -2135,8 +5850,11 @@ def main():
     )
     conf.add_argument(
         "--generate-config",
-        action="store_true",
-        help="Print default config template and exit",
+        nargs="?",
+        const="conf",
+        choices=["conf", "toml"],
+        metavar="FORMAT",
+        help="Print default config template (conf or toml format, conf by default) and exit",
     )
     conf.add_argument(
         "--env-file",
@@ -2152,7 +5870,15 @@ def main():
         dest="npsso_key",
         metavar="PSN_NPSSO",
         type=str,
-        help="PlayStation NPSSO key"
+        help="PlayStation NPSSO key (several keys of different accounts can be separated by commas)"
+    )
+
+    creds.add_argument(
+        "--psn-api-url",
+        dest="psn_api_url",
+        metavar="URL",
+        type=str,
+        help="Use alternative PSN API base URL (e.g. local fake server from tools/psn_fake_server.py)"
     )
 
     # Notifications
@@ -2171,6 +5897,20 @@ def main():
         default=None,
         help="Email on game start/change/stop"
     )
+    notify.add_argument(
+        "-t", "--notify-trophies",
+        dest="notify_trophies",
+        action="store_true",
+        default=None,
+        help="Email when user earns trophies (checked every TROPHIES_REFRESH_INTERVAL)"
+    )
+    notify.add_argument(
+        "-p", "--notify-profile",
+        dest="notify_profile",
+        action="store_true",
+        default=None,
+        help="Email when profile, trophy summary or played titles data of the user changes"
+    )
     notify.add_argument(
         "-e", "--no-error-notify",
         dest="notify_errors",
@@ -2222,6 +5962,27 @@ def main():
         type=int,
         help="Polling interval when user is online"
     )
+    times.add_argument(
+        "--adaptive",
+        dest="adaptive_polling",
+        action="store_true",
+        default=None,
+        help="Adapt polling interval of offline users to their hour-of-week activity profile"
+    )
+    times.add_argument(
+        "--burst",
+        dest="burst_polling",
+        action="store_true",
+        default=None,
+        help="Poll faster for a while right after status or game changes"
+    )
+    times.add_argument(
+        "--raw-presence",
+        dest="raw_presence",
+        action="store_true",
+        default=None,
+        help="Fetch presence with the lean built-in client instead of PSNAWP"
+    )
 
     # Features & Output
     opts = parser.add_argument_group("Features & output")
@@ -2232,6 +5993,83 @@ def main():
         type=str,
         help="Write status & game changes to CSV"
     )
+    opts.add_argument(
+        "--ndjson-file",
+        dest="ndjson_file",
+        metavar="NDJSON_FILENAME",
+        type=str,
+        help="Append all monitoring events to NDJSON file"
+    )
+    opts.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        metavar="METRICS_FILENAME",
+        type=str,
+        help="Write monitoring counters to JSON file"
+    )
+    opts.add_argument(
+        "--state-file",
+        dest="state_file",
+        metavar="STATE_FILENAME",
+        type=str,
+        help="State store file keeping last status & checkpoints of all users (with <file>.journal)"
+    )
+    opts.add_argument(
+        "--workers",
+        dest="workers",
+        metavar="N",
+        type=int,
+        help="Spread monitored users across N worker processes (multi-user mode, macOS/Linux/Unix)"
+    )
+    opts.add_argument(
+        "--lease-backend",
+        dest="lease_backend",
+        metavar="URL",
+        type=str,
+        help="Coordinate nodes monitoring the same users via leases, e.g. sqlite:///path/psn_leases.db"
+    )
+    opts.add_argument(
+        "--node-id",
+        dest="node_id",
+        metavar="NODE_ID",
+        type=str,
+        help="Unique ID of this node in the lease backend (default: <hostname>:<pid>)"
+    )
+    opts.add_argument(
+        "--friends",
+        dest="friends_mode",
+        action="store_true",
+        default=None,
+        help="Monitor all friends of the PSN account with bulk presence polls (PSN IDs given limit it to these friends)"
+    )
+    opts.add_argument(
+        "--friends-filter",
+        dest="friends_filter",
+        metavar="REGEX",
+        type=str,
+        help="Monitor only friends whose PSN ID matches the regex (friends mode, case-insensitive)"
+    )
+    opts.add_argument(
+        "--users-file",
+        dest="users_file",
+        metavar="PATH",
+        type=str,
+        help="File with PSN IDs of users to monitor, one per line"
+    )
+    opts.add_argument(
+        "--control-socket",
+        dest="control_socket",
+        metavar="PATH",
+        type=str,
+        help="Accept control commands (add/remove users, intervals, outputs, polls, state & stats) on Unix socket"
+    )
+    opts.add_argument(
+        "--control",
+        dest="control_command",
+        metavar="COMMAND",
+        type=str,
+        help="Send COMMAND to the control socket of the running tool, print the reply and exit (e.g. \"users\")"
+    )
     opts.add_argument(
         "-d", "--disable-logging",
         dest="disable_logging",
@@ -2239,9 +6077,27 @@ def main():
         default=None,
         help="Disable logging to psn_monitor_<psn_user_id>.log"
     )
+    opts.add_argument(
+        "--headless",
+        dest="headless",
+        action="store_true",
+        default=None,
+        help="Headless mode for services: no console output & log file, events go only to email/CSV/NDJSON/metrics"
+    )
 
     args = parser.parse_args()
 
+    if args.generate_config:
+        print(get_toml_config_template() if args.generate_config == "toml" else CONFIG_BLOCK.strip("\n"))
+        sys.exit(0)
+
+    # Headless mode is checked before the config file is read, so the screen is not cleared with --headless; control
+    # client mode (--control) prints only the reply of the running tool, so it can be parsed (e.g. JSON status)
+    clear_screen(CLEAR_SCREEN and not args.headless and not args.control_command)
+
+    if not args.control_command:
+        print(f"PSN Monitoring Tool v{VERSION}\n")
+
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         sys.exit(1)
@@ -2255,7 +6111,17 @@ def main():
         print(f"* Error: Config file '{CLI_CONFIG_PATH}' does not exist")
         sys.exit(1)
 
-    if cfg_path:
+    # TOML config files are validated as a whole before any option is set, legacy .conf files are executed as Python
+    if cfg_path and is_toml_config_file(cfg_path):
+        try:
+            CONFIG["options"], CONFIG["users"] = load_toml_config(cfg_path)
+        except Exception as e:
+            print(f"* Error loading config file '{cfg_path}': {e}")
+            sys.exit(1)
+        CONFIG["path"] = cfg_path
+        globals().update(CONFIG["options"])
+        LIVENESS_CHECK_COUNTER = LIVENESS_CHECK_INTERVAL / PSN_CHECK_INTERVAL
+    elif cfg_path:
         try:
             with open(cfg_path, "r") as cf:
                 exec(cf.read(), globals())
@@ -2298,11 +6164,11 @@ def main():
 
     local_tz = None
     if LOCAL_TIMEZONE == "Auto":
-        if get_localzone is not None:
-            try:
-                local_tz = get_localzone()
-            except Exception:
-                pass
+        try:
+            from tzlocal import get_localzone
+            local_tz = get_localzone()
+        except Exception:
+            pass
         if local_tz:
             LOCAL_TIMEZONE = str(local_tz)
         else:
@@ -2315,8 +6181,20 @@ def main():
             print(f"* Error: Configured LOCAL_TIMEZONE '{LOCAL_TIMEZONE}' is not valid. Please use a valid pytz timezone name.")
             sys.exit(1)
 
-    if not check_internet():
-        sys.exit(1)
+    if args.control_socket:
+        CONTROL_SOCKET = args.control_socket
+    if CONTROL_SOCKET:
+        CONTROL_SOCKET = os.path.expanduser(CONTROL_SOCKET)
+
+    if args.control_command:
+        if not CONTROL_SOCKET:
+            print("* Error: CONTROL_SOCKET (--control-socket) needs to be set to send control commands")
+            sys.exit(1)
+        try:
+            sys.exit(0 if send_control_command(CONTROL_SOCKET, args.control_command) else 1)
+        except (OSError, ValueError) as e:
+            print(f"* Error: cannot send command to control socket {CONTROL_SOCKET}: {e}")
+            sys.exit(1)
 
     if args.send_test_email:
         print("* Sending test email notification ...\n")
@@ -2326,10 +6204,39 @@ def main():
             sys.exit(1)
         sys.exit(0)
 
-    if not args.psn_user_id:
+    psn_user_ids = list(args.psn_user_id or [])
+    if args.users_file:
+        try:
+            psn_user_ids += read_users_file(os.path.expanduser(args.users_file))
+        except Exception as e:
+            print(f"* Error: cannot read users file: {e}")
+            sys.exit(1)
+    psn_user_ids = list(dict.fromkeys(psn_user_ids))
+
+    if args.friends_mode is True:
+        FRIENDS_MODE = True
+
+    if args.friends_filter:
+        FRIENDS_FILTER = args.friends_filter
+
+    if FRIENDS_MODE and args.info_mode:
+        print("* Error: info mode (-i) cannot be used in friends mode (--friends)")
+        sys.exit(1)
+
+    if FRIENDS_FILTER:
+        try:
+            re.compile(FRIENDS_FILTER)
+        except re.error as e:
+            print(f"* Error: FRIENDS_FILTER '{FRIENDS_FILTER}' is not a valid regex: {e}")
+            sys.exit(1)
+
+    if not psn_user_ids and not FRIENDS_MODE:
         print("* Error: PSN_USER_ID needs to be defined !")
         sys.exit(1)
 
+    # Friends mode logs and writes CSV files per friend like multi-user mode
+    multi_user = len(psn_user_ids) > 1 or FRIENDS_MODE
+
     if args.npsso_key:
         PSN_NPSSO = args.npsso_key
 
@@ -2337,12 +6244,37 @@ def main():
         print("* Error: PSN_NPSSO (-n / --npsso_key) value is empty or incorrect")
         sys.exit(1)
 
+    check_required_modules()
+
+    if args.psn_api_url:
+        PSN_API_BASE_URL = args.psn_api_url
+
+    if PSN_API_BASE_URL:
+        try:
+            apply_psn_api_base_url(PSN_API_BASE_URL)
+        except RuntimeError as e:
+            print(f"* Error: {e}")
+            sys.exit(1)
+
+    if args.state_file:
+        STATE_STORE_FILE = args.state_file
+    if STATE_STORE_FILE:
+        STATE_STORE_FILE = os.path.expanduser(STATE_STORE_FILE)
+
+    # Info mode skips the connectivity pre-check, the PSN authentication request reports network problems anyway
     if args.info_mode:
         include_trophies = args.include_trophies if hasattr(args, 'include_trophies') and args.include_trophies else False
         show_recent_games = not (hasattr(args, 'no_recent_games') and args.no_recent_games)
-        get_user_info(args.psn_user_id, include_trophies=include_trophies, show_recent_games=show_recent_games)
+        if multi_user:
+            print("* Error: info mode (-i) supports a single PSN_USER_ID")
+            sys.exit(1)
+        RATE_LIMIT_PACING = False
+        get_user_info(psn_user_ids[0], include_trophies=include_trophies, show_recent_games=show_recent_games)
         sys.exit(0)
 
+    if not check_internet(PSN_API_BASE_URL or CHECK_INTERNET_URL):
+        sys.exit(1)
+
     if args.check_interval:
         PSN_CHECK_INTERVAL = args.check_interval
         LIVENESS_CHECK_COUNTER = LIVENESS_CHECK_INTERVAL / PSN_CHECK_INTERVAL
@@ -2350,31 +6282,92 @@ def main():
     if args.active_interval:
         PSN_ACTIVE_CHECK_INTERVAL = args.active_interval
 
+    if args.adaptive_polling is True:
+        ADAPTIVE_POLLING = True
+
+    if args.burst_polling is True:
+        BURST_POLLING = True
+
+    if args.raw_presence is True:
+        RAW_PRESENCE_CLIENT = True
+
+    if args.workers is not None:
+        WORKERS = args.workers
+
+    if args.lease_backend:
+        LEASE_BACKEND = args.lease_backend
+
+    if args.node_id:
+        LEASE_NODE_ID = args.node_id
+
+    if CONTROL_SOCKET and (platform.system() == 'Windows' or (multi_user and WORKERS > 1 and not FRIENDS_MODE)):
+        print("* Warning: control socket is not available on Windows and with worker processes, it is disabled")
+        CONTROL_SOCKET = ""
+
+    if LEASE_BACKEND:
+        try:
+            get_lease_backend()
+        except Exception as e:
+            print(f"* Error: cannot open lease backend '{LEASE_BACKEND}': {e}")
+            sys.exit(1)
+
     if args.csv_file:
         CSV_FILE = os.path.expanduser(args.csv_file)
     else:
         if CSV_FILE:
             CSV_FILE = os.path.expanduser(CSV_FILE)
 
+    # In multi-user mode each user gets its own CSV file, e.g. psn.csv -> psn_<psn_user_id>.csv
+    csv_file_names = {}
     if CSV_FILE:
+        csv_file_names = {psn_user_id: (get_user_file_name(CSV_FILE, psn_user_id) if multi_user else CSV_FILE) for psn_user_id in psn_user_ids}
+
+    for csv_file_name in csv_file_names.values():
         try:
-            with open(CSV_FILE, 'a', newline='', buffering=1, encoding="utf-8") as _:
+            with open(csv_file_name, 'a', newline='', buffering=1, encoding="utf-8") as _:
                 pass
         except Exception as e:
             print(f"* Error, CSV file cannot be opened for writing: {e}")
             sys.exit(1)
 
+    if args.ndjson_file:
+        NDJSON_FILE = args.ndjson_file
+    if args.metrics_file:
+        METRICS_FILE = args.metrics_file
+
+    if NDJSON_FILE:
+        NDJSON_FILE = os.path.expanduser(NDJSON_FILE)
+        try:
+            with open(NDJSON_FILE, 'a', encoding="utf-8") as _:
+                pass
+        except Exception as e:
+            print(f"* Error, NDJSON file cannot be opened for writing: {e}")
+            sys.exit(1)
+
+    if METRICS_FILE:
+        METRICS_FILE = os.path.expanduser(METRICS_FILE)
+        try:
+            with open(METRICS_FILE, 'a', encoding="utf-8") as _:
+                pass
+        except Exception as e:
+            print(f"* Error, metrics file cannot be opened for writing: {e}")
+            sys.exit(1)
+
     if args.disable_logging is True:
         DISABLE_LOGGING = True
 
-    if not DISABLE_LOGGING:
+    if args.headless is True:
+        HEADLESS_MODE = True
+
+    if not DISABLE_LOGGING and not HEADLESS_MODE:
         log_path = Path(os.path.expanduser(PSN_LOGFILE))
+        log_suffix = "friends" if FRIENDS_MODE else "multi" if multi_user else psn_user_ids[0]
         if log_path.parent != Path('.'):
             if log_path.suffix == "":
-                log_path = log_path.parent / f"{log_path.name}_{args.psn_user_id}.log"
+                log_path = log_path.parent / f"{log_path.name}_{log_suffix}.log"
         else:
             if log_path.suffix == "":
-                log_path = Path(f"{log_path.name}_{args.psn_user_id}.log")
+                log_path = Path(f"{log_path.name}_{log_suffix}.log")
         log_path.parent.mkdir(parents=True, exist_ok=True)
         FINAL_LOG_PATH = str(log_path)
         sys.stdout = Logger(FINAL_LOG_PATH)
@@ -2387,24 +6380,77 @@ def main():
     if args.notify_game_change is True:
         GAME_CHANGE_NOTIFICATION = True
 
+    if args.notify_trophies is True:
+        TROPHY_NOTIFICATION = True
+
+    if args.notify_profile is True:
+        PROFILE_CHANGE_NOTIFICATION = True
+
     if args.notify_errors is False:
         ERROR_NOTIFICATION = False
 
     if SMTP_HOST.startswith("your_smtp_server_"):
         ACTIVE_INACTIVE_NOTIFICATION = False
         GAME_CHANGE_NOTIFICATION = False
+        TROPHY_NOTIFICATION = False
+        PROFILE_CHANGE_NOTIFICATION = False
         ERROR_NOTIFICATION = False
 
+    # Config reloads are applied by the monitoring loop, worker processes in supervisor mode do not have a shared one
+    config_reload = bool(CONFIG["path"]) and CONFIG_RELOAD_INTERVAL > 0 and not (multi_user and WORKERS > 1 and not FRIENDS_MODE)
+
+    # In headless mode the startup summary and all later messages except errors and warnings (sent to stderr) are discarded,
+    # liveness checks only print so they are disabled
+    if HEADLESS_MODE:
+        sinks = [name for name, enabled in (("email", ACTIVE_INACTIVE_NOTIFICATION or GAME_CHANGE_NOTIFICATION or TROPHY_NOTIFICATION or PROFILE_CHANGE_NOTIFICATION or ERROR_NOTIFICATION), ("CSV", bool(CSV_FILE)), ("NDJSON", bool(NDJSON_FILE)), ("metrics", bool(METRICS_FILE))) if enabled]
+        print(f"* Headless mode: console output disabled (errors and warnings go to stderr), events go to: {', '.join(sinks) or 'none'}")
+        if not sinks:
+            print("* Warning: no output configured for headless mode, set CSV_FILE, NDJSON_FILE, METRICS_FILE or email notifications")
+        LIVENESS_CHECK_INTERVAL = 0
+        LIVENESS_CHECK_COUNTER = 0
+        sys.stdout = HeadlessOutput()
+
     print(f"* PSN polling intervals:\t[offline: {display_time(PSN_CHECK_INTERVAL)}] [online: {display_time(PSN_ACTIVE_CHECK_INTERVAL)}]")
-    print(f"* Email notifications:\t\t[online/offline status changes = {ACTIVE_INACTIVE_NOTIFICATION}] [game changes = {GAME_CHANGE_NOTIFICATION}]\n*\t\t\t\t[errors = {ERROR_NOTIFICATION}]")
+    print(f"* Adaptive polling:\t\t{ADAPTIVE_POLLING}" + (f" (offline: {display_time(PSN_ACTIVE_CHECK_INTERVAL)} - {display_time(max(PSN_CHECK_INTERVAL, ADAPTIVE_MAX_INTERVAL))})" if ADAPTIVE_POLLING else ""))
+    print(f"* Raw presence client:\t\t{RAW_PRESENCE_CLIENT}" + (f" (JSON decoder: {get_json_loads().__module__})" if RAW_PRESENCE_CLIENT else ""))
+    print(f"* Burst polling:\t\t{BURST_POLLING}" + (f" (from {display_time(BURST_INTERVAL)} over {display_time(BURST_WINDOW)}, budget {BURST_BUDGET_PER_HOUR} extra polls/hour)" if BURST_POLLING else ""))
+    print("* Data refresh intervals:\t" + " ".join(f"[{task['name']}: {display_time(task['interval']()) if task['interval']() > 0 else 'disabled'}]" for task in REFRESH_TASKS))
+    if TROPHY_NOTIFICATION and TROPHIES_REFRESH_INTERVAL <= 0:
+        print("* Warning: trophy notifications need TROPHIES_REFRESH_INTERVAL > 0, earned trophies will not be tracked")
+    if ADAPTIVE_POLLING and not CSV_FILE:
+        print("* Warning: adaptive polling learns from CSV history, without CSV_FILE only status changes observed while running are used")
+    print(f"* Email notifications:\t\t[online/offline status changes = {ACTIVE_INACTIVE_NOTIFICATION}] [game changes = {GAME_CHANGE_NOTIFICATION}]\n*\t\t\t\t[trophies = {TROPHY_NOTIFICATION}] [profile changes = {PROFILE_CHANGE_NOTIFICATION}] [errors = {ERROR_NOTIFICATION}]")
+    print("* PSN API rate limit:\t\t" + (f"{PSN_RATE_LIMIT} calls/min (burst {PSN_RATE_LIMIT_BURST})" if PSN_RATE_LIMIT > 0 else "disabled") + (" per NPSSO credential" if len(get_npsso_codes(PSN_NPSSO)) > 1 else ""))
+    print(f"* NPSSO credentials:\t\t{len(get_npsso_codes(PSN_NPSSO))}")
+    print(f"* PSN retry policy:\t\t[delay: {display_time(RETRY_BASE_DELAY)} - {display_time(RETRY_MAX_DELAY)}] [circuit breaker: " + (f"{CIRCUIT_BREAKER_THRESHOLD} failures, {display_time(CIRCUIT_BREAKER_COOLDOWN)} cooldown]" if CIRCUIT_BREAKER_THRESHOLD > 0 else "disabled]"))
+    if FRIENDS_MODE:
+        print(f"* Friends mode:\t\t\t{FRIENDS_MODE} (filter: {FRIENDS_FILTER or 'none'}, friends list refresh: {display_time(FRIENDS_REFRESH_INTERVAL)}, {FRIENDS_PRESENCE_BATCH} presences per request)")
+    elif multi_user:
+        print("* Worker processes:\t\t" + (f"{WORKERS} (PSN API rate limit split between workers)" if WORKERS > 1 else "disabled"))
+    print("* Lease backend:\t\t" + (f"{LEASE_BACKEND} (node: {get_lease_node_id()}, TTL: {display_time(LEASE_TTL)})" if LEASE_BACKEND else "disabled"))
+    print(f"* Control socket:\t\t{CONTROL_SOCKET or 'disabled'}")
     print(f"* Liveness check:\t\t{bool(LIVENESS_CHECK_INTERVAL)}" + (f" ({display_time(LIVENESS_CHECK_INTERVAL)})" if LIVENESS_CHECK_INTERVAL else ""))
-    print(f"* CSV logging enabled:\t\t{bool(CSV_FILE)}" + (f" ({CSV_FILE})" if CSV_FILE else ""))
+    print(f"* CSV logging enabled:\t\t{bool(CSV_FILE)}" + (f" ({get_user_file_name(CSV_FILE, '<psn_user_id>') if multi_user else CSV_FILE})" if CSV_FILE else ""))
+    print(f"* NDJSON events enabled:\t{bool(NDJSON_FILE)}" + (f" ({NDJSON_FILE})" if NDJSON_FILE else ""))
+    print(f"* Account ID cache file:\t{PSN_ID_CACHE_FILE or 'disabled'}")
+    print(f"* State store file:\t\t{STATE_STORE_FILE or 'disabled (memory only)'}")
+    print(f"* Metrics file enabled:\t\t{bool(METRICS_FILE)}" + (f" ({METRICS_FILE})" if METRICS_FILE else ""))
     print(f"* Output logging enabled:\t{not DISABLE_LOGGING}" + (f" ({FINAL_LOG_PATH})" if not DISABLE_LOGGING else ""))
-    print(f"* Configuration file:\t\t{cfg_path}")
+    print(f"* Configuration file:\t\t{cfg_path}" + (f" (hot reload: every {display_time(CONFIG_RELOAD_INTERVAL)})" if config_reload else ""))
+    if CONFIG["users"]:
+        print(f"* Per-user config overrides:\t{len(CONFIG['users'])} users")
     print(f"* Dotenv file:\t\t\t{env_path or 'None'}")
     print(f"* Local timezone:\t\t{LOCAL_TIMEZONE}")
-
-    out = f"\nMonitoring user with PSN ID {args.psn_user_id}"
+    if PSN_API_BASE_URL:
+        print(f"* PSN API base URL:\t\t{PSN_API_BASE_URL}")
+
+    if FRIENDS_MODE:
+        out = "\nMonitoring friends of the PSN account" + (f" with PSN IDs {', '.join(psn_user_ids[:10])}" + (f" (+{len(psn_user_ids) - 10} more)" if len(psn_user_ids) > 10 else "") if psn_user_ids else "")
+    elif multi_user:
+        users_str = ", ".join(psn_user_ids[:10]) + (f" (+{len(psn_user_ids) - 10} more)" if len(psn_user_ids) > 10 else "")
+        out = f"\nMonitoring {len(psn_user_ids)} users with PSN IDs {users_str}"
+    else:
+        out = f"\nMonitoring user with PSN ID {psn_user_ids[0]}"
     print(out)
     print("─" * len(out))
 
@@ -2416,7 +6462,33 @@ def main():
         signal.signal(signal.SIGABRT, decrease_active_check_signal_handler)
         signal.signal(signal.SIGHUP, reload_secrets_signal_handler)
 
-    psn_monitor_user(args.psn_user_id, CSV_FILE)
+    # Options which differ from the config file now were set by command-line flags or .env, config reloads leave them alone
+    if config_reload:
+        defaults = get_config_defaults()
+        CONFIG["overridden"] = {name for name in defaults if globals()[name] != CONFIG["options"].get(name, defaults[name])}
+        start_config_watcher(cfg_path)
+
+    if CONTROL_SOCKET:
+        try:
+            start_control_server(CONTROL_SOCKET)
+        except Exception as e:
+            print(f"* Error: cannot open control socket: {e}")
+            sys.exit(1)
+
+    # Journal of the state store is flushed to disk on exit (including Ctrl+C), unsynced changes are not lost
+    try:
+        if FRIENDS_MODE:
+            psn_monitor_friends(psn_user_ids)
+        elif multi_user and WORKERS > 1:
+            psn_monitor_supervisor(psn_user_ids, csv_file_names, WORKERS, os.path.expanduser(args.users_file) if args.users_file else "", args.psn_user_id or [])
+        elif multi_user or LEASE_BACKEND:
+            psn_monitor_users(psn_user_ids, csv_file_names)
+        else:
+            psn_monitor_user(psn_user_ids[0], CSV_FILE)
+    finally:
+        state_store_sync(force=True)
+        write_metrics_file(force=True)
+        stop_control_server()
 
     sys.stdout = stdout_bck
     sys.exit(0)
@@ -0,0 +1,56 @@
+import importlib.util
+import io
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import psn_monitor  # noqa: E402
+
+
+def test_headless_output_passes_errors_to_stderr():
+    stream = io.StringIO()
+    out = psn_monitor.HeadlessOutput(stream)
+    print("* PSN polling intervals:\t[offline: 5 min] [online: 3 min]", file=out)
+    print("─" * 20, file=out)
+    print("\n* Error: cannot open control socket: [Errno 2] No such file or directory", file=out)
+    out.write("* Warning: no output configured ")
+    assert stream.getvalue() == "* Error: cannot open control socket: [Errno 2] No such file or directory\n"
+    out.write("for headless mode\n")
+    assert stream.getvalue().endswith("* Warning: no output configured for headless mode\n")
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(importlib.util.find_spec("psnawp_api") is None, reason="PSNAWP is not installed")
+def test_headless_fatal_error_is_visible(tmp_path):
+    port = get_free_port()
+    server = subprocess.Popen([sys.executable, str(ROOT / "tools" / "psn_fake_server.py"), "--port", str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        (tmp_path / "psn_monitor.toml").write_text('LOCAL_TIMEZONE = "UTC"\nPSN_NPSSO = "fake_npsso"\n', encoding="utf-8")
+        result = subprocess.run(
+            [sys.executable, str(ROOT / "psn_monitor.py"), "fake_user_00001", "--config-file", "psn_monitor.toml",
+             "--psn-api-url", f"http://127.0.0.1:{port}", "--headless", "--control-socket", str(tmp_path / "missing" / "ctl.sock")],
+            cwd=tmp_path, capture_output=True, text=True, timeout=120,
+        )
+    finally:
+        server.terminate()
+        server.wait()
+    assert result.returncode == 1
+    assert "* Error: cannot open control socket" in result.stderr
@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+"""
+Author: Michal Szymanski <misiektoja-github@rm-rf.ninja>
+v1.8.2
+
+Local stand-in for the Sony PlayStation (PSN) API used by psn_monitor:
+https://github.com/misiektoja/psn_monitor/
+
+It implements the auth, presence, profile, friendship, trophy and title stats endpoints called by PSNAWP
+and probe_npsso_auth_error(), so the monitor can be exercised offline (integration and load tests).
+
+Start psn_monitor with --psn-api-url http://127.0.0.1:8765 (or PSN_API_BASE_URL) to point it here.
+
+Features:
+- scripted presence timelines per user (loaded from a JSON scenario file) or randomly generated users
+- injected latency, HTTP 429 (with Retry-After), 5xx responses, malformed bodies, expired-token responses and
+  hanging requests (timeout)
+- scheduled fault windows and runtime fault changes via POST /_fake/faults
+- request statistics via GET /_fake/stats
+
+Only Python standard library is required.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Redirect URI used by the PSN Android app, PSNAWP extracts the code from it
+AUTH_REDIRECT_URI = "com.scee.psxandroid.scecompcall://redirect"
+
+# Default fault settings, probabilities are in 0..1 range and latency in milliseconds; timeout_seconds is how long
+# requests hang in "timeout" fault windows
+DEFAULT_FAULTS = {
+    "latency_ms": 0,
+    "latency_jitter_ms": 0,
+    "rate_429": 0.0,
+    "retry_after": 30,
+    "rate_5xx": 0.0,
+    "rate_malformed": 0.0,
+    "rate_expired": 0.0,
+    "npsso_expired": False,
+    "tosua_pending": False,
+    "timeout_seconds": 30,
+    "windows": [],
+}
+
+SAMPLE_GAMES = [
+    ("PPSA01284_00", "Marvel’s Spider-Man 2", "PS5"),
+    ("PPSA01487_00", "ELDEN RING™", "PS5"),
+    ("CUSA07408_00", "Gran Turismo® Sport", "PS4"),
+    ("PPSA02530_00", "Astro’s Playroom", "PS5"),
+    ("CUSA00552_00", "The Last of Us™ Remastered", "PS4"),
+    ("PPSA04264_00", "Helldivers™ 2", "PS5"),
+]
+
+TROPHY_TYPES = ("bronze", "bronze", "bronze", "silver", "silver", "gold", "platinum")
+
+STATE = {
+    "users": {},           # account_id -> user dict
+    "online_ids": {},      # online_id (lowercase) -> account_id
+    "tokens": {},          # access token -> expiry (monotonic), expired tokens are pruned when new ones are issued
+    "refresh_tokens": set(),
+    "faults": dict(DEFAULT_FAULTS),
+    "speed": 1.0,
+    "token_ttl": 3600,
+    "start_mono": time.monotonic(),
+    "start_wall": time.time(),
+    "me_account_id": "1000000000000000001",
+    "rng": random.Random(),
+    "stats": {"requests": 0, "by_endpoint": {}, "by_status": {}, "faults": {}},
+}
+
+LOCK = threading.Lock()
+
+
+# Returns the simulated number of seconds elapsed since the server start
+def sim_now():
+    return (time.monotonic() - STATE["start_mono"]) * STATE["speed"]
+
+
+# Converts simulated offset in seconds to ISO 8601 UTC string as returned by PSN
+def sim_to_iso(offset):
+    wall = STATE["start_wall"] + offset / STATE["speed"]
+    return datetime.fromtimestamp(wall, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+# Increments the counter stored under the given key of the stats dict
+def stat_inc(section, key):
+    with LOCK:
+        if section is None:
+            STATE["stats"][key] = STATE["stats"].get(key, 0) + 1
+            return
+        bucket = STATE["stats"][section]
+        bucket[key] = bucket.get(key, 0) + 1
+
+
+# Normalizes a single user definition coming from the scenario file
+def prepare_user(raw, idx):
+    online_id = str(raw.get("online_id") or f"fake_user_{idx:05d}")
+    account_id = str(raw.get("account_id") or f"{7000000000000000000 + idx}")
+    timeline = sorted(raw.get("timeline") or [{"at": 0, "status": "offline"}], key=lambda e: e.get("at", 0))
+    user = {
+        "online_id": online_id,
+        "account_id": account_id,
+        "timeline": timeline,
+        "loop": raw.get("loop"),
+        "about_me": raw.get("about_me", ""),
+        "is_plus": raw.get("is_plus", False),
+        "languages": raw.get("languages", ["en-US"]),
+        "verified": raw.get("verified", False),
+        "friend": raw.get("friend", True),
+        "trophy_titles": raw.get("trophy_titles") or generate_trophy_titles(account_id),
+    }
+    return user
+
+
+# Generates a deterministic list of trophy titles with earn offsets for the given account
+def generate_trophy_titles(account_id, titles=3, trophies=12):
+    rng = random.Random(account_id)
+    out = []
+    for t in range(titles):
+        title_id, name, plat = SAMPLE_GAMES[(rng.randrange(len(SAMPLE_GAMES)) + t) % len(SAMPLE_GAMES)]
+        items = []
+        for n in range(trophies):
+            earned_at = None
+            roll = rng.random()
+            if roll < 0.4:
+                earned_at = -rng.randrange(86400, 86400 * 90)
+            elif roll < 0.6:
+                earned_at = rng.randrange(60, 7200)
+            items.append({"id": n, "name": f"Trophy {n + 1}", "type": TROPHY_TYPES[n % len(TROPHY_TYPES)], "earned_at": earned_at})
+        out.append({"np_communication_id": f"NPWR{rng.randrange(10000, 99999)}_00", "name": name, "platform": plat, "title_id": title_id, "trophies": items})
+    return out
+
+
+# Generates a random presence timeline lasting roughly the given number of simulated seconds
+def generate_timeline(rng, duration=86400):
+    timeline = []
+    at = 0
+    status = "offline" if rng.random() < 0.7 else "online"
+    while at < duration:
+        entry = {"at": at, "status": status, "platform": rng.choice(["PS5", "PS4"])}
+        if status == "online" and rng.random() < 0.7:
+            title_id, name, plat = rng.choice(SAMPLE_GAMES)
+            entry.update({"game": name, "title_id": title_id, "launch_platform": plat})
+        timeline.append(entry)
+        at += rng.randrange(300, 7200) if status == "online" else rng.randrange(600, 21600)
+        if status == "online" and rng.random() < 0.3:
+            continue
+        status = "online" if status == "offline" else "offline"
+    return timeline
+
+
+# Loads users from scenario data and optionally adds a number of generated users
+def load_users(scenario, generate=0, seed=None):
+    rng = random.Random(seed)
+    raw_users = list(scenario.get("users", []))
+    for n in range(generate):
+        raw_users.append({"online_id": f"fake_user_{n + 1:05d}", "timeline": generate_timeline(rng), "loop": 86400})
+    users = {}
+    online_ids = {}
+    for idx, raw in enumerate(raw_users, 1):
+        user = prepare_user(raw, idx)
+        users[user["account_id"]] = user
+        online_ids[user["online_id"].lower()] = user["account_id"]
+    STATE["users"] = users
+    STATE["online_ids"] = online_ids
+
+
+# Returns the timeline entry active at the simulated time together with the time it started
+def current_entry(user, now=None):
+    now = sim_now() if now is None else now
+    loop = user.get("loop")
+    t = now % loop if loop else now
+    cycle_base = now - t
+    active = user["timeline"][0]
+    for entry in user["timeline"]:
+        if entry.get("at", 0) > t:
+            break
+        active = entry
+    return active, cycle_base + active.get("at", 0)
+
+
+# Builds the basicPresence dict for the given user
+def build_presence(user):
+    entry, since = current_entry(user)
+    status = entry.get("status", "offline")
+    primary = {"onlineStatus": status, "platform": entry.get("platform", "PS5")}
+    presence = {"availability": "unavailable" if status == "offline" else "availableToPlay", "primaryPlatformInfo": primary}
+    if status == "offline":
+        primary["lastOnlineDate"] = sim_to_iso(since)
+    elif entry.get("game"):
+        presence["gameTitleInfoList"] = [{
+            "npTitleId": entry.get("title_id", "PPSA00000_00"),
+            "titleName": entry["game"],
+            "format": entry.get("launch_platform", "PS5"),
+            "launchPlatform": entry.get("launch_platform", "PS5"),
+            "conceptIconUrl": "https://image.api.playstation.com/fake.png",
+        }]
+    return presence
+
+
+# Returns trophies of a title with the earned flag evaluated at the current simulated time
+def evaluate_trophies(title, now=None):
+    now = sim_now() if now is None else now
+    out = []
+    for tr in title["trophies"]:
+        earned_at = tr.get("earned_at")
+        earned = earned_at is not None and earned_at <= now
+        out.append((tr, earned, earned_at if earned else None))
+    return out
+
+
+# Returns trophy counts and the last update offset of a title
+def title_progress(title, now=None):
+    counts = {"bronze": 0, "silver": 0, "gold": 0, "platinum": 0}
+    defined = {"bronze": 0, "silver": 0, "gold": 0, "platinum": 0}
+    last = None
+    for tr, earned, earned_at in evaluate_trophies(title, now):
+        defined[tr["type"]] += 1
+        if earned:
+            counts[tr["type"]] += 1
+            last = earned_at if last is None else max(last, earned_at)
+    total = sum(defined.values()) or 1
+    progress = int(100 * sum(counts.values()) / total)
+    return counts, defined, progress, last
+
+
+# Decides which fault (if any) should be injected for a request
+def pick_fault(endpoint):
+    faults = STATE["faults"]
+    now = sim_now()
+    for win in faults.get("windows") or []:
+        if win.get("from", 0) <= now < win.get("to", float("inf")):
+            eps = win.get("endpoints")
+            if not eps or endpoint in eps:
+                return win.get("kind")
+    if endpoint in ("stats", "faults"):
+        return None
+    rng = STATE["rng"]
+    if rng.random() < faults.get("rate_429", 0):
+        return "429"
+    if rng.random() < faults.get("rate_5xx", 0):
+        return "5xx"
+    if endpoint not in ("authorize", "token") and rng.random() < faults.get("rate_expired", 0):
+        return "expired"
+    if rng.random() < faults.get("rate_malformed", 0):
+        return "malformed"
+    return None
+
+
+class FakePSNHandler(BaseHTTPRequestHandler):
+    server_version = "FakePSN/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent separately, with Nagle's algorithm kept-alive clients would wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    def send_json(self, code, payload, headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(body)
+        stat_inc("by_status", str(code))
+
+    def send_redirect(self, location):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        stat_inc("by_status", "302")
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        parsed = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        body = self.read_body() if method == "POST" else b""
+        for route_method, pattern, endpoint, handler, needs_auth in ROUTES:
+            if route_method != method:
+                continue
+            m = pattern.fullmatch(parsed.path)
+            if not m:
+                continue
+            stat_inc(None, "requests")
+            stat_inc("by_endpoint", endpoint)
+            faults = STATE["faults"]
+            latency = faults.get("latency_ms", 0) + STATE["rng"].uniform(0, faults.get("latency_jitter_ms", 0))
+            if latency > 0 and endpoint not in ("stats", "faults"):
+                time.sleep(latency / 1000.0)
+            fault = pick_fault(endpoint)
+            if fault:
+                stat_inc("faults", fault)
+                if self.inject_fault(fault, endpoint):
+                    return
+            if needs_auth and not self.check_token():
+                return
+            try:
+                handler(self, query=query, body=body, **m.groupdict())
+            except Exception as e:
+                self.send_json(500, {"error": {"code": 500, "message": f"fake server error: {e}"}})
+            return
+        stat_inc("by_endpoint", "unknown")
+        self.send_json(404, {"error": {"code": 2105356, "message": f"Not found: {parsed.path}"}})
+
+    # Returns True if a response was already sent for the fault
+    def inject_fault(self, fault, endpoint):
+        if fault == "429":
+            self.send_json(429, {"error": {"code": 2107392, "message": "Too Many Requests"}}, headers={"Retry-After": STATE["faults"].get("retry_after", 30)})
+            return True
+        if fault == "5xx":
+            code = STATE["rng"].choice([500, 502, 503])
+            self.send_json(code, {"error": {"code": code, "message": "Service Unavailable"}})
+            return True
+        if fault == "expired":
+            self.send_json(401, {"error": {"referenceId": "fake", "source": "token", "code": 2241025, "message": "Invalid token"}})
+            return True
+        if fault == "malformed":
+            variant = STATE["rng"].choice([b"<html>Service Temporarily Unavailable</html>", b"", b'{"basicPresence": []}', b'{"basicPresence": {"primaryPlatformInfo": null}}', b'{"truncated": '])
+            self.send_json(200, variant)
+            return True
+        if fault == "timeout":
+            time.sleep(STATE["faults"].get("timeout_seconds", 30))
+            return False
+        return False
+
+    def check_token(self):
+        auth = self.headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else ""
+        with LOCK:
+            expiry = STATE["tokens"].get(token)
+        if expiry is None or expiry < time.monotonic():
+            self.send_json(401, {"error": {"referenceId": "fake", "source": "token", "code": 2241025, "message": "Invalid token"}})
+            return False
+        return True
+
+    def get_user(self, account_id):
+        if account_id == "me":
+            account_id = STATE["me_account_id"]
+        user = STATE["users"].get(account_id)
+        if not user:
+            self.send_json(404, {"error": {"code": 2105356, "message": f"User not found (user: '{account_id}')"}})
+        return user
+
+
+# ---------- auth ----------
+
+def h_authorize(h, query, body):
+    npsso = ""
+    for part in h.headers.get("Cookie", "").split(";"):
+        k, _, v = part.strip().partition("=")
+        if k == "npsso":
+            npsso = v
+    if STATE["faults"].get("tosua_pending"):
+        h.send_redirect(f"{AUTH_REDIRECT_URI}/?error=access_denied&error_code=103&error_description=ToSUA+re-acceptance+required")
+        return
+    if not npsso or STATE["faults"].get("npsso_expired"):
+        h.send_redirect(f"{AUTH_REDIRECT_URI}/?error=login_required&error_code=4165&error_description=Missing+Authentication+Token")
+        return
+    code = f"fake{STATE['rng'].getrandbits(48):012x}"
+    h.send_redirect(f"{AUTH_REDIRECT_URI}/?code={code}&cid={query.get('cid', '')}")
+
+
+def h_token(h, query, body):
+    form = {k: v[-1] for k, v in parse_qs(body.decode("utf-8", "replace")).items()}
+    grant = form.get("grant_type")
+    if STATE["faults"].get("npsso_expired") or (grant == "refresh_token" and form.get("refresh_token") not in STATE["refresh_tokens"]):
+        h.send_json(400, {"error": "invalid_grant", "error_description": "Invalid refresh token", "error_code": 4159})
+        return
+    if grant not in ("authorization_code", "refresh_token"):
+        h.send_json(400, {"error": "unsupported_grant_type", "error_code": 4158})
+        return
+    rng = STATE["rng"]
+    access = f"at{rng.getrandbits(96):024x}"
+    refresh = form.get("refresh_token") or f"rt{rng.getrandbits(96):024x}"
+    with LOCK:
+        now = time.monotonic()
+        STATE["tokens"] = {token: expiry for token, expiry in STATE["tokens"].items() if expiry >= now}
+        STATE["tokens"][access] = now + STATE["token_ttl"]
+        STATE["refresh_tokens"].add(refresh)
+    h.send_json(200, {
+        "access_token": access,
+        "token_type": "bearer",
+        "expires_in": STATE["token_ttl"],
+        "scope": "psn:mobile.v2.core psn:clientapp",
+        "id_token": "fake.id.token",
+        "refresh_token": refresh,
+        "refresh_token_expires_in": 5183999,
+    })
+
+
+# ---------- profiles & presence ----------
+
+def h_legacy_profile(h, query, body, online_id):
+    account_id = STATE["online_ids"].get(online_id.lower())
+    if not account_id:
+        h.send_json(404, {"error": {"code": 2105356, "message": f"User not found (user: '{online_id}')"}})
+        return
+    user = STATE["users"][account_id]
+    h.send_json(200, {"profile": {"onlineId": user["online_id"], "accountId": account_id, "npId": "ZmFrZQ==", "currentOnlineId": user["online_id"]}})
+
+
+def h_search(h, query, body):
+    try:
+        term = json.loads(body or b"{}").get("searchTerm", "")
+    except ValueError:
+        term = ""
+    results = []
+    account_id = STATE["online_ids"].get(str(term).lower())
+    if account_id:
+        user = STATE["users"][account_id]
+        results.append({"id": account_id, "type": "SocialAllAccountsResult", "socialMetadata": {"accountId": account_id, "onlineId": user["online_id"], "isPsPlus": user["is_plus"], "isVerified": user["verified"]}})
+    h.send_json(200, {"prefix": term, "suggestions": [], "fallbackQueries": [], "domainResponses": [{"domain": "SocialAllAccounts", "results": results, "totalResultCount": len(results)}]})
+
+
+def profile_payload(user):
+    return {
+        "onlineId": user["online_id"],
+        "aboutMe": user["about_me"],
+        "avatars": [{"size": "l", "url": "https://image.api.playstation.com/fake_avatar.png"}],
+        "languages": user["languages"],
+        "isPlus": user["is_plus"],
+        "isOfficiallyVerified": user["verified"],
+        "isMe": False,
+    }
+
+
+def h_profile(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if user:
+        h.send_json(200, profile_payload(user))
+
+
+def h_profiles_bulk(h, query, body):
+    ids = [i for i in query.get("accountIds", "").split(",") if i]
+    h.send_json(200, {"profiles": [profile_payload(STATE["users"][i]) if i in STATE["users"] else None for i in ids]})
+
+
+def h_presence(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if user:
+        h.send_json(200, {"basicPresence": build_presence(user)})
+
+
+def h_presences_bulk(h, query, body):
+    ids = [i for i in query.get("accountIds", "").split(",") if i]
+    out = []
+    for account_id in ids:
+        user = STATE["users"].get(account_id)
+        if user:
+            out.append({"accountId": account_id, **build_presence(user)})
+    h.send_json(200, {"basicPresences": out})
+
+
+def h_friendship(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if user:
+        relation = "friend" if user["friend"] else "no"
+        h.send_json(200, {"friendRelation": relation, "personalDetailSharing": "no", "friendsCount": 42, "mutualFriendsCount": 3 if user["friend"] else -1})
+
+
+def h_friends_list(h, query, body):
+    friends = [a for a, u in STATE["users"].items() if u["friend"]]
+    offset = int(query.get("offset", 0) or 0)
+    limit = int(query.get("limit", 1000) or 1000)
+    page = friends[offset:offset + limit]
+    payload = {"friends": page, "totalItemCount": len(friends)}
+    if offset + limit < len(friends):
+        payload["nextOffset"] = offset + limit
+    h.send_json(200, payload)
+
+
+def h_share(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if user:
+        h.send_json(200, {"shareUrl": f"https://profile.playstation.com/share/{user['online_id']}", "shareImageUrl": "https://image.api.playstation.com/fake_qr.png", "shareImageUrlDestination": ""})
+
+
+# ---------- trophies & title stats ----------
+
+def h_trophy_summary(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if not user:
+        return
+    earned = {"bronze": 0, "silver": 0, "gold": 0, "platinum": 0}
+    for title in user["trophy_titles"]:
+        counts, _, _, _ = title_progress(title)
+        for k, v in counts.items():
+            earned[k] += v
+    total = sum(earned.values())
+    h.send_json(200, {"accountId": user["account_id"], "trophyLevel": 100 + total, "progress": (total * 7) % 100, "tier": 2, "earnedTrophies": earned})
+
+
+def trophy_title_payload(title):
+    counts, defined, progress, last = title_progress(title)
+    return {
+        "npServiceName": "trophy2" if title["platform"] == "PS5" else "trophy",
+        "npCommunicationId": title["np_communication_id"],
+        "trophySetVersion": "01.00",
+        "trophyTitleName": title["name"],
+        "trophyTitleIconUrl": "https://image.api.playstation.com/fake_trophy.png",
+        "trophyTitlePlatform": title["platform"],
+        "hasTrophyGroups": False,
+        "definedTrophies": defined,
+        "progress": progress,
+        "earnedTrophies": counts,
+        "hiddenFlag": False,
+        "lastUpdatedDateTime": sim_to_iso(last if last is not None else -86400 * 365),
+    }
+
+
+def h_trophy_titles(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if not user:
+        return
+    titles = sorted((trophy_title_payload(t) for t in user["trophy_titles"]), key=lambda t: t["lastUpdatedDateTime"], reverse=True)
+    offset = int(query.get("offset", 0) or 0)
+    limit = int(query.get("limit", 100) or 100)
+    payload = {"trophyTitles": titles[offset:offset + limit], "totalItemCount": len(titles)}
+    if offset + limit < len(titles):
+        payload["nextOffset"] = offset + limit
+    h.send_json(200, payload)
+
+
+def find_title(user, npcomm):
+    for title in user["trophy_titles"]:
+        if title["np_communication_id"] == npcomm:
+            return title
+    return None
+
+
+def h_title_trophies(h, query, body, npcomm, group):
+    for user in STATE["users"].values():
+        title = find_title(user, npcomm)
+        if title:
+            trophies = [{"trophyId": tr["id"], "trophyHidden": False, "trophyType": tr["type"], "trophyName": tr["name"], "trophyDetail": f"Earn {tr['name']}", "trophyIconUrl": "https://image.api.playstation.com/fake_trophy.png", "trophyGroupId": "default"} for tr in title["trophies"]]
+            h.send_json(200, {"trophySetVersion": "01.00", "hasTrophyGroups": False, "trophies": trophies, "totalItemCount": len(trophies)})
+            return
+    h.send_json(404, {"error": {"code": 2240525, "message": "Resource not found"}})
+
+
+def h_user_title_trophies(h, query, body, account_id, npcomm, group):
+    user = h.get_user(account_id)
+    if not user:
+        return
+    title = find_title(user, npcomm)
+    if not title:
+        h.send_json(404, {"error": {"code": 2240525, "message": "Resource not found"}})
+        return
+    trophies = []
+    for tr, earned, earned_at in evaluate_trophies(title):
+        item = {"trophyId": tr["id"], "trophyHidden": False, "earned": earned, "trophyType": tr["type"], "trophyRare": 2, "trophyEarnedRate": "12.5"}
+        if earned:
+            item["earnedDateTime"] = sim_to_iso(earned_at)
+        trophies.append(item)
+    h.send_json(200, {"trophySetVersion": "01.00", "hasTrophyGroups": False, "lastUpdatedDateTime": trophy_title_payload(title)["lastUpdatedDateTime"], "trophies": trophies, "totalItemCount": len(trophies)})
+
+
+def h_user_trophy_groups(h, query, body, account_id, npcomm):
+    user = h.get_user(account_id)
+    if not user:
+        return
+    title = find_title(user, npcomm)
+    if not title:
+        h.send_json(404, {"error": {"code": 2240525, "message": "Resource not found"}})
+        return
+    payload = trophy_title_payload(title)
+    payload["trophyGroups"] = [{"trophyGroupId": "default", "trophyGroupName": title["name"], "progress": payload["progress"], "earnedTrophies": payload["earnedTrophies"]}]
+    h.send_json(200, payload)
+
+
+def h_title_stats(h, query, body, account_id):
+    user = h.get_user(account_id)
+    if not user:
+        return
+    titles = []
+    seen = set()
+    for entry in reversed(user["timeline"]):
+        if not entry.get("game") or entry.get("title_id") in seen:
+            continue
+        seen.add(entry.get("title_id"))
+        titles.append({
+            "titleId": entry.get("title_id"),
+            "name": entry["game"],
+            "localizedName": entry["game"],
+            "imageUrl": "https://image.api.playstation.com/fake.png",
+            "category": "ps5_native_game" if entry.get("launch_platform", "PS5") == "PS5" else "ps4_game",
+            "service": "none_purchased",
+            "playCount": 3,
+            "concept": {"id": 10000000 + len(titles), "titleIds": [entry.get("title_id")], "name": entry["game"]},
+            "firstPlayedDateTime": sim_to_iso(-86400 * 30),
+            "lastPlayedDateTime": sim_to_iso(entry.get("at", 0)),
+            "playDuration": "PT12H34M56S",
+        })
+    offset = int(query.get("offset", 0) or 0)
+    limit = int(query.get("limit", 200) or 200)
+    h.send_json(200, {"titles": titles[offset:offset + limit], "totalItemCount": len(titles)})
+
+
+# ---------- fake server control ----------
+
+def h_stats(h, query, body):
+    with LOCK:
+        stats = json.loads(json.dumps(STATE["stats"]))
+    stats["sim_time"] = round(sim_now(), 3)
+    stats["users"] = len(STATE["users"])
+    stats["faults_config"] = STATE["faults"]
+    h.send_json(200, stats)
+
+
+def h_faults(h, query, body):
+    try:
+        changes = json.loads(body or b"{}")
+        if not isinstance(changes, dict):
+            raise ValueError("expected a JSON object")
+    except ValueError as e:
+        h.send_json(400, {"error": str(e)})
+        return
+    with LOCK:
+        if changes.pop("reset", False):
+            STATE["faults"] = dict(DEFAULT_FAULTS)
+        STATE["faults"].update(changes)
+    h.send_json(200, STATE["faults"])
+
+
+def h_index(h, query, body):
+    h.send_json(200, {"server": "fake psn", "users": len(STATE["users"])})
+
+
+PROFILE = r"/api/userProfile/v1/internal/users"
+# PSNAWP 3.x fetches presences from the v2 profile API (bulk requests with a double slash before basicPresences)
+PROFILE_V2 = r"/api/userProfile/v2/internal/users"
+TROPHY = r"/api/trophy/v1"
+
+# (method, path regex, endpoint name used in stats/faults, handler, requires bearer token)
+ROUTES = [
+    ("GET", re.compile(r"/api/authz/v3/oauth/authorize"), "authorize", h_authorize, False),
+    ("POST", re.compile(r"/api/authz/v3/oauth/token"), "token", h_token, False),
+    ("GET", re.compile(r"/userProfile/v1/users/(?P<online_id>[^/]+)/profile2"), "legacy_profile", h_legacy_profile, True),
+    ("POST", re.compile(r"/api/search/v1/universalSearch"), "search", h_search, True),
+    ("GET", re.compile(PROFILE + r"/basicPresences"), "presences_bulk", h_presences_bulk, True),
+    ("GET", re.compile(PROFILE_V2 + r"/+basicPresences"), "presences_bulk", h_presences_bulk, True),
+    ("GET", re.compile(PROFILE + r"/profiles"), "profiles_bulk", h_profiles_bulk, True),
+    ("GET", re.compile(PROFILE + r"/me/friends"), "friends_list", h_friends_list, True),
+    ("GET", re.compile(PROFILE + r"/me/friends/(?P<account_id>[^/]+)/summary"), "friendship", h_friendship, True),
+    ("GET", re.compile(PROFILE + r"/(?P<account_id>[^/]+)/basicPresences"), "presence", h_presence, True),
+    ("GET", re.compile(PROFILE_V2 + r"/(?P<account_id>[^/]+)/basicPresences"), "presence", h_presence, True),
+    ("GET", re.compile(PROFILE + r"/(?P<account_id>[^/]+)/profiles"), "profile", h_profile, True),
+    ("GET", re.compile(r"/api/cpss/v1/share/profile/(?P<account_id>[^/]+)"), "share", h_share, True),
+    ("GET", re.compile(TROPHY + r"/users/(?P<account_id>[^/]+)/trophySummary"), "trophy_summary", h_trophy_summary, True),
+    ("GET", re.compile(TROPHY + r"/users/(?P<account_id>[^/]+)/trophyTitles"), "trophy_titles", h_trophy_titles, True),
+    ("GET", re.compile(TROPHY + r"/users/(?P<account_id>[^/]+)/npCommunicationIds/(?P<npcomm>[^/]+)/trophyGroups/(?P<group>[^/]+)/trophies"), "user_trophies", h_user_title_trophies, True),
+    ("GET", re.compile(TROPHY + r"/users/(?P<account_id>[^/]+)/npCommunicationIds/(?P<npcomm>[^/]+)/trophyGroups"), "user_trophy_groups", h_user_trophy_groups, True),
+    ("GET", re.compile(TROPHY + r"/npCommunicationIds/(?P<npcomm>[^/]+)/trophyGroups/(?P<group>[^/]+)/trophies"), "title_trophies", h_title_trophies, True),
+    ("GET", re.compile(r"/api/gamelist/v2/users/(?P<account_id>[^/]+)/titles"), "title_stats", h_title_stats, True),
+    ("GET", re.compile(r"/_fake/stats"), "stats", h_stats, False),
+    ("POST", re.compile(r"/_fake/faults"), "faults", h_faults, False),
+    ("GET", re.compile(r"/"), "index", h_index, False),
+]
+
+
+# Creates the fake server (not started yet), used directly by the benchmark suite
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, scenario=None, generate_users=0, seed=None, speed=1.0, token_ttl=3600, faults=None, verbose=False):
+    STATE["rng"] = random.Random(seed)
+    STATE["speed"] = float(speed) if speed and speed > 0 else 1.0
+    STATE["token_ttl"] = int(token_ttl)
+    STATE["faults"] = dict(DEFAULT_FAULTS)
+    STATE["faults"].update((scenario or {}).get("faults", {}))
+    STATE["faults"].update(faults or {})
+    STATE["tokens"] = {}
+    STATE["refresh_tokens"] = set()
+    STATE["stats"] = {"requests": 0, "by_endpoint": {}, "by_status": {}, "faults": {}}
+    load_users(scenario or {}, generate=generate_users, seed=seed)
+    STATE["start_mono"] = time.monotonic()
+    STATE["start_wall"] = time.time()
+    server = ThreadingHTTPServer((host, port), FakePSNHandler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+
+# Starts the fake server in a background thread and returns it together with its base URL
+def start_background(**kwargs):
+    server = create_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="fake-psn", daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="psn_fake_server",
+        description="Local fake PSN API server for offline integration and load tests of psn_monitor", formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--scenario", metavar="JSON_FILE", help="Scenario file with users, presence timelines and faults")
+    parser.add_argument("--generate-users", dest="generate_users", type=int, default=0, metavar="N", help="Add N users with random presence timelines")
+    parser.add_argument("--seed", type=int, help="Random seed for generated users and injected faults")
+    parser.add_argument("--speed", type=float, default=1.0, help="Simulated clock speed multiplier for timelines (default: 1.0)")
+    parser.add_argument("--token-ttl", dest="token_ttl", type=int, default=3600, metavar="SECONDS", help="Access token lifetime (default: 3600)")
+    parser.add_argument("--latency", type=int, metavar="MS", help="Added latency per request")
+    parser.add_argument("--latency-jitter", dest="latency_jitter", type=int, metavar="MS", help="Random extra latency per request")
+    parser.add_argument("--rate-429", dest="rate_429", type=float, metavar="P", help="Probability of HTTP 429 responses")
+    parser.add_argument("--retry-after", dest="retry_after", type=int, metavar="SECONDS", help="Retry-After value sent with 429 responses (default: 30)")
+    parser.add_argument("--rate-5xx", dest="rate_5xx", type=float, metavar="P", help="Probability of HTTP 5xx responses")
+    parser.add_argument("--rate-malformed", dest="rate_malformed", type=float, metavar="P", help="Probability of malformed response bodies")
+    parser.add_argument("--rate-expired", dest="rate_expired", type=float, metavar="P", help="Probability of expired-token (401) responses")
+    parser.add_argument("--npsso-expired", dest="npsso_expired", action="store_true", default=None, help="Reject all logins and refreshes as with an expired NPSSO")
+    parser.add_argument("--tosua", action="store_true", default=None, help="Reject logins with a pending ToSUA re-acceptance error")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request to stderr")
+    args = parser.parse_args()
+
+    scenario = {}
+    if args.scenario:
+        try:
+            with open(args.scenario, "r", encoding="utf-8") as f:
+                scenario = json.load(f)
+        except Exception as e:
+            print(f"* Error loading scenario file '{args.scenario}': {e}")
+            sys.exit(1)
+
+    faults = {
+        "latency_ms": args.latency,
+        "latency_jitter_ms": args.latency_jitter,
+        "rate_429": args.rate_429,
+        "retry_after": args.retry_after,
+        "rate_5xx": args.rate_5xx,
+        "rate_malformed": args.rate_malformed,
+        "rate_expired": args.rate_expired,
+        "npsso_expired": args.npsso_expired,
+        "tosua_pending": args.tosua,
+    }
+    faults = {k: v for k, v in faults.items() if v is not None}
+
+    if not scenario.get("users") and not args.generate_users:
+        args.generate_users = 1
+
+    server = create_server(args.host, args.port, scenario=scenario, generate_users=args.generate_users, seed=args.seed, speed=args.speed, token_ttl=args.token_ttl, faults=faults, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    print(f"* Fake PSN API listening on http://{host}:{port} ({len(STATE['users'])} users)")
+    for user in list(STATE["users"].values())[:10]:
+        print(f"- {user['online_id']} ({user['account_id']})")
+    if len(STATE["users"]) > 10:
+        print(f"- ... and {len(STATE['users']) - 10} more")
+    print(f"\n* Run the monitor with: psn_monitor <psn_user_id> -n fake_npsso --psn-api-url http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n* Fake PSN API terminated")
+
+
+if __name__ == "__main__":
+    main()